@@ -0,0 +1,195 @@
+import math
+import time
+import threading
+
+# cost class -> concurrency cap and per-client token bucket (refill per second, burst)
+DEFAULT_CLASSES = {
+    "sign": {"concurrency": 8, "rate": 2.0, "burst": 20},
+    "keygen": {"concurrency": 4, "rate": 1.0, "burst": 10},
+    "keygen_heavy": {"concurrency": 2, "rate": 0.2, "burst": 3},
+    "batch": {"concurrency": 1, "rate": 0.02, "burst": 1},
+    "verify": {"concurrency": 2, "rate": 0.5, "burst": 10},
+}
+# keygen algorithms that cost an order of magnitude more than the rest
+DEFAULT_HEAVY_ALGORITHMS = ("rsa4096", "mldsa87")
+
+
+class Rejected(Exception):
+    """Admission refused: `status` is 429 (client over its rate) or 503 (class at capacity)."""
+
+    def __init__(self, status, cost_class, retry_after, reason):
+        super().__init__(reason)
+        self.status = status
+        self.cost_class = cost_class
+        self.retry_after = retry_after
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst, now):
+        self.tokens = float(burst)
+        self.updated = now
+
+
+class Ticket:
+    """Slots held by one admitted request; `release()` may be called more than once."""
+
+    def __init__(self, controller, cost_class, algorithm):
+        self.controller = controller
+        self.cost_class = cost_class
+        self.algorithm = algorithm
+        self.started = time.perf_counter()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.controller._release(self)
+
+
+class AdmissionController:
+    """
+    Admission of expensive requests by cost class (operation x algorithm).
+
+    Each class has a concurrency cap and a per-client token bucket, and
+    keygen algorithms can carry their own cap on top. All classes together
+    never take more than `workers - reserved` request threads, so CA
+    certificate, CRL and key downloads and OCSP (which are never classified)
+    always find a free thread. A request over its client's rate gets 429, a
+    request finding its class full gets 503, both with a Retry-After from
+    the bucket refill time or the class's recent service time.
+    """
+
+    def __init__(self, workers=16, reserved=4, classes=None, heavy_algorithms=DEFAULT_HEAVY_ALGORITHMS,
+                 algorithm_limits=None, max_wait=0.0, max_clients=10000):
+        self.workers = workers
+        self.reserved = reserved
+        self.classes = {name: dict(limits) for name, limits in DEFAULT_CLASSES.items()}
+        for name, limits in (classes or {}).items():
+            self.classes.setdefault(name, {}).update(limits)
+        self.heavy_algorithms = set(heavy_algorithms)
+        self.algorithm_limits = algorithm_limits or {}
+        self.max_wait = max_wait
+        self.max_clients = max_clients
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._in_flight = {name: 0 for name in self.classes}
+        self._algorithms = {}
+        self._service = {name: None for name in self.classes}  # EWMA of seconds per request
+        self._decisions = {name: {"admitted": 0, "throttled": 0, "shed": 0} for name in self.classes}
+
+    @property
+    def capacity(self):
+        return max(1, self.workers - self.reserved)
+
+    def classify(self, operation, algorithm=None, pooled=False):
+        """Cost class of `operation`; a keygen served from the key pool costs no more than signing."""
+        if operation == "keygen":
+            if pooled:
+                return "sign"
+            return "keygen_heavy" if algorithm in self.heavy_algorithms else "keygen"
+        return operation
+
+    # -- admission ------------------------------------------------------------
+    def _take_token(self, cost_class, client, now):
+        limits = self.classes[cost_class]
+        rate, burst = limits.get("rate"), limits.get("burst")
+        if not rate:
+            return 0.0
+        key = (client, cost_class)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._prune(now)
+            bucket = self._buckets[key] = _Bucket(burst, now)
+        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+        bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / rate
+
+    def _refund(self, cost_class, client):
+        bucket = self._buckets.get((client, cost_class))
+        if bucket is not None:
+            bucket.tokens = min(self.classes[cost_class]["burst"], bucket.tokens + 1)
+
+    def _prune(self, now):
+        """Drop buckets that have refilled completely (their clients went quiet)."""
+        for key, bucket in list(self._buckets.items()):
+            limits = self.classes[key[1]]
+            if bucket.tokens + (now - bucket.updated) * limits["rate"] >= limits["burst"]:
+                del self._buckets[key]
+
+    def _has_slot(self, cost_class, algorithm):
+        if sum(self._in_flight.values()) >= self.capacity:
+            return False
+        if self._in_flight[cost_class] >= self.classes[cost_class].get("concurrency", self.capacity):
+            return False
+        limit = self.algorithm_limits.get(algorithm)
+        return limit is None or self._algorithms.get(algorithm, 0) < limit
+
+    def _retry_after(self, cost_class):
+        service = self._service[cost_class] or 1.0
+        return service * max(1, self._in_flight[cost_class]) / max(1, self.classes[cost_class].get("concurrency", 1))
+
+    def admit(self, cost_class, client, algorithm=None, slot=True):
+        """
+        Charge `client`'s bucket and take a slot of `cost_class` (unless `slot`
+        is False, e.g. for work handed to the job queue). Raises `Rejected`.
+        """
+        with self._cond:
+            now = time.monotonic()
+            wait = self._take_token(cost_class, client, now)
+            if wait:
+                self._decisions[cost_class]["throttled"] += 1
+                raise Rejected(429, cost_class, math.ceil(wait), f"Rate limit exceeded for {cost_class} requests")
+            if not slot:
+                self._decisions[cost_class]["admitted"] += 1
+                return None
+            deadline = now + self.max_wait
+            while not self._has_slot(cost_class, algorithm):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._refund(cost_class, client)
+                    self._decisions[cost_class]["shed"] += 1
+                    raise Rejected(503, cost_class, math.ceil(self._retry_after(cost_class)),
+                                   f"No capacity for {cost_class} requests")
+                self._cond.wait(remaining)
+            self._in_flight[cost_class] += 1
+            if algorithm is not None:
+                self._algorithms[algorithm] = self._algorithms.get(algorithm, 0) + 1
+            self._decisions[cost_class]["admitted"] += 1
+        return Ticket(self, cost_class, algorithm)
+
+    def _release(self, ticket):
+        elapsed = time.perf_counter() - ticket.started
+        with self._cond:
+            self._in_flight[ticket.cost_class] -= 1
+            if ticket.algorithm is not None:
+                self._algorithms[ticket.algorithm] -= 1
+            previous = self._service[ticket.cost_class]
+            self._service[ticket.cost_class] = elapsed if previous is None else 0.8 * previous + 0.2 * elapsed
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "workers": self.workers,
+                "reserved": self.reserved,
+                "capacity": self.capacity,
+                "in_flight": sum(self._in_flight.values()),
+                "clients": len({client for client, _ in self._buckets}),
+                "classes": {
+                    name: dict(
+                        limits, in_flight=self._in_flight[name],
+                        service_seconds=self._service[name], **self._decisions[name],
+                    )
+                    for name, limits in self.classes.items()
+                },
+                "algorithms": {
+                    algorithm: {"in_flight": self._algorithms.get(algorithm, 0), "limit": limit}
+                    for algorithm, limit in self.algorithm_limits.items()
+                },
+            }
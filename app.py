@@ -1,35 +1,152 @@
-from flask import Flask, request, abort, render_template, jsonify, send_file
+from flask import Flask, Response, g, request, abort, render_template, jsonify, send_file, url_for, stream_with_context
 import os
+import sys
+import json
+import subprocess
+import hmac
+import base64
 import shutil
+import tarfile
 import tempfile
+import importlib
 import uuid
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
-from zipfile import ZipFile
+from itertools import islice
+from urllib.parse import unquote
+from zipfile import ZipFile, ZIP_DEFLATED, is_zipfile
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import Encoding
+from werkzeug.exceptions import HTTPException
 from werkzeug.utils import secure_filename
 
+import pkiCrypto
 from pkiCrypto import (
     generate_private_key,
     generate_csr,
-    sign_certificate,
-    create_certificate_chain,
     get_ca_certificate_details,
     get_crl_details,
-    convert_certificate_to_der,
+    openssl_stats,
+    generate_private_key_pem,
+    generate_csr_pem,
 )
+from certFormats import FormatEngine, FORMATS
+from caEngine import SigningEngine, serial_to_hex
+from caState import CAState
+from caRegistry import CARegistry
+from keyPool import KeyPool
+from ocspResponder import OCSPResponder
+from pkiCache import ArtifactCache
+from crlManager import CRLManager, delta_crl_path
+from crlIndex import CRLIndex
+from certInventory import CertificateInventory
+from jobQueue import JobQueue, QueueFull
+from issuanceStore import IssuanceStore, StoreFull
+from admission import AdmissionController, Rejected
+from csrPolicy import CSRValidator, CSRRejected, IssuedCache, REASONS as CSR_REJECT_REASONS
+from chainValidator import ChainValidator, iter_certificates, STATUSES as CHAIN_STATUSES, SIGNATURE_METHODS
+from retention import RetentionSweeper, secure_delete
+from publisher import StaticPublisher
+from opensslPool import OpenSSLWorkerPool
+from pkiMetrics import Metrics
 from config import Config
 
 # -----------------------------------------------------------------------------
 # App & config
 # -----------------------------------------------------------------------------
 logging.basicConfig(level=logging.INFO)
+metrics = Metrics()
 
 app = Flask(__name__, static_url_path="/static")
 app.config.from_object(Config)
 Config.validate()
 
 openssl = app.config["OPENSSL"]
-OQS_CONF = "/opt/pki-file/oqs.cnf"
+pkiCrypto.OPENSSL_TIMEOUT = app.config.get("OPENSSL_TIMEOUT", pkiCrypto.OPENSSL_TIMEOUT)
+openssl_pool = OpenSSLWorkerPool(
+    openssl,
+    pkiCrypto.WORKER_ENVS,
+    size=app.config.get("OPENSSL_POOL_SIZE", 2),
+    timeout=pkiCrypto.OPENSSL_TIMEOUT,
+    health_interval=app.config.get("OPENSSL_POOL_HEALTH_INTERVAL", 30),
+    libcrypto=app.config.get("OPENSSL_LIBCRYPTO"),
+)
+if app.config.get("OPENSSL_POOL_ENABLED", True):
+    openssl_pool.start()
+    pkiCrypto.set_worker_pool(openssl_pool)
+signer = SigningEngine(
+    openssl,
+    ca_state=(lambda ctx: CAState(
+        ctx,
+        lease_size=app.config.get("CA_SERIAL_LEASE_SIZE", 32),
+        stale_after=app.config.get("CA_LEASE_STALE_AFTER", 300),
+    )) if app.config.get("CA_STATE_ENABLED", False) else None,
+)
+keypool = KeyPool(
+    openssl,
+    app.config.get("KEYPOOL_DIR", os.path.join(app.config["TEMP_KEY_DIR"], ".keypool")),
+    low=app.config.get("KEYPOOL_LOW", 2),
+    high=app.config.get("KEYPOOL_HIGH", 5),
+    workers=app.config.get("KEYPOOL_WORKERS", 2),
+    pools=app.config.get("KEYPOOL_POOLS"),
+    backoff=app.config.get("KEYPOOL_BACKOFF", 30),
+    max_failures=app.config.get("KEYPOOL_MAX_FAILURES", 5),
+)
+if app.config.get("KEYPOOL_ENABLED", True):
+    keypool.start()
+ocsp_responder = OCSPResponder(
+    openssl,
+    validity=app.config.get("OCSP_VALIDITY", 86400),
+    refresh_interval=app.config.get("OCSP_REFRESH_INTERVAL", 30),
+    pool=openssl_pool if app.config.get("OPENSSL_POOL_ENABLED", True) else None,
+    batch=app.config.get("OCSP_PRESIGN_BATCH", 64),
+)
+artifact_cache = ArtifactCache()
+formats = FormatEngine(openssl, max_bytes=app.config.get("FORMAT_CACHE_BYTES", 8 * 1024 * 1024))
+inventory = CertificateInventory(
+    app.config.get("INVENTORY_DB", os.path.join(app.config["CERTS_DIR"], "inventory.db"))
+)
+crl_manager = CRLManager(
+    openssl,
+    base_interval=app.config.get("CRL_BASE_INTERVAL", 86400),
+    delta_url=app.config.get("CRL_DELTA_URL"),
+)
+batch_executor = ThreadPoolExecutor(
+    max_workers=app.config.get("BATCH_WORKERS", 4), thread_name_prefix="batch"
+)
+job_queue = JobQueue(
+    workers=app.config.get("JOB_WORKERS", 4),
+    limits=app.config.get("JOB_ALGORITHM_LIMITS"),
+    default_limit=app.config.get("JOB_DEFAULT_LIMIT", 2),
+    ttl=app.config.get("JOB_TTL", 3600),
+    max_pending=app.config.get("JOB_QUEUE_MAX", 100),
+)
+issuance_store = IssuanceStore(
+    ttl=app.config.get("ISSUANCE_STORE_TTL", 900),
+    max_entries=app.config.get("ISSUANCE_STORE_MAX", 1000),
+)
+csr_validator = CSRValidator(
+    openssl,
+    algorithms=app.config.get("CSR_ALLOWED_ALGORITHMS"),
+    max_san=app.config.get("CSR_MAX_SAN", 16),
+    allow_wildcards=app.config.get("CSR_ALLOW_WILDCARDS", False),
+)
+issued_cache = IssuedCache(
+    ttl=app.config.get("CSR_IDEMPOTENCY_TTL", 600),
+    max_entries=app.config.get("CSR_IDEMPOTENCY_MAX", 10000),
+)
+admission = AdmissionController(
+    workers=app.config.get("ADMISSION_WORKERS", 16),
+    reserved=app.config.get("ADMISSION_RESERVED", 4),
+    classes=app.config.get("ADMISSION_CLASSES"),
+    heavy_algorithms=app.config.get("ADMISSION_HEAVY_ALGORITHMS", ("rsa4096", "mldsa87")),
+    algorithm_limits=app.config.get("ADMISSION_ALGORITHM_LIMITS", app.config.get("JOB_ALGORITHM_LIMITS")),
+    max_wait=app.config.get("ADMISSION_MAX_WAIT", 0.0),
+)
 
 
 # -----------------------------------------------------------------------------
@@ -46,6 +163,26 @@ def _tmpdir(prefix: str) -> str:
 def _safe_name(name: str, fallback: str) -> str:
     return secure_filename(name) or fallback
 
+def _pem_to_der(pem: bytes) -> bytes:
+    """DER encoding of every certificate in a PEM bundle, concatenated."""
+    return b"".join(c.public_bytes(Encoding.DER) for c in x509.load_pem_x509_certificates(pem))
+
+class _ZipStream:
+    """Write-only sink for ZipFile that hands finished bytes to a generator."""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
 # -----------------------------------------------------------------------------
 # Path mappers (centralize all directory/file names; logic unchanged)
 # -----------------------------------------------------------------------------
@@ -182,6 +319,254 @@ def issued_certs_dir_for(pki: str, ca: str) -> str:
         return os.path.join(base, "qubip-tls-ca", "newcerts")
     abort(404, "CA not found")
 
+def issuing_cas():
+    """Issuing CA name for each chain."""
+    return {
+        "certs": app.config["TLS_CA"],
+        "pki-65": app.config["MPU_CA"],
+        "pki-44": app.config["MCU_CA"],
+    }
+
+def _issuing_ca_paths():
+    return {chain: (ca, chain_issue_paths(chain)) for chain, ca in issuing_cas().items()}
+
+def _reload_config():
+    """Re-import the config module; app.config only changes if it validates."""
+    module = importlib.reload(sys.modules[Config.__module__])
+    module.Config.validate()
+    app.config.from_object(module.Config)
+
+def _on_ca_loaded(chain, ca, ctx):
+    ocsp_responder.register(ca, ctx)
+    crl_manager.register(chain, ca, ctx, ca_crl_path(chain, ca))
+    artifact_cache.invalidate(chain, ca)
+
+ca_registry = CARegistry(
+    signer, openssl, _issuing_ca_paths,
+    reload_config=_reload_config if app.config.get("CONFIG_RELOAD_ENABLED", True) else None,
+    config_file=sys.modules[Config.__module__].__file__,
+)
+ca_registry.subscribe(_on_ca_loaded)
+
+def _on_crl_event(event, chain, ca, detail):
+    if event == "revoked":
+        inventory.record_revoked(ca, detail)
+        issued_cache.discard_serial(detail)
+        ocsp_responder.refresh(ca, [detail])
+    else:
+        artifact_cache.invalidate(chain, ca)
+
+def backfill_inventory():
+    for chain, ctx in ca_registry.contexts().items():
+        try:
+            inventory.backfill(chain, issuing_cas()[chain], ctx.database, ctx.new_certs_dir)
+        except Exception as e:
+            logging.error(f"Inventory backfill failed for {chain}: {e!r}")
+
+ca_registry.load()
+if app.config.get("CA_RELOAD_ENABLED", True):
+    ca_registry.start(app.config.get("CA_RELOAD_INTERVAL", 10))
+signer.start(app.config.get("CA_STATE_MERGE_INTERVAL", 5))
+crl_manager.subscribe(_on_crl_event)
+if app.config.get("OCSP_ENABLED", True):
+    ocsp_responder.start()
+if app.config.get("CRL_ENABLED", True):
+    crl_manager.start()
+threading.Thread(target=backfill_inventory, name="inventory-backfill", daemon=True).start()
+
+retention = RetentionSweeper(
+    app.config["TEMP_KEY_DIR"],
+    [issued_certs_dir_for(chain, ca) for chain, ca in issuing_cas().items()],
+    key_ttl=app.config.get("TEMP_KEY_TTL", 86400),
+    csr_ttl=app.config.get("CSR_TTL", 3600),
+    archive_after=app.config.get("ARCHIVE_AFTER_DAYS", 30) * 86400,
+    segment_bytes=app.config.get("ARCHIVE_SEGMENT_BYTES", 64 * 1024 * 1024),
+)
+if app.config.get("RETENTION_ENABLED", True):
+    retention.start(app.config.get("RETENTION_INTERVAL", 3600))
+
+def _trust_paths():
+    """Chain file and root/issuing CA base and delta CRLs of every chain, for batch chain validation."""
+    return {
+        chain: (
+            [chain_issue_paths(chain)["ca_chain"]],
+            [path for ca in ("qubip-root-ca", issuing)
+             for path in (ca_crl_path(chain, ca), delta_crl_path(ca_crl_path(chain, ca)))],
+        )
+        for chain, issuing in issuing_cas().items()
+    }
+
+chain_validator = ChainValidator(
+    openssl, _trust_paths,
+    # started on first use
+    pool=OpenSSLWorkerPool(
+        openssl, pkiCrypto.WORKER_ENVS, size=app.config.get("CHAIN_VERIFY_WORKERS", 2),
+        timeout=pkiCrypto.OPENSSL_TIMEOUT,
+        health_interval=app.config.get("OPENSSL_POOL_HEALTH_INTERVAL", 30),
+        libcrypto=app.config.get("OPENSSL_LIBCRYPTO"),
+    ) if app.config.get("CHAIN_VERIFY_POOL_ENABLED", True) else None,
+    workers=app.config.get("CHAIN_VERIFY_THREADS", 4),
+    chunk=app.config.get("CHAIN_VERIFY_CHUNK", 64),
+    check_interval=app.config.get("TRUST_STORE_CHECK_INTERVAL", 5),
+)
+crl_manager.subscribe(lambda event, chain, ca, detail: chain_validator.store.invalidate())
+
+# -----------------------------------------------------------------------------
+# Metrics (gauges and externally kept counters are read at scrape time)
+# -----------------------------------------------------------------------------
+def _openssl_ops(field):
+    return lambda: [((op,), e[field]) for op, e in openssl_stats()["operations"].items()]
+
+def _pool_jobs():
+    return [((group, op), e["count"]) for group, s in openssl_pool.stats().items() for op, e in s["jobs"].items()]
+
+metrics.collected_counter("pki_openssl_spawns_total", "openssl processes started, by operation.", ("op",), _openssl_ops("spawns"))
+metrics.collected_counter("pki_openssl_errors_total", "openssl processes that failed or timed out.", ("op",), _openssl_ops("errors"))
+metrics.collected_counter("pki_openssl_seconds_total", "Wall time spent in openssl processes.", ("op",), _openssl_ops("total_seconds"))
+metrics.collected_counter("pki_openssl_worker_jobs_total", "Jobs run by pooled OpenSSL workers.", ("group", "op"), _pool_jobs)
+metrics.collected_counter("pki_openssl_worker_restarts_total", "Pooled OpenSSL workers replaced.", ("group",),
+                          lambda: [((n,), s["restarts"]) for n, s in openssl_pool.stats().items()])
+metrics.gauge("pki_openssl_workers_idle", "Idle pooled OpenSSL workers.", ("group",),
+              lambda: [((n,), s["idle"]) for n, s in openssl_pool.stats().items()])
+metrics.gauge("pki_artifact_cache_entries", "CA certificates and CRLs held in the artifact cache.", (),
+              lambda: [((), artifact_cache.stats()["entries"])])
+metrics.collected_counter("pki_artifact_cache_requests_total", "Artifact cache lookups.", ("result",),
+                          lambda: [(("hit",), artifact_cache.hits), (("miss",), artifact_cache.misses)])
+metrics.gauge("pki_format_cache_bytes", "Derived certificate formats held in memory.", (),
+              lambda: [((), formats.stats()["bytes"])])
+metrics.collected_counter("pki_format_cache_requests_total", "Derived format cache lookups.", ("result",),
+                          lambda: [(("hit",), formats.stats()["hits"]), (("miss",), formats.stats()["misses"])])
+metrics.collected_counter("pki_retention_reclaimed_bytes_total", "Bytes freed by the retention sweeper.", ("kind",),
+                          lambda: [((k,), c["bytes"]) for k, c in retention.stats()["reclaimed"].items()])
+metrics.collected_counter("pki_retention_reclaimed_inodes_total", "Inodes freed by the retention sweeper.", ("kind",),
+                          lambda: [((k,), c["inodes"]) for k, c in retention.stats()["reclaimed"].items()])
+metrics.gauge("pki_job_queue_depth", "Queued certificate jobs.", (),
+              lambda: [((), job_queue.stats()["queue_depth"])])
+metrics.gauge("pki_job_queued", "Queued certificate jobs by algorithm.", ("algorithm",),
+              lambda: [((a,), n) for a, n in job_queue.stats()["queued_by_algorithm"].items()])
+metrics.gauge("pki_job_running", "Running certificate jobs by algorithm.", ("algorithm",),
+              lambda: [((a,), n) for a, n in job_queue.stats()["running_by_algorithm"].items()])
+metrics.gauge("pki_keypool_depth", "Pre-generated keys available.", ("pool",),
+              lambda: [((p,), s["depth"]) for p, s in keypool.stats()["pools"].items()])
+metrics.gauge("pki_ocsp_cached_responses", "Pre-signed OCSP responses.", ("ca",),
+              lambda: [((ca,), s["cached"]) for ca, s in ocsp_responder.stats().items()])
+metrics.collected_counter("pki_ocsp_responses_total", "OCSP responses by cache result.", ("ca", "result"),
+                          lambda: [((ca, r), s[r]) for ca, s in ocsp_responder.stats().items()
+                                   for r in ("hits", "misses", "signed", "errors")])
+metrics.gauge("pki_crl_revoked_entries", "Revoked serials per CA.", ("ca",),
+              lambda: [((ca,), s["revoked"]) for ca, s in crl_manager.stats().items()])
+metrics.gauge("pki_crl_bytes", "Size of the last published CRL.", ("ca", "kind"),
+              lambda: [((ca, kind), s[kind]["bytes"]) for ca, s in crl_manager.stats().items()
+                       for kind in ("base", "delta") if s[kind]])
+metrics.gauge("pki_ca_lease_remaining", "Leased serials not yet used by this process.", ("ca",),
+              lambda: [((ca,), s["lease_remaining"]) for ca, s in signer.state_stats().items()])
+metrics.collected_counter("pki_ca_state_total", "Serial leasing and journal events.", ("ca", "event"),
+                          lambda: [((ca, e), s[e]) for ca, s in signer.state_stats().items()
+                                   for e in ("leases", "issued", "journaled", "merged", "reclaimed", "restored")])
+metrics.collected_counter("pki_ca_reloads_total", "CA material and config reloads.", ("result",),
+                          lambda: [((r,), n) for r, n in ca_registry.stats().items()
+                                   if r in ("reloads", "rejected", "config_reloads")])
+metrics.gauge("pki_ca_generation", "Times each issuing CA context has been loaded.", ("ca",),
+              lambda: [((s["ca"],), s["generation"]) for s in ca_registry.stats()["cas"].values()])
+metrics.gauge("pki_issuance_store_entries", "Issued bundles awaiting download.", (),
+              lambda: [((), issuance_store.stats()["entries"])])
+metrics.collected_counter("pki_issuance_store_total", "Issuance store events.", ("event",),
+                          lambda: [((e,), n) for e, n in issuance_store.stats().items()
+                                   if e in ("stored", "downloaded", "expired", "rejected")])
+metrics.collected_counter("pki_static_publish_total", "Static publication runs by outcome.", ("result",),
+                          lambda: [((r,), n) for r, n in publisher.stats().items()
+                                   if r in ("published", "unchanged", "failed")] if publisher else [])
+metrics.collected_counter("pki_csr_checks_total", "CSR pre-validation results.", ("result",),
+                          lambda: [((r,), csr_validator.stats()[r]) for r in ("accepted",) + CSR_REJECT_REASONS])
+metrics.collected_counter("pki_csr_issuance_total", "CSR issuances signed or replayed from the idempotency cache.",
+                          ("result",),
+                          lambda: [((r,), issued_cache.stats()[r]) for r in ("issued", "replayed")])
+metrics.collected_counter("pki_chain_validations_total", "Certificates checked by batch chain validation.", ("status",),
+                          lambda: [((s,), n) for s, n in chain_validator.stats()["statuses"].items()])
+metrics.collected_counter("pki_chain_signature_checks_total", "Chain validation signature checks by method.", ("method",),
+                          lambda: [((m,), chain_validator.stats()["signatures"][m]) for m in SIGNATURE_METHODS])
+metrics.gauge("pki_admission_in_flight", "Admitted expensive requests in progress.", ("class",),
+              lambda: [((c,), s["in_flight"]) for c, s in admission.stats()["classes"].items()])
+metrics.gauge("pki_admission_limit", "Concurrency cap per cost class.", ("class",),
+              lambda: [((c,), s.get("concurrency", admission.capacity)) for c, s in admission.stats()["classes"].items()])
+metrics.collected_counter("pki_admission_decisions_total", "Admission decisions (throttled: 429, shed: 503).",
+                          ("class", "result"),
+                          lambda: [((c, r), s[r]) for c, s in admission.stats()["classes"].items()
+                                   for r in ("admitted", "throttled", "shed")])
+
+@app.errorhandler(subprocess.CalledProcessError)
+@app.errorhandler(subprocess.TimeoutExpired)
+def _openssl_failed(e):
+    # run_openssl has logged the command's stderr
+    logging.error(f"[{g.get('request_id', '')}] openssl failed: {e}")
+    return jsonify({"error": "Certificate operation failed", "details": str(e)}), 500
+
+@app.before_request
+def _start_trace():
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    g.request_start = time.perf_counter()
+
+def _cost():
+    """(cost class, algorithm, holds a request thread) of an expensive request, or None."""
+    if request.method != "POST":
+        return None
+    if request.endpoint == "generate_certificate":
+        data = request.get_json(silent=True) or request.form
+        algorithm = data.get("algorithm")
+        try:
+            pooled = keypool.ready(device_ctx(data.get("device"), request.view_args["purpose"])["pki"], algorithm)
+        except HTTPException:
+            return None  # rejected by the view itself
+        return admission.classify("keygen", algorithm, pooled), algorithm, not _wants_async(data)
+    if request.endpoint == "issue_from_csr":
+        return "sign", None, True
+    if request.endpoint == "issue_from_csr_batch":
+        return "batch", None, True
+    if request.endpoint == "validate_certificates":
+        return "verify", None, True
+    return None
+
+@app.before_request
+def _admit():
+    if not app.config.get("ADMISSION_ENABLED", True):
+        return None
+    cost = _cost()
+    if cost is None:
+        return None
+    cost_class, algorithm, slot = cost
+    header = app.config.get("ADMISSION_CLIENT_HEADER")
+    client = (header and request.headers.get(header)) or request.remote_addr
+    try:
+        g.admission = admission.admit(cost_class, client, algorithm if slot else None, slot=slot)
+    except Rejected as e:
+        logging.warning(f"[{g.request_id}] {e} (client {client})")
+        response = jsonify({"error": str(e), "class": e.cost_class, "retry_after": e.retry_after})
+        response.status_code = e.status
+        response.headers["Retry-After"] = str(e.retry_after)
+        return response
+    return None
+
+@app.after_request
+def _finish_trace(response):
+    response.headers["X-Request-ID"] = g.get("request_id", "")
+    if g.get("admission") is not None:
+        # streamed responses (batch issuance) keep their slot until fully sent
+        response.call_on_close(g.admission.release)
+    if "request_start" in g:
+        metrics.request_duration.observe(
+            time.perf_counter() - g.request_start,
+            endpoint=request.url_rule.rule if request.url_rule else "unmatched",
+            method=request.method,
+            status=response.status_code,
+        )
+    return response
+
+@app.teardown_request
+def _release_admission(exc):
+    # no-op after call_on_close; covers requests that failed before a response existed
+    if exc is not None and g.get("admission") is not None:
+        g.admission.release()
+
 # -----------------------------------------------------------------------------
 # Routes
 # -----------------------------------------------------------------------------
@@ -197,61 +582,326 @@ def issue_from_csr():
 
     if purpose not in {"server", "client"}:
         abort(400, "Invalid purpose")
-    if out_format not in {"pem", "der"}:
+    if out_format not in FORMATS:
         abort(400, "Invalid output format")
 
     up = request.files.get("csr")
     if not up or up.filename == "":
         abort(400, "CSR file is required")
-    # 3) Work in an isolated temp dir
-    workdir = tempfile.mkdtemp(prefix="csr_issue_")
+    ca = issuing_cas().get(chain)
+    stage = metrics.stage_timer(pki=chain, ca=ca, purpose=purpose)
     try:
-        csr_path = os.path.join("/tmp/", "input.csr")
-        up.save(csr_path)
-        logging.info(csr_path)
-
-        # 4) Issue certificate (always produce PEM first)
-        leaf_pem = os.path.join(workdir, f"{purpose}.pem")
-        sign_certificate(
-            openssl, chain, csr_path, leaf_pem, purpose,
-            paths["ca_key_file"], paths["ca_passfile"], paths["ca_cert"], paths["ca_conf"],
-        )
-        # 5) Optionally build bundle
-        download_path = leaf_pem
-        download_name = f"leaf-{purpose}-{chain}.pem"
-        if include_chain:
-            bundle_pem = os.path.join(workdir, "bundle.pem")
-            create_certificate_chain(leaf_pem, paths['ca_chain'], bundle_pem)
-            download_path = bundle_pem
-            download_name = f"leaf_bundle-{purpose}-{chain}.pem"
-
-        # 6) Convert to DER if requested
-        if out_format == "der":
-            der_path = os.path.join(workdir, "leaf.der")
-            # If bundle was requested with DER, you likely still return leaf.der (bundling DER is uncommon).
-            convert_certificate_to_der(openssl, chain, leaf_pem)
-            download_path = der_path
-            download_name = download_name.replace(".pem", ".der")
+        # 1) Reject what the CA would refuse before doing any signing work
+        with stage("validate"):
+            checked = csr_validator.check(chain, up.read(), ca_registry.get(chain))
+    except CSRRejected as e:
+        logging.info(f"[{g.request_id}] CSR rejected ({e.reason}): {e}")
+        return jsonify({"error": str(e), "reason": e.reason}), 400
+    try:
+        # 2) Issue certificate (PEM, in memory; the CA keeps newcerts/<SERIAL>.pem),
+        #    or replay the one issued for the same CSR within CSR_IDEMPOTENCY_TTL
+        def sign():
+            with stage("sign"):
+                leaf = signer.sign_pem(
+                    chain, checked.pem, purpose,
+                    paths["ca_key_file"], paths["ca_passfile"], paths["ca_cert"], paths["ca_conf"],
+                )
+            with stage("inventory"):
+                inventory.record_issued(chain, ca, leaf, newcerts_dir=paths["ca_certs_dir"])
+            return leaf
+        leaf, replayed = issued_cache.issue((checked.digest, chain, purpose), sign)
 
-        # 7) Return file as download
-        mimetype = "application/pkix-cert" if out_format == "der" else "application/x-pem-file"
-        return send_file(download_path, as_attachment=True, download_name=download_name, mimetype=mimetype)
+        # 3) Derive the requested format; with include_chain DER becomes a PKCS#7 bundle
+        with stage("format"):
+            body = formats.render(leaf, out_format, chain=paths["ca_chain"] if include_chain else None, pki=chain)
+        mimetype, ext = FORMATS[out_format]
+        if include_chain and out_format == "der":
+            mimetype, ext = FORMATS["p7b"]
+        prefix = "leaf_bundle" if include_chain else "leaf"
+        response = send_file(BytesIO(body), as_attachment=True,
+                             download_name=f"{prefix}-{purpose}-{chain}.{ext}", mimetype=mimetype)
+        if replayed:
+            response.headers["X-Idempotent-Replay"] = "true"
+        return response
 
     except Exception as e:
         app.logger.exception("Issuance failed")
         return jsonify({"error": str(e)}), 500
+
+
+def _batch_csrs(max_items):
+    """Yield (name, bytes) for every CSR in the multipart files and archives."""
+    count = 0
+    for up in request.files.getlist("csrs") + request.files.getlist("archive"):
+        if not up or up.filename == "":
+            continue
+        if is_zipfile(up.stream):
+            up.stream.seek(0)
+            with ZipFile(up.stream) as zf:
+                members = [(i.filename, zf.read(i)) for i in zf.infolist() if not i.is_dir()]
+        else:
+            up.stream.seek(0)
+            try:
+                with tarfile.open(fileobj=up.stream, mode="r:*") as tf:
+                    members = [(m.name, tf.extractfile(m).read()) for m in tf.getmembers() if m.isfile()]
+            except tarfile.TarError:
+                up.stream.seek(0)
+                members = [(up.filename, up.read())]
+        for name, data in members:
+            count += 1
+            if count > max_items:
+                abort(413, f"Batch exceeds {max_items} CSRs")
+            yield name, data
+
+def _issue_batch_item(index, name, csr_data, chain, ca, purpose, out_format, include_chain, paths, workdir, chain_pem):
+    """Sign one CSR of a batch. Never raises: failures go to the manifest."""
+    base = os.path.splitext(os.path.basename(name))[0]
+    stem = f"{index:05d}-{_safe_name(base, 'csr')}"
+    entry = {"item": index, "name": name, "files": []}
+    csr_path = os.path.join(workdir, f"{stem}.csr")
+    leaf_pem = os.path.join(workdir, f"{stem}.pem")
+    stage = metrics.stage_timer(pki=chain, ca=ca, purpose=purpose)
+    try:
+        with stage("validate"):
+            checked = csr_validator.check(chain, csr_data, ca_registry.get(chain))
+
+        def sign():
+            with open(csr_path, "wb") as fp:
+                fp.write(checked.pem)
+            with stage("sign"):
+                signer.sign(
+                    chain, csr_path, leaf_pem, purpose,
+                    paths["ca_key_file"], paths["ca_passfile"], paths["ca_cert"], paths["ca_conf"],
+                )
+            with open(leaf_pem, "rb") as fp:
+                leaf = fp.read()
+            with stage("inventory"):
+                inventory.record_issued(chain, ca, leaf, newcerts_dir=paths["ca_certs_dir"])
+            return leaf
+        leaf, replayed = issued_cache.issue((checked.digest, chain, purpose), sign)
+        files = [(f"{stem}.pem", leaf)]
+        if include_chain:
+            files.append((f"{stem}-chain.pem", leaf + chain_pem))
+        if out_format == "der":
+            files = [(n.replace(".pem", ".der"), _pem_to_der(data)) for n, data in files]
+        entry.update(status="issued", serial=f"{x509.load_pem_x509_certificate(leaf).serial_number:X}")
+        if replayed:
+            entry["replayed"] = True
+        entry["files"] = [n for n, _ in files]
+        return entry, files
+    except CSRRejected as e:
+        entry.update(status="rejected", reason=e.reason, error=str(e))
+        return entry, []
+    except Exception as e:
+        logging.warning(f"Batch item {index} ({name}) failed: {e!r}")
+        entry.update(status="error", error=str(e) or repr(e))
+        return entry, []
     finally:
-        # Remove temp dir after response has been sent
+        for path in (csr_path, leaf_pem):
+            if os.path.exists(path):
+                os.remove(path)
+
+@app.post('/issue_from_csr/batch')
+def issue_from_csr_batch():
+    chain = request.form.get("chain", "").strip()
+    purpose = request.form.get("purpose", "").strip()
+    out_format = request.form.get("out_format", "pem").strip().lower()
+    include_chain = "include_chain" in request.form
+    paths = chain_issue_paths(chain)
+
+    if purpose not in {"server", "client"}:
+        abort(400, "Invalid purpose")
+    if out_format not in {"pem", "der"}:
+        abort(400, "Invalid output format")
+
+    items = list(_batch_csrs(app.config.get("BATCH_MAX_ITEMS", 5000)))
+    if not items:
+        abort(400, "At least one CSR is required")
+    chain_pem = b""
+    if include_chain:
+        with open(paths["ca_chain"], "rb") as fp:
+            chain_pem = fp.read()
+
+    workdir = tempfile.mkdtemp(prefix="csr_batch_")
+    futures = [
+        batch_executor.submit(
+            _issue_batch_item, index, name, data, chain, issuing_cas()[chain], purpose, out_format,
+            include_chain, paths, workdir, chain_pem,
+        )
+        for index, (name, data) in enumerate(items)
+    ]
+    logging.info(f"Batch of {len(futures)} CSRs queued for {chain}/{purpose}")
+
+    def generate():
+        sink = _ZipStream()
+        manifest = []
         try:
+            with ZipFile(sink, "w", ZIP_DEFLATED) as zipf:
+                for future in as_completed(futures):
+                    entry, files = future.result()
+                    manifest.append(entry)
+                    for arcname, data in files:
+                        zipf.writestr(arcname, data)
+                    yield from sink.drain()
+                manifest.sort(key=lambda e: e["item"])
+                zipf.writestr("manifest.json", json.dumps({
+                    "chain": chain,
+                    "purpose": purpose,
+                    "issued": sum(e["status"] == "issued" for e in manifest),
+                    "failed": sum(e["status"] == "error" for e in manifest),
+                    "items": manifest,
+                }, indent=2))
+            yield from sink.drain()
+        finally:
+            for future in futures:
+                future.cancel()
             shutil.rmtree(workdir, ignore_errors=True)
-        except Exception:
-            pass
 
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=batch-{purpose}-{chain}.zip"},
+    )
+
+
+def _certificate_sources():
+    """(stream, name) of every multipart `certs` file, or of the raw request body."""
+    if request.mimetype != "multipart/form-data":
+        return [(request.stream, "body")]
+    sources = []
+    for up in request.files.getlist("certs"):
+        if up and up.filename:
+            sources.append((up.stream, up.filename))
+            up.stream = BytesIO()  # the request teardown closes this one, not the spooled upload
+    return sources
+
+@app.post('/validate_certificates')
+def validate_certificates():
+    chain = request.values.get("chain", "").strip() or None
+    if chain is not None and chain not in issuing_cas():
+        abort(400, "Invalid chain")
+    max_items = app.config.get("CHAIN_VALIDATE_MAX_ITEMS", 100000)
+    chunk = app.config.get("CHAIN_VALIDATE_CHUNK", 1024)
+
+    sources = _certificate_sources()
+
+    def generate():
+        # one JSON result per line, in input order, as each chunk is validated
+        counts = dict.fromkeys(CHAIN_STATUSES, 0)
+        items = (item for stream, name in sources for item in iter_certificates(stream, name))
+        total = 0
+        try:
+            while True:
+                batch = list(islice(items, chunk))
+                if not batch:
+                    break
+                if total + len(batch) > max_items:
+                    yield json.dumps({"error": f"Batch exceeds {max_items} certificates"}) + "\n"
+                    break
+                for result in chain_validator.validate(batch, chain):
+                    result["item"] = total
+                    total += 1
+                    counts[result["status"]] += 1
+                    yield json.dumps(result) + "\n"
+            yield json.dumps({"summary": dict(counts, total=total)}) + "\n"
+        finally:
+            for stream, _ in sources:
+                if stream is not request.stream:
+                    stream.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def issue_generated_certificate(ctx, purpose, algorithm, commonName, cn_type, job_stage=None):
+    """Key, CSR and certificate for /generate_certificate; each step is a metrics span."""
+    stage = metrics.stage_timer(also=job_stage, pki=ctx['pki'], ca=ctx['ca'], algorithm=algorithm, purpose=purpose)
+    cert_id = f'{str(uuid.uuid4().hex[:10 ])}-{purpose}'
+    if app.config.get("ISSUANCE_IN_MEMORY"):
+        return _issue_in_memory(ctx, purpose, algorithm, commonName, cn_type, cert_id, stage)
+
+    if not os.path.exists(app.config['TEMP_KEY_DIR']):
+        os.makedirs(app.config['TEMP_KEY_DIR'], exist_ok=True)
+    key_file = os.path.join(app.config['TEMP_KEY_DIR'], f'{cert_id}.key')
+    logging.debug(f"Key file: {key_file}")
+    logging.debug(f"Generating certificate for {purpose} with commonName: {commonName}, algorithm: {algorithm}, cert_id: {cert_id}")
+    with stage("keygen"):
+        if keypool.take(ctx['pki'], algorithm, key_file):
+            logging.debug("Private key taken from key pool")
+        else:
+            generate_private_key(openssl, ctx['pki'], key_file, algorithm)
+    logging.info("PRIVATE KEY GENERATED")
+    logging.info(f"Key file: {key_file}")
+    subjectAltName = commonName
+    logging.info(f"SAN = {subjectAltName}")
+    subj = f"/C=EU/O=QUBIP/CN={commonName}"
+    csr_file = os.path.join(ctx['ca_certs_dir'], f'{cert_id}.csr')
+    with stage("csr"):
+        generate_csr(
+            openssl, ctx["pki"], key_file, csr_file, subj, ctx["conf_file"],
+            commonName, subjectAltName, cn_type
+        )
+    logging.info("CSR GENERATED")
+    cert_file = os.path.join(ctx['ca_certs_dir'], f'{cert_id}-cert.pem')
+    with stage("sign"):
+        signer.sign(
+            ctx["pki"], csr_file, cert_file, purpose,
+            ctx["ca_key_file"], ctx["ca_passfile"], ctx["ca_cert"], ctx["ca_conf"]
+        )
+        with open(cert_file, 'r') as cert_fp:
+            certificate = cert_fp.read()
+    with stage("inventory"):
+        inventory.record_issued(
+            ctx['pki'], ctx['ca'], certificate.encode(), path=cert_file,
+            cert_id=cert_id, algorithm=algorithm,
+        )
+    # DER and chain bundles are derived at download time (certFormats)
+    return {
+        'pki': ctx['pki'],
+        'ca': ctx['ca'],
+        'certificate_id': cert_id,
+        'certificate': certificate,
+        'filename': f'{cert_id}.pem'
+    }
+
+def _issue_in_memory(ctx, purpose, algorithm, commonName, cn_type, cert_id, stage):
+    """ISSUANCE_IN_MEMORY variant: only the CA's newcerts/<SERIAL>.pem touches the disk."""
+    with issuance_store.reserve(cert_id):
+        with stage("keygen"):
+            key_pem = keypool.take_pem(ctx['pki'], algorithm) or generate_private_key_pem(openssl, ctx['pki'], algorithm)
+        with stage("csr"):
+            csr_pem = generate_csr_pem(
+                openssl, ctx["pki"], key_pem, f"/C=EU/O=QUBIP/CN={commonName}", ctx["conf_file"],
+                commonName, commonName, cn_type
+            )
+        with stage("sign"):
+            cert_pem = signer.sign_pem(
+                ctx["pki"], csr_pem, purpose,
+                ctx["ca_key_file"], ctx["ca_passfile"], ctx["ca_cert"], ctx["ca_conf"]
+            )
+        with stage("inventory"):
+            inventory.record_issued(
+                ctx['pki'], ctx['ca'], cert_pem, cert_id=cert_id, algorithm=algorithm,
+                newcerts_dir=ctx['ca_certs_dir'],
+            )
+        issuance_store.put(cert_id, ctx['pki'], ctx['ca'], key_pem, cert_pem)
+    logging.info(f"Certificate {cert_id} issued in memory")
+    return {
+        'pki': ctx['pki'],
+        'ca': ctx['ca'],
+        'certificate_id': cert_id,
+        'certificate': cert_pem.decode(),
+        'filename': f'{cert_id}.pem'
+    }
+
+def _wants_async(data) -> bool:
+    value = data.get('async', request.args.get('async', ''))
+    return value is True or str(value).lower() in ("1", "true", "yes")
 
 @app.route('/generate_certificate/<purpose>', methods=['GET','POST'])
 def generate_certificate(purpose):
     if request.method == 'GET':
-        return render_template('gen-cert.html', purpose=purpose)
+        return render_template('gen-cert.html', purpose=purpose,
+                               async_jobs=app.config.get("JOBS_ASYNC_CLIENT", False))
     if request.method == 'POST':
         try:
             data = request.json or request.form
@@ -262,112 +912,132 @@ def generate_certificate(purpose):
 
             commonName = data.get('common_name')
             cn_type = data.get('cn_type') # IP/DNS
-            cert_id = f'{str(uuid.uuid4().hex[:10 ])}-{purpose}' 
-
-            if not os.path.exists(app.config['TEMP_KEY_DIR']):
-                os.makedirs(app.config['TEMP_KEY_DIR'])
-            key_file = os.path.join(app.config['TEMP_KEY_DIR'], f'{cert_id}.key')
-            logging.debug(f"Key file: {key_file}")
-            logging.debug(f"Generating certificate for {purpose} with commonName: {commonName}, algorithm: {algorithm}, cert_id: {cert_id}")
-            generate_private_key(openssl, ctx['pki'], key_file, algorithm)
-            if not key_file:
-                return {"error": "Failed to generate private key"}, 500
-            else:
-                logging.info("PRIVATE KEY GENERATED")
-                logging.info(f"Key file: {key_file}")
-                subjectAltName = commonName
-                logging.info(f"SAN = {subjectAltName}")
-                subj = f"/C=EU/O=QUBIP/CN={commonName}"
-                csr_file = os.path.join(ctx['ca_certs_dir'], f'{cert_id}.csr')
-                generate_csr(
-                    openssl, ctx["pki"], key_file, csr_file, subj, ctx["conf_file"],
-                    commonName, subjectAltName, cn_type
-                )          
-                if not csr_file:
-                    return jsonify({"error": "Failed to generate CSR"}), 500
-                logging.info("CSR GENERATED")
-                cert_file = os.path.join(ctx['ca_certs_dir'], f'{cert_id}-cert.pem')
-                sign_certificate(
-                    openssl, ctx["pki"], csr_file, cert_file, purpose,
-                    ctx["ca_key_file"], ctx["ca_passfile"], ctx["ca_cert"], ctx["ca_conf"]
+            if _wants_async(data):
+                job = job_queue.submit(
+                    algorithm, lambda job: issue_generated_certificate(
+                        ctx, purpose, algorithm, commonName, cn_type, job_stage=job.stage)
                 )
-                with open(cert_file, 'r') as cert_fp:
-                    certificate = cert_fp.read()
-                if not cert_file:
-                    return jsonify({"error": "Failed to generate certificate"}), 500
-                else:
-                    chain_file = f'{cert_id}-chain.pem'
-                    chain_path = os.path.join(ctx['ca_certs_dir'], chain_file)
-                    convert_certificate_to_der(openssl, ctx['pki'], cert_file)
-                    logging.info("DER certificate converted")
-                    create_certificate_chain(cert_file, ctx['ca_chain'], chain_path)
-                    convert_certificate_to_der(openssl, ctx['pki'], chain_path)
-                    logging.info(chain_path)
-                    
-                    return jsonify({
-                        'pki': ctx['pki'],
-                        'ca': ctx['ca'],
-                        'certificate_id': cert_id,
-                        'certificate': certificate,
-                        'filename': f'{cert_id}.pem'
-                        }), 200
+                return jsonify({
+                    'job_id': job.id,
+                    'status': job.status,
+                    'status_url': f'/jobs/{job.id}',
+                }), 202
+            return jsonify(issue_generated_certificate(ctx, purpose, algorithm, commonName, cn_type)), 200
+        except (QueueFull, StoreFull) as e:
+            logging.warning(f"[{g.request_id}] {e}")
+            response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+            response.status_code = 503
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
         except Exception as e:
-            logging.error(f"Error generating certificate: {e}")
+            logging.error(f"[{g.request_id}] Error generating certificate: {e}")
             return jsonify({'error': 'An unexpected error occurred', 'details': str(e)}), 500
     return jsonify({'error': 'Invalid request method'}), 400
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/jobs/stats', methods=['GET'])
+def job_stats():
+    return jsonify(job_queue.stats()), 200
+
+ZIP_EXTRA_FORMATS = {"p7b", "p12"}
+
+def _stream_certificate_zip(cert_id, pki, ca_chain, cert_pem, key_pem, extra=()):
+    """
+    Stream the /download_certificate archive: cert (PEM and DER), key and
+    leaf+chain PEM, plus any of ZIP_EXTRA_FORMATS; all derived on demand.
+    """
+    files = [
+        (f"{cert_id}-cert.pem", lambda: cert_pem),
+        (f"{cert_id}-cert.der", lambda: formats.render(cert_pem, "der")),
+        (f"{cert_id}.key", lambda: key_pem),
+        (f"{cert_id}-chain.pem", lambda: formats.render(cert_pem, "pem", chain=ca_chain)),
+    ]
+    if "p7b" in extra:
+        files.append((f"{cert_id}-chain.p7b", lambda: formats.render(cert_pem, "p7b", chain=ca_chain)))
+    if "p12" in extra:
+        files.append((f"{cert_id}.p12", lambda: formats.render(
+            cert_pem, "p12", chain=ca_chain, key_pem=key_pem, pki=pki)))
+
+    def generate():
+        sink = _ZipStream()
+        with ZipFile(sink, "w", ZIP_DEFLATED) as zipf:
+            for arcname, data in files:
+                zipf.writestr(arcname, data())
+                yield from sink.drain()
+        yield from sink.drain()
+
+    return Response(
+        generate(),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={cert_id}.zip"},
+    )
+
 @app.route('/download_certificate/<pki>/<ca>/<cert_id>', methods=['GET'])
 def download_certificate(pki, ca, cert_id):
-    working_dir = chain_base_dir(pki)  # preserves your original mapping
-    certs_path = issued_certs_dir_for(pki, ca)
+    extra = {f for f in request.args.get("formats", "").split(",") if f}
+    if not extra <= ZIP_EXTRA_FORMATS:
+        abort(400, f"Unsupported formats: {', '.join(sorted(extra - ZIP_EXTRA_FORMATS))}")
+    ca_chain = chain_issue_paths(pki)["ca_chain"]
+    issued = issuance_store.pop(cert_id, pki, ca)
+    if issued is not None:
+        bundle, key_pem = issued
+        return _stream_certificate_zip(cert_id, pki, ca_chain, bundle.cert_pem, key_pem, extra)
+    record = inventory.find_by_cert_id(cert_id)
+    if record and record["ca"] == ca and record["path"]:
+        certs_path = os.path.dirname(record["path"])
+    else:
+        certs_path = issued_certs_dir_for(pki, ca)
 
     filename        = f"{cert_id}-cert.pem"
-    chain_filename  = f"{cert_id}-chain.pem"
     full_path       = os.path.join(certs_path, filename)
-    full_chain_path = os.path.join(certs_path, chain_filename)
-    der_cert        = f"{full_path}.der"
-    der_chain       = f"{full_chain_path}.der"
     key_filename    = os.path.join(app.config["TEMP_KEY_DIR"], f"{cert_id}.key")
-    csr_file        = f"{cert_id}.csr"  # as in your original code
+    csr_file        = os.path.join(certs_path, f"{cert_id}.csr")
 
-    _abort_if_missing(full_path, "Certificate not found")
-    _abort_if_missing(der_cert, "DER certificate not found")
-    _abort_if_missing(full_chain_path, "Chain certificate file NOT found")
-    _abort_if_missing(der_chain, "DER chain certificate not found")
+    cert_pem = retention.read_issued(full_path)  # may have been packed into newcerts/archive
+    if cert_pem is None:
+        logging.error("app.py - Certificate not found: %s", filename)
+        abort(404, "Certificate not found")
     _abort_if_missing(key_filename, "Private key not found")
-    with open(key_filename, 'r') as f:
-        key_content = f.read()
     try:
-        stream = BytesIO()
-        with ZipFile(stream, 'w') as zipf:
-            zipf.write(full_path, arcname=filename) # add filename
-            zipf.write(der_cert, arcname=f'{cert_id}-cert.der') # add der cert
-            #zipf.write(der_chain, arcname=f'{cert_id}-chain.der') # add der chain
-            zipf.writestr(f"{cert_id}.key", key_content) # add private key
-            zipf.write(full_chain_path, arcname=chain_filename)
-        stream.seek(0)
-
-        # delete key and csr after download
-        os.remove(key_filename)
-        # Delete the CSR file
-        if os.path.exists(csr_file):
-            os.remove(csr_file)
-        return send_file(
-            stream, 
-            as_attachment=True,
-            download_name=f'{cert_id}.zip', 
-            mimetype='application/zip'
-        )
+        with open(key_filename, 'rb') as f:
+            key_pem = f.read()
     except FileNotFoundError:
-        logging.error("app.py - Certificate not found: %s", filename)
+        logging.error("app.py - Private key not found: %s", key_filename)
         return jsonify({'error': 'File not found'}), 404
+    # delete key and csr once they are read; a concurrent download may have got there first
+    try:
+        secure_delete(key_filename)
+    except FileNotFoundError:
+        pass
+    try:
+        os.remove(csr_file)
+    except FileNotFoundError:
+        pass
+    return _stream_certificate_zip(cert_id, pki, ca_chain, cert_pem, key_pem, extra)
+
+def _send_artifact(artifact, download_name):
+    return send_file(
+        BytesIO(artifact.data),
+        as_attachment=True,
+        download_name=download_name,
+        etag=artifact.etag,
+        last_modified=artifact.last_modified,
+        conditional=True,
+    )
 
 @app.route('/<chain>/<ca>/certificate', methods=['GET'])
 def download_ca_certificate(chain, ca):
     filename = ca_cert_path(chain, ca)
     _abort_if_missing(filename, "Certificate not found")
     try:
-        return send_file(filename, as_attachment=True)
+        artifact = artifact_cache.get(chain, ca, "certificate", filename)
+        return _send_artifact(artifact, os.path.basename(filename))
     except FileNotFoundError:
         logging.error("app.py - Certificate not found: %s", filename)
         return jsonify({"error": "File not found"}), 404
@@ -378,45 +1048,317 @@ def download_crl(chain, ca):
     ca_crl = ca_crl_path(chain, ca)
     _abort_if_missing(ca_crl, "CRL not found")
     try:
-        return send_file(ca_crl, as_attachment=True)
+        artifact = artifact_cache.get(chain, ca, "crl", ca_crl)
+        return _send_artifact(artifact, os.path.basename(ca_crl))
     except FileNotFoundError:
         logging.error("app.py - CRL not found: %s", ca_crl)
         return jsonify({"error": "File not found"}), 404
 
+@app.route('/<chain>/<ca>/delta_crl', methods=['GET'])
+def download_delta_crl(chain, ca):
+    delta_crl = delta_crl_path(ca_crl_path(chain, ca))
+    _abort_if_missing(delta_crl, "Delta CRL not found")
+    artifact = artifact_cache.get(chain, ca, "delta_crl", delta_crl)
+    return _send_artifact(artifact, os.path.basename(delta_crl))
+
+@app.post('/<chain>/<ca>/revoke')
+def revoke_certificate(chain, ca):
+    token = app.config.get("REVOCATION_TOKEN")
+    if not token:
+        abort(403, "Revocation is disabled (no REVOCATION_TOKEN configured)")
+    supplied = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode()):
+        abort(401, "Revocation requires a valid token")
+    if issuing_cas().get(chain) != ca:
+        abort(404, "CA not found")
+    data = request.json if request.is_json else request.form
+    try:
+        serial = int(str(data.get("serial", "")).strip(), 16)
+    except ValueError:
+        abort(400, "Invalid serial (hex expected)")
+    reason = data.get("reason", "unspecified")
+    try:
+        entry = crl_manager.revoke(ca, serial, reason)
+    except LookupError as e:
+        return jsonify({"error": str(e)}), 404
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "ca": ca,
+        "serial": serial_to_hex(serial),
+        "reason": reason,
+        "revoked_at": entry.revoked.isoformat(),
+    }), 200
+
+def _parse_date_arg(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        when = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, f"Invalid {name} (ISO 8601 expected)")
+    return when if when.tzinfo else when.replace(tzinfo=timezone.utc)
+
+@app.route('/inventory/certificates', methods=['GET'])
+def inventory_certificates():
+    args = request.args
+    try:
+        serial = int(args["serial"], 16) if args.get("serial") else None
+        per_page = min(500, max(1, int(args.get("per_page", 50))))
+        within_days = int(args["expires_within_days"]) if args.get("expires_within_days") else None
+    except ValueError:
+        abort(400, "Invalid query parameter")
+    status = args.get("status")
+    if status not in (None, "valid", "revoked", "expired"):
+        abort(400, "Invalid status")
+    expires_after = _parse_date_arg("expires_after")
+    expires_before = _parse_date_arg("expires_before")
+    if within_days is not None:
+        expires_after = expires_after or datetime.now(timezone.utc)
+        expires_before = datetime.now(timezone.utc) + timedelta(days=within_days)
+    try:
+        result = inventory.query(
+            cn=args.get("cn"), serial=serial, ca=args.get("ca"), status=status,
+            expires_after=expires_after, expires_before=expires_before,
+            cursor=args.get("cursor"), per_page=per_page,
+        )
+    except ValueError as e:
+        abort(400, str(e))
+    return jsonify(result), 200
+
+@app.route('/inventory/certificates/<ca>/<serial>', methods=['GET'])
+def inventory_certificate(ca, serial):
+    try:
+        record = inventory.get(ca, int(serial, 16))
+    except ValueError:
+        abort(400, "Invalid serial (hex expected)")
+    if record is None:
+        abort(404, "Certificate not found")
+    return jsonify(record), 200
+
+@app.route('/crl/stats', methods=['GET'])
+def crl_stats():
+    return jsonify(crl_manager.stats()), 200
+
 @app.route('/certificate_details/<chain>/<ca>/ca_certificate', methods=['GET'])
 def view_ca_certificate(chain, ca):
     filename = ca_cert_path(chain, ca)
     _abort_if_missing(filename, "Certificate not found")
 
     try:
-        if chain == "pki-44":
-            openssl_cmd = f"OPENSSL_CONF={OQS_CONF} {openssl}"
-            cert_data = get_ca_certificate_details(openssl_cmd, filename)
-        else:
-            cert_data = get_ca_certificate_details(openssl, filename)
+        artifact = artifact_cache.get(chain, ca, "certificate", filename)
+        with metrics.span("render", pki=chain, ca=ca):
+            cert_data = artifact.rendered(lambda: get_ca_certificate_details(openssl, filename, chain))
 
         return render_template("view-ca-certificate.html", cert_data=cert_data, ca=ca)
     except Exception as e:
         logging.error(f"Error reading certificate: {e}")
         return jsonify({"error": "Error reading certificate"}), 500
 
+def _crl_index(chain, ca, artifact):
+    """Serial-sorted index of a CRL artifact, or None when the CRL cannot be walked."""
+    def build():
+        with metrics.span("crl_index", pki=chain, ca=ca):
+            return CRLIndex(artifact.der, artifact.parsed)
+    try:
+        return artifact.derived("index", build)
+    except (ValueError, IndexError) as e:
+        logging.warning(f"Could not index CRL {artifact.path}: {e}")
+        return None
+
+def _crl_query(index):
+    args = request.args
+    try:
+        serial = int(args["serial"].strip().replace(":", ""), 16) if args.get("serial") else None
+        page = max(1, int(args.get("page", 1)))
+        per_page = min(500, max(1, int(args.get("per_page", app.config.get("CRL_PAGE_SIZE", 50)))))
+    except ValueError:
+        abort(400, "Invalid query parameter")
+    return index.query(
+        serial=serial,
+        revoked_after=_parse_date_arg("revoked_after"),
+        revoked_before=_parse_date_arg("revoked_before"),
+        page=page, per_page=per_page,
+    )
+
 @app.route('/crl_details/<chain>/<ca>', methods=['GET'])
 def view_ca_crl(chain, ca):
     filename = ca_crl_path(chain, ca)
     _abort_if_missing(filename, "CRL not found")
-    try:
-        if chain == "pki-44":
-            openssl_cmd = f"OPENSSL_CONF={OQS_CONF} {openssl}"
-            crl_data = get_crl_details(openssl_cmd, filename)
-        else:
-            crl_data = get_crl_details(openssl, filename)
-        return render_template("view-ca-crl.html", crl_data=crl_data, ca=ca)
-    except Exception:
+    artifact = artifact_cache.get(chain, ca, "crl", filename)
+    index = _crl_index(chain, ca, artifact)
+    if index is None:
+        try:
+            with metrics.span("render", pki=chain, ca=ca):
+                crl_data = artifact.rendered(lambda: get_crl_details(openssl, filename, chain))
+            return render_template("view-ca-crl.html", crl_data=crl_data, ca=ca)
+        except Exception:
+            return jsonify({"error": "Error reading CRL"}), 500
+    result = _crl_query(index)
+    filters = {k: request.args[k] for k in ("serial", "revoked_after", "revoked_before", "per_page") if request.args.get(k)}
+    pages = max(1, -(-result["total"] // result["per_page"]))
+    page_url = lambda page: url_for("view_ca_crl", chain=chain, ca=ca, page=page, **filters)
+    with metrics.span("render", pki=chain, ca=ca):
+        return render_template(
+            "view-ca-crl.html", ca=ca, chain=chain, header=index.header, result=result, filters=filters,
+            pages=pages, searchable=True,
+            prev_url=page_url(result["page"] - 1) if result["page"] > 1 else None,
+            next_url=page_url(result["page"] + 1) if result["page"] < pages else None,
+        )
+
+@app.route('/crl_entries/<chain>/<ca>', methods=['GET'])
+def crl_entries(chain, ca):
+    filename = ca_crl_path(chain, ca)
+    _abort_if_missing(filename, "CRL not found")
+    artifact = artifact_cache.get(chain, ca, "crl", filename)
+    index = _crl_index(chain, ca, artifact)
+    if index is None:
         return jsonify({"error": "Error reading CRL"}), 500
+    return jsonify(dict(_crl_query(index), header=index.header)), 200
+
+def _ocsp_reply(ca, request_der):
+    try:
+        der, next_update = ocsp_responder.respond(ca, request_der)
+    except KeyError:
+        abort(404, "CA not found")
+    response = Response(der, mimetype="application/ocsp-response")
+    if request.method == "GET" and next_update is not None:
+        response.cache_control.public = True
+        response.cache_control.no_transform = True
+        response.cache_control.must_revalidate = True
+        response.cache_control.max_age = max(0, int((next_update - datetime.now(timezone.utc)).total_seconds()))
+        response.expires = next_update
+    return response
+
+@app.post('/ocsp/<ca>')
+def ocsp_post(ca):
+    return _ocsp_reply(ca, request.get_data())
+
+@app.get('/ocsp/<ca>/<path:encoded>')
+def ocsp_get(ca, encoded):
+    try:
+        request_der = base64.b64decode(unquote(encoded), validate=True)
+    except ValueError:
+        abort(400, "Invalid OCSP request encoding")
+    return _ocsp_reply(ca, request_der)
+
+@app.route('/ocsp/stats', methods=['GET'])
+def ocsp_stats():
+    return jsonify(ocsp_responder.stats()), 200
+
+@app.route('/keypool/stats', methods=['GET'])
+def keypool_stats():
+    return jsonify(keypool.stats()), 200
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(artifact_cache.stats(), formats=formats.stats(), issued=issued_cache.stats())), 200
+
+@app.route('/validation/stats', methods=['GET'])
+def validation_stats():
+    return jsonify(chain_validator.stats()), 200
+
+@app.route('/csr/stats', methods=['GET'])
+def csr_stats():
+    return jsonify(csr_validator.stats()), 200
+
+@app.route('/ca/stats', methods=['GET'])
+def ca_registry_stats():
+    return jsonify(ca_registry.stats()), 200
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    return jsonify(admission.stats()), 200
+
+@app.route('/publish/stats', methods=['GET'])
+def publish_stats():
+    if publisher is None:
+        return jsonify({"error": "Static publication is disabled"}), 404
+    return jsonify(publisher.stats()), 200
+
+@app.route('/retention/stats', methods=['GET'])
+def retention_stats():
+    return jsonify(retention.stats()), 200
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/openssl/stats', methods=['GET'])
+def openssl_process_stats():
+    return jsonify(dict(openssl_stats(), pool=openssl_pool.stats())), 200
 
 @app.route('/')
 def home():
     return render_template('home.html')
 
+# -----------------------------------------------------------------------------
+# Static publication (a reverse proxy serves the public CA material)
+# -----------------------------------------------------------------------------
+def _static_crl(chain, ca, crl_file, base, per_page):
+    crl = artifact_cache.get(chain, ca, "crl", crl_file)
+    mtime = crl.last_modified.timestamp()
+    items = [(f"{base}/crl.pem", crl.pem, mtime), (f"{base}/crl.crl", crl.der, mtime)]
+    index = _crl_index(chain, ca, crl)
+    if index is None:
+        text = crl.rendered(lambda: get_crl_details(openssl, crl_file, chain))
+        html = render_template("view-ca-crl.html", crl_data=text, ca=ca)
+        return items + [(f"{base}/crl_details.html", html.encode(), mtime)]
+    pages = max(1, -(-len(index) // per_page))
+    page_name = lambda page: "crl_details.html" if page == 1 else f"crl_details-{page}.html"
+    for page in range(1, pages + 1):
+        html = render_template(
+            "view-ca-crl.html", ca=ca, chain=chain, header=index.header,
+            result=index.query(page=page, per_page=per_page), filters={}, pages=pages, searchable=False,
+            prev_url=page_name(page - 1) if page > 1 else None,
+            next_url=page_name(page + 1) if page < pages else None,
+        )
+        items.append((f"{base}/{page_name(page)}", html.encode(), mtime))
+    return items
+
+def _static_artifacts():
+    """Every public CA file and detail page, as [(path, bytes, mtime)] under <chain>/<ca>/."""
+    items = []
+    per_page = app.config.get("STATIC_CRL_PAGE_SIZE", 500)
+    with app.app_context():
+        for chain, issuing in issuing_cas().items():
+            for ca in ("qubip-root-ca", issuing):
+                base = f"{chain}/{ca}"
+                cert_file = ca_cert_path(chain, ca)
+                if os.path.exists(cert_file):
+                    cert = artifact_cache.get(chain, ca, "certificate", cert_file)
+                    mtime = cert.last_modified.timestamp()
+                    text = cert.rendered(lambda: get_ca_certificate_details(openssl, cert_file, chain))
+                    items += [
+                        (f"{base}/certificate.pem", cert.pem, mtime),
+                        (f"{base}/certificate.der", cert.der, mtime),
+                        (f"{base}/certificate_details.html",
+                         render_template("view-ca-certificate.html", cert_data=text, ca=ca).encode(), mtime),
+                    ]
+                crl_file = ca_crl_path(chain, ca)
+                if os.path.exists(crl_file):
+                    items += _static_crl(chain, ca, crl_file, base, per_page)
+                delta_file = delta_crl_path(crl_file)
+                if os.path.exists(delta_file):
+                    delta = artifact_cache.get(chain, ca, "delta_crl", delta_file)
+                    mtime = delta.last_modified.timestamp()
+                    items += [(f"{base}/delta_crl.pem", delta.pem, mtime), (f"{base}/delta_crl.crl", delta.der, mtime)]
+            chain_file = chain_issue_paths(chain)["ca_chain"]
+            if os.path.exists(chain_file):
+                with open(chain_file, "rb") as fp:
+                    items.append((f"{chain}/{issuing}/chain.pem", fp.read(), os.path.getmtime(chain_file)))
+    return items
+
+publisher = None
+if app.config.get("STATIC_PUBLISH_DIR"):
+    publisher = StaticPublisher(
+        app.config["STATIC_PUBLISH_DIR"], _static_artifacts,
+        keep=app.config.get("STATIC_PUBLISH_KEEP", 3),
+    )
+    crl_manager.subscribe(lambda event, chain, ca, detail: publisher.request())
+    ca_registry.subscribe(lambda chain, ca, ctx: publisher.request())
+    publisher.start(app.config.get("STATIC_PUBLISH_INTERVAL", 300))
+
 if __name__ == '__main__':
     app.run(host='130.192.1.31', debug=True, port=5000)
\ No newline at end of file
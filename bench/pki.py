@@ -0,0 +1,181 @@
+"""
+Throwaway PKI for the benchmarks, laid out like the one built by `scripts/`:
+root + issuing CA per chain, `db/`, `newcerts/`, `crl/`, passphrase-protected
+keys and the request confs `generate_csr` expects (`fqdn_ext`/`ip_ext` reading
+`$ENV::SAN`). pki-65/pki-44 use ML-DSA when oqsprovider is usable, otherwise
+classical stand-ins so the suite still runs.
+"""
+import os
+import subprocess
+
+from pkiCrypto import openssl_env
+
+CA_CONF = """\
+[ ca ]
+default_ca = {name}_ca
+[ {name}_ca ]
+dir = {dir}
+database = $dir/db/{name}.db
+serial = $dir/db/{name}.crt.srl
+crlnumber = $dir/db/{name}.crl.srl
+new_certs_dir = $dir/newcerts
+certificate = $dir/{name}-cert.pem
+private_key = $dir/private/{name}.key
+default_md = {md}
+default_days = 365
+default_crl_days = 7
+copy_extensions = copy
+unique_subject = no
+policy = match_pol
+[ match_pol ]
+countryName = optional
+organizationName = supplied
+commonName = supplied
+[ req ]
+prompt = no
+distinguished_name = dn
+[ dn ]
+C = EU
+O = QUBIP
+CN = {name}
+[ root_ca_ext ]
+basicConstraints = critical,CA:true
+keyUsage = critical,keyCertSign,cRLSign
+subjectKeyIdentifier = hash
+[ signing_ca_ext ]
+basicConstraints = critical,CA:true,pathlen:0
+keyUsage = critical,keyCertSign,cRLSign
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+[ server_ext ]
+keyUsage = critical,digitalSignature,keyEncipherment
+basicConstraints = CA:false
+extendedKeyUsage = serverAuth
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+[ client_ext ]
+keyUsage = critical,digitalSignature
+basicConstraints = CA:false
+extendedKeyUsage = clientAuth
+subjectKeyIdentifier = hash
+authorityKeyIdentifier = keyid:always
+"""
+
+REQ_CONF = """\
+[ req ]
+prompt = no
+distinguished_name = dn
+[ dn ]
+CN = placeholder
+[ fqdn_ext ]
+subjectAltName = DNS:$ENV::SAN
+[ ip_ext ]
+subjectAltName = IP:$ENV::SAN
+"""
+
+CLASSICAL = {
+    "certs": ["-algorithm", "ed25519"],
+    "pki-65": ["-algorithm", "EC", "-pkeyopt", "ec_paramgen_curve:P-256"],
+    "pki-44": ["-algorithm", "RSA", "-pkeyopt", "rsa_keygen_bits:2048"],
+}
+POST_QUANTUM = {
+    "certs": ["-algorithm", "ed25519"],
+    "pki-65": ["-algorithm", "mldsa65"],
+    "pki-44": ["-algorithm", "mldsa44"],
+}
+ISSUING_CA = {"certs": "qubip-tls-ca", "pki-65": "qubip-mpu-ca", "pki-44": "qubip-mcu-ca"}
+
+
+def _openssl(openssl, pki, *args):
+    subprocess.run([openssl, *args], check=True, capture_output=True, env=openssl_env(pki))
+
+def oqsprovider_available(openssl, workdir):
+    try:
+        _openssl(openssl, "pki-44", "genpkey", "-algorithm", "mldsa44", "-out", os.path.join(workdir, "probe.key"))
+        return True
+    except subprocess.CalledProcessError:
+        return False
+
+def _make_ca(openssl, pki, base, conf_dir, name, keygen, md):
+    ca_dir = os.path.join(base, name)
+    for sub in ("private", "db", "crl", "newcerts"):
+        os.makedirs(os.path.join(ca_dir, sub), exist_ok=True)
+    open(os.path.join(ca_dir, "db", f"{name}.db"), "w").close()
+    for srl in ("crt", "crl"):
+        with open(os.path.join(ca_dir, "db", f"{name}.{srl}.srl"), "w") as fp:
+            fp.write("01\n")
+    conf = os.path.join(conf_dir, f"{name}.conf")
+    with open(conf, "w") as fp:
+        fp.write(CA_CONF.format(name=name, dir=ca_dir, md=md))
+    passfile = os.path.join(ca_dir, "private", f".{name}-passphrase.txt")
+    with open(passfile, "w") as fp:
+        fp.write(os.urandom(24).hex() + "\n")
+    key = os.path.join(ca_dir, "private", f"{name}.key")
+    _openssl(openssl, pki, "genpkey", *keygen, "-aes-256-cbc", "-out", key, "-pass", f"file:{passfile}")
+    return {"dir": ca_dir, "conf": conf, "key": key, "passfile": passfile,
+            "cert": os.path.join(ca_dir, f"{name}-cert.pem")}
+
+def _gencrl(openssl, pki, ca, name):
+    _openssl(openssl, pki, "ca", "-gencrl", "-config", ca["conf"], "-keyfile", ca["key"],
+             "-passin", f"file:{ca['passfile']}", "-cert", ca["cert"],
+             "-out", os.path.join(ca["dir"], "crl", f"{name}.crl"))
+
+def build_chain(openssl, pki, base, conf_dir, keygen):
+    md = "sha256" if "mldsa" not in keygen[1] else "default"
+    os.makedirs(conf_dir, exist_ok=True)
+    root = _make_ca(openssl, pki, base, conf_dir, "qubip-root-ca", keygen, md)
+    _openssl(openssl, pki, "req", "-new", "-x509", "-key", root["key"], "-passin", f"file:{root['passfile']}",
+             "-config", root["conf"], "-extensions", "root_ca_ext", "-days", "7305", "-out", root["cert"])
+    name = ISSUING_CA[pki]
+    ca = _make_ca(openssl, pki, base, conf_dir, name, keygen, md)
+    csr = os.path.join(ca["dir"], f"{name}.csr")
+    _openssl(openssl, pki, "req", "-new", "-key", ca["key"], "-passin", f"file:{ca['passfile']}",
+             "-config", ca["conf"], "-out", csr)
+    _openssl(openssl, pki, "ca", "-config", root["conf"], "-keyfile", root["key"],
+             "-passin", f"file:{root['passfile']}", "-cert", root["cert"], "-in", csr, "-out", ca["cert"],
+             "-extensions", "signing_ca_ext", "-days", "3650", "-batch")
+    _gencrl(openssl, pki, root, "qubip-root-ca")
+    _gencrl(openssl, pki, ca, name)
+    with open(os.path.join(ca["dir"], f"{name}-chain.pem"), "wb") as out:
+        for path in (ca["cert"], root["cert"]):
+            with open(path, "rb") as fp:
+                out.write(fp.read())
+    for purpose in ("server", "client"):
+        with open(os.path.join(conf_dir, f"qubip-{purpose}.conf"), "w") as fp:
+            fp.write(REQ_CONF)
+    return ca
+
+def build_pki(openssl, root, post_quantum=None):
+    """Build the three chains under `root` and return the matching Config attributes."""
+    os.makedirs(root, exist_ok=True)
+    if post_quantum is None:
+        post_quantum = oqsprovider_available(openssl, root)
+    keygens = POST_QUANTUM if post_quantum else CLASSICAL
+    etc = os.path.join(root, "etc")
+    dirs = {pki: os.path.join(root, pki) for pki in ISSUING_CA}
+    tls = build_chain(openssl, "certs", dirs["certs"], os.path.join(etc, "tls"), keygens["certs"])
+    build_chain(openssl, "pki-65", dirs["pki-65"], os.path.join(etc, "pki65"), keygens["pki-65"])
+    build_chain(openssl, "pki-44", dirs["pki-44"], os.path.join(etc, "pki44"), keygens["pki-44"])
+    return {
+        "OPENSSL": openssl,
+        "CERTS_DIR": dirs["certs"],
+        "PKI65_DIR": dirs["pki-65"],
+        "PKI44_DIR": dirs["pki-44"],
+        "CONF_DIR_PKI65": os.path.join(etc, "pki65"),
+        "CONF_DIR_PKI44": os.path.join(etc, "pki44"),
+        "ROOT_CA": "qubip-root-ca",
+        "MPU_CA": "qubip-mpu-ca",
+        "MCU_CA": "qubip-mcu-ca",
+        "TLS_CA": "qubip-tls-ca",
+        "SERVER_CONF": os.path.join(etc, "tls", "qubip-server.conf"),
+        "CLIENT_CONF": os.path.join(etc, "tls", "qubip-client.conf"),
+        "TEMP_KEY_DIR": os.path.join(root, "keys"),
+        "TLS_CERTS_DIR": os.path.join(tls["dir"], "newcerts"),
+        "TLS_CA_CONF": tls["conf"],
+        "TLS_CA_KEY": tls["key"],
+        "TLS_CA_PASSWORD": tls["passfile"],
+        "TLS_CA_CERT": tls["cert"],
+        "TLS_CA_CHAIN": os.path.join(tls["dir"], "qubip-tls-ca-chain.pem"),
+        "TLS_CA_CRL": os.path.join(tls["dir"], "crl", "qubip-tls-ca.crl"),
+        "POST_QUANTUM": post_quantum,
+    }
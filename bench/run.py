@@ -0,0 +1,375 @@
+"""
+Load and micro-benchmarks for the PKI web app against a throwaway PKI.
+
+    python bench/run.py --requests 20 --concurrency 4 --out bench-results.json
+    python bench/run.py --baseline bench/baseline.json --tolerance 0.25 --fail-on-regression
+
+A fresh PKI is built in a temporary directory (see bench/pki.py), a `config`
+module pointing at it is installed before `app` is imported, and the routes
+are driven through Flask's test client from a thread pool. Results are
+latency percentiles and throughput per route and per algorithm, plus
+micro-benchmarks of the pkiCrypto functions.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import shutil
+import argparse
+import tempfile
+import platform
+import threading
+import types
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pki import build_pki, ISSUING_CA  # noqa: E402
+
+CLASSICAL_ALGORITHMS = ["ed25519", "rsa2048"]
+PQ_ALGORITHMS = ["mldsa44", "mldsa65", "mldsa87"]
+DEVICES = {"tls": "certs", "mpu": "pki-65", "mcu": "pki-44"}
+
+
+def summarize(samples, errors=0, wall=None):
+    ordered = sorted(samples)
+
+    def pct(p):
+        if not ordered:
+            return None
+        return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))] * 1000
+
+    result = {
+        "count": len(ordered),
+        "errors": errors,
+        "mean_ms": sum(ordered) / len(ordered) * 1000 if ordered else None,
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+    }
+    if wall:
+        result["throughput_rps"] = len(ordered) / wall
+    return result
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+        self.walls = {}
+
+    def add(self, keys, elapsed, ok):
+        with self._lock:
+            for key in keys:
+                if ok:
+                    self.samples.setdefault(key, []).append(elapsed)
+                else:
+                    self.errors[key] = self.errors.get(key, 0) + 1
+                    self.samples.setdefault(key, [])
+
+    def results(self):
+        return {
+            key: summarize(samples, self.errors.get(key, 0), self.walls.get(key))
+            for key, samples in sorted(self.samples.items())
+        }
+
+
+def install_config(settings):
+    """Make `from config import Config` resolve to the throwaway PKI."""
+    attrs = dict(settings)
+    attrs["validate"] = classmethod(lambda cls: None)
+    module = types.ModuleType("config")
+    module.Config = type("Config", (), attrs)
+    sys.modules["config"] = module
+
+
+# -----------------------------------------------------------------------------
+# Route benchmarks
+# -----------------------------------------------------------------------------
+class RouteBench:
+    def __init__(self, app_module, concurrency, recorder):
+        self.app = app_module.app
+        self.concurrency = concurrency
+        self.recorder = recorder
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def phase(self, route, jobs):
+        """Run `jobs` (callables returning (keys, ok, value)) at the configured concurrency."""
+        def timed(job):
+            start = time.perf_counter()
+            try:
+                keys, ok, value = job(self.client())
+            except Exception as e:
+                print(f"  {route}: {e!r}", file=sys.stderr)
+                keys, ok, value = [route], False, None
+            self.recorder.add(keys, time.perf_counter() - start, ok)
+            return value
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as pool:
+            values = list(pool.map(timed, jobs))
+        self.recorder.walls[route] = time.perf_counter() - start
+        return values
+
+
+def generate_job(purpose, device, algorithm, index):
+    route = "POST /generate_certificate/<purpose>"
+
+    def job(client):
+        cn = f"bench-{index}.example.com"
+        r = client.post(f"/generate_certificate/{purpose}",
+                        json={"device": device, "algorithm": algorithm, "common_name": cn, "cn_type": "fqdn"})
+        ok = r.status_code == 200
+        value = (r.json["pki"], r.json["ca"], r.json["certificate_id"]) if ok else None
+        return [route, f"{route} [{algorithm}]"], ok, value
+    return job
+
+def issue_job(chain, csr_pem, out_format):
+    route = "POST /issue_from_csr"
+
+    def job(client):
+        r = client.post("/issue_from_csr", content_type="multipart/form-data", data={
+            "chain": chain, "purpose": "client", "out_format": out_format, "include_chain": "on",
+            "csr": (BytesIO(csr_pem), "bench.csr"),
+        })
+        return [route, f"{route} [{chain}]"], r.status_code == 200, None
+    return job
+
+def get_job(route, url, key=None):
+    def job(client):
+        r = client.get(url)
+        return [route] + ([f"{route} [{key}]"] if key else []), r.status_code == 200, None
+    return job
+
+def make_csr(index):
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519
+    key = ed25519.Ed25519PrivateKey.generate()
+    cn = f"csr-{index}.example.com"
+    csr = (
+        x509.CertificateSigningRequestBuilder()
+        .subject_name(x509.Name([
+            x509.NameAttribute(NameOID.ORGANIZATION_NAME, "QUBIP"),
+            x509.NameAttribute(NameOID.COMMON_NAME, cn),
+        ]))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName(cn)]), critical=False)
+        .sign(key, None)
+    )
+    return csr.public_bytes(serialization.Encoding.PEM)
+
+def run_routes(app_module, args, algorithms):
+    recorder = Recorder()
+    bench = RouteBench(app_module, args.concurrency, recorder)
+    n = args.requests
+
+    print("routes: /generate_certificate", file=sys.stderr)
+    jobs = [
+        generate_job("server" if i % 2 else "client", device, algorithm, i)
+        for algorithm in algorithms for device in DEVICES for i in range(n)
+    ]
+    issued = [v for v in bench.phase("POST /generate_certificate/<purpose>", jobs) if v]
+
+    print("routes: /issue_from_csr", file=sys.stderr)
+    csrs = [make_csr(i) for i in range(n)]
+    bench.phase("POST /issue_from_csr", [
+        issue_job(chain, csrs[i], "der" if i % 2 else "pem") for chain in DEVICES.values() for i in range(n)
+    ])
+
+    print("routes: /download_certificate", file=sys.stderr)
+    bench.phase("GET /download_certificate/<pki>/<ca>/<cert_id>", [
+        get_job("GET /download_certificate/<pki>/<ca>/<cert_id>", f"/download_certificate/{pki}/{ca}/{cert_id}", pki)
+        for pki, ca, cert_id in issued
+    ])
+
+    print("routes: CA artifacts and views", file=sys.stderr)
+    for route, template in [
+        ("GET /<chain>/<ca>/certificate", "/{chain}/{ca}/certificate"),
+        ("GET /<chain>/<ca>/crl", "/{chain}/{ca}/crl"),
+        ("GET /certificate_details/<chain>/<ca>/ca_certificate", "/certificate_details/{chain}/{ca}/ca_certificate"),
+        ("GET /crl_details/<chain>/<ca>", "/crl_details/{chain}/{ca}"),
+    ]:
+        bench.phase(route, [
+            get_job(route, template.format(chain=chain, ca=ca), chain)
+            for chain, issuing in ISSUING_CA.items()
+            for ca in ("qubip-root-ca", issuing)
+            for _ in range(n)
+        ])
+    return recorder.results()
+
+
+# -----------------------------------------------------------------------------
+# pkiCrypto micro-benchmarks
+# -----------------------------------------------------------------------------
+def _time(results, name, fn, repeat):
+    samples, errors = [], 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        try:
+            fn()
+            samples.append(time.perf_counter() - start)
+        except (Exception, SystemExit):
+            errors += 1
+    results[name] = summarize(samples, errors)
+
+def run_crypto(app_module, args, algorithms, workdir):
+    import pkiCrypto
+    openssl = app_module.openssl
+    cfg = app_module.app.config
+    results = {}
+    repeat = args.repeat
+    for pki in DEVICES.values():
+        paths = app_module.chain_issue_paths(pki)
+        conf = os.path.join(cfg["CONF_DIR_PKI65"] if pki == "pki-65" else
+                            cfg["CONF_DIR_PKI44"] if pki == "pki-44" else os.path.dirname(cfg["SERVER_CONF"]),
+                            "qubip-client.conf")
+        for algorithm in algorithms:
+            key = os.path.join(workdir, f"{pki}-{algorithm}.key")
+            _time(results, f"generate_private_key [{pki}/{algorithm}]",
+                  lambda: pkiCrypto.generate_private_key(openssl, pki, key, algorithm), repeat)
+        key = os.path.join(workdir, f"{pki}-{algorithms[0]}.key")
+        csr = os.path.join(workdir, f"{pki}.csr")
+        _time(results, f"generate_csr [{pki}]", lambda: pkiCrypto.generate_csr(
+            openssl, pki, key, csr, "/C=EU/O=QUBIP/CN=micro.example.com", conf,
+            "micro.example.com", "micro.example.com", "fqdn"), repeat)
+        crt = os.path.join(workdir, f"{pki}-cert.pem")
+        sign_args = (paths["ca_key_file"], paths["ca_passfile"], paths["ca_cert"], paths["ca_conf"])
+        _time(results, f"sign_certificate (openssl ca) [{pki}]", lambda: pkiCrypto.sign_certificate(
+            openssl, pki, csr, crt, "client", *sign_args), repeat)
+        _time(results, f"SigningEngine.sign [{pki}]", lambda: app_module.signer.sign(
+            pki, csr, crt, "client", *sign_args), repeat)
+        _time(results, f"convert_certificate_to_der [{pki}]",
+              lambda: pkiCrypto.convert_certificate_to_der(openssl, pki, crt), repeat)
+        chain = os.path.join(workdir, f"{pki}-chain.pem")
+        _time(results, f"create_certificate_chain [{pki}]",
+              lambda: pkiCrypto.create_certificate_chain(crt, paths["ca_chain"], chain), repeat)
+        ca = ISSUING_CA[pki]
+        _time(results, f"get_ca_certificate_details [{pki}]", lambda: pkiCrypto.get_ca_certificate_details(
+            openssl, app_module.ca_cert_path(pki, ca), pki), repeat)
+        _time(results, f"get_crl_details [{pki}]", lambda: pkiCrypto.get_crl_details(
+            openssl, app_module.ca_crl_path(pki, ca), pki), repeat)
+    return results
+
+
+# -----------------------------------------------------------------------------
+# Reporting
+# -----------------------------------------------------------------------------
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"{'name':<72} {'n':>5} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, r in results.items():
+        fmt = lambda v: f"{v:9.2f}" if v is not None else f"{'-':>9}"
+        rps = f"{r['throughput_rps']:8.1f}" if "throughput_rps" in r else f"{'':>8}"
+        print(f"{name:<72} {r['count']:>5} {r['errors']:>4} {rps} {fmt(r['p50_ms'])} {fmt(r['p95_ms'])} {fmt(r['p99_ms'])}")
+
+def compare(current, baseline, tolerance):
+    """Entries whose p50 or p95 grew by more than `tolerance` relative to the baseline."""
+    regressions = []
+    for section in ("routes", "crypto"):
+        for name, now in current.get(section, {}).items():
+            before = baseline.get(section, {}).get(name)
+            if not before:
+                continue
+            for metric in ("p50_ms", "p95_ms"):
+                if now.get(metric) and before.get(metric) and now[metric] > before[metric] * (1 + tolerance):
+                    regressions.append((section, name, metric, before[metric], now[metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--openssl", default=os.environ.get("OPENSSL", "openssl"))
+    parser.add_argument("--requests", type=int, default=10, help="requests per route/algorithm/chain")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=10, help="iterations per micro-benchmark")
+    parser.add_argument("--algorithms", help="comma separated; default classical + ML-DSA when available")
+    parser.add_argument("--classical-only", action="store_true", help="do not use oqsprovider even if present")
+    parser.add_argument("--keypool", action="store_true", help="enable the background key pool")
+    parser.add_argument("--no-worker-pool", action="store_true", help="exec openssl for every operation")
+    parser.add_argument("--skip-routes", action="store_true")
+    parser.add_argument("--skip-crypto", action="store_true")
+    parser.add_argument("--out", help="write results as JSON")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary PKI")
+    args = parser.parse_args(argv)
+
+    root = tempfile.mkdtemp(prefix="qubip-bench-")
+    try:
+        print(f"building PKI in {root}", file=sys.stderr)
+        settings = build_pki(args.openssl, root, post_quantum=False if args.classical_only else None)
+        settings.update(
+            INVENTORY_DB=os.path.join(root, "inventory.db"),
+            KEYPOOL_ENABLED=args.keypool,
+            KEYPOOL_DIR=os.path.join(root, "keypool"),
+            OPENSSL_POOL_ENABLED=not args.no_worker_pool,
+            ADMISSION_ENABLED=False,
+        )
+        install_config(settings)
+        import app as app_module
+        import pkiCrypto
+        logging.getLogger().setLevel(logging.WARNING)
+
+        if args.algorithms:
+            algorithms = args.algorithms.split(",")
+        else:
+            algorithms = CLASSICAL_ALGORITHMS + (PQ_ALGORITHMS if settings["POST_QUANTUM"] else [])
+
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "post_quantum": settings["POST_QUANTUM"],
+                "algorithms": algorithms,
+                "requests": args.requests,
+                "concurrency": args.concurrency,
+                "repeat": args.repeat,
+                "worker_pool": not args.no_worker_pool,
+                "keypool": args.keypool,
+            },
+        }
+        if not args.skip_routes:
+            results["routes"] = run_routes(app_module, args, algorithms)
+            print_table("routes", results["routes"])
+        if not args.skip_crypto:
+            workdir = os.path.join(root, "micro")
+            os.makedirs(workdir)
+            results["crypto"] = run_crypto(app_module, args, algorithms, workdir)
+            print_table("pkiCrypto", results["crypto"])
+        results["openssl"] = pkiCrypto.openssl_stats()
+        print(f"\nopenssl processes spawned: {results['openssl']['spawns']}")
+
+        if args.out:
+            with open(args.out, "w") as fp:
+                json.dump(results, fp, indent=2, sort_keys=True)
+        if args.baseline:
+            with open(args.baseline) as fp:
+                regressions = compare(results, json.load(fp), args.tolerance)
+            print(f"\n{len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%})")
+            for section, name, metric, before, now in regressions:
+                print(f"  {section}: {name} {metric} {before:.2f} -> {now:.2f} ms")
+            if regressions and args.fail_on_regression:
+                return 1
+        return 0
+    finally:
+        if args.keep:
+            print(f"PKI kept in {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
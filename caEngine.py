@@ -0,0 +1,646 @@
+import os
+import re
+import fcntl
+import logging
+import time
+import threading
+import datetime
+from contextlib import contextmanager
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.x509.oid import NameOID, ExtendedKeyUsageOID, AuthorityInformationAccessOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519, ed448
+
+try:
+    from cryptography.hazmat.primitives.asymmetric import mldsa
+except ImportError:  # cryptography < 47
+    mldsa = None
+
+from pkiCrypto import sign_certificate, sign_certificate_pem
+
+# Key types signing without a separate digest (pure EdDSA and ML-DSA)
+PURE_KEY_TYPES = (ed25519.Ed25519PrivateKey, ed448.Ed448PrivateKey)
+if mldsa is not None:
+    PURE_KEY_TYPES += (mldsa.MLDSA44PrivateKey, mldsa.MLDSA65PrivateKey, mldsa.MLDSA87PrivateKey)
+
+# Key types the in-process backend can sign with. Everything else (composites,
+# SLH-DSA via oqsprovider, ML-DSA with an older cryptography) goes through `openssl ca`.
+SUPPORTED_KEY_TYPES = (rsa.RSAPrivateKey, ec.EllipticCurvePrivateKey) + PURE_KEY_TYPES
+
+DIGESTS = {
+    "sha256": hashes.SHA256,
+    "sha384": hashes.SHA384,
+    "sha512": hashes.SHA512,
+}
+
+KEY_USAGES = {
+    "digitalSignature": "digital_signature",
+    "nonRepudiation": "content_commitment",
+    "contentCommitment": "content_commitment",
+    "keyEncipherment": "key_encipherment",
+    "dataEncipherment": "data_encipherment",
+    "keyAgreement": "key_agreement",
+    "keyCertSign": "key_cert_sign",
+    "cRLSign": "crl_sign",
+    "encipherOnly": "encipher_only",
+    "decipherOnly": "decipher_only",
+}
+
+EXTENDED_KEY_USAGES = {
+    "serverAuth": ExtendedKeyUsageOID.SERVER_AUTH,
+    "clientAuth": ExtendedKeyUsageOID.CLIENT_AUTH,
+    "codeSigning": ExtendedKeyUsageOID.CODE_SIGNING,
+    "emailProtection": ExtendedKeyUsageOID.EMAIL_PROTECTION,
+    "timeStamping": ExtendedKeyUsageOID.TIME_STAMPING,
+    "OCSPSigning": ExtendedKeyUsageOID.OCSP_SIGNING,
+}
+
+POLICY_FIELDS = {
+    "countryName": NameOID.COUNTRY_NAME,
+    "stateOrProvinceName": NameOID.STATE_OR_PROVINCE_NAME,
+    "localityName": NameOID.LOCALITY_NAME,
+    "organizationName": NameOID.ORGANIZATION_NAME,
+    "organizationalUnitName": NameOID.ORGANIZATIONAL_UNIT_NAME,
+    "commonName": NameOID.COMMON_NAME,
+    "emailAddress": NameOID.EMAIL_ADDRESS,
+}
+
+ONELINE_NAMES = {
+    NameOID.COUNTRY_NAME: "C",
+    NameOID.STATE_OR_PROVINCE_NAME: "ST",
+    NameOID.LOCALITY_NAME: "L",
+    NameOID.ORGANIZATION_NAME: "O",
+    NameOID.ORGANIZATIONAL_UNIT_NAME: "OU",
+    NameOID.COMMON_NAME: "CN",
+    NameOID.EMAIL_ADDRESS: "emailAddress",
+}
+
+PURPOSE_EXTENSIONS = {"server": "server_ext", "client": "client_ext"}
+
+# index.txt revocation reason -> CRL/OCSP reason code
+REVOCATION_REASONS = {
+    "unspecified": x509.ReasonFlags.unspecified,
+    "keyCompromise": x509.ReasonFlags.key_compromise,
+    "CACompromise": x509.ReasonFlags.ca_compromise,
+    "affiliationChanged": x509.ReasonFlags.affiliation_changed,
+    "superseded": x509.ReasonFlags.superseded,
+    "cessationOfOperation": x509.ReasonFlags.cessation_of_operation,
+    "certificateHold": x509.ReasonFlags.certificate_hold,
+    "removeFromCRL": x509.ReasonFlags.remove_from_crl,
+    "privilegeWithdrawn": x509.ReasonFlags.privilege_withdrawn,
+    "AACompromise": x509.ReasonFlags.aa_compromise,
+}
+
+
+class UnsupportedProfile(Exception):
+    """The CA, CSR or extension profile needs the `openssl ca` path."""
+
+
+# -----------------------------------------------------------------------------
+# OpenSSL config / database helpers
+# -----------------------------------------------------------------------------
+_VAR_RE = re.compile(r"\$(?:\{([\w:.]+)\}|([\w]+(?:::[\w.]+)?))")
+
+def parse_openssl_conf(path):
+    """Minimal OpenSSL config reader: sections, `key = value`, `$var` expansion."""
+    sections = {"default": {}}
+    current = sections["default"]
+    with open(path, "r") as fp:
+        for raw in fp:
+            line = raw.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("[") and line.endswith("]"):
+                current = sections.setdefault(line[1:-1].strip(), {})
+                continue
+            if "=" not in line:
+                continue
+            key, value = (part.strip() for part in line.split("=", 1))
+            current[key] = _expand(value.strip('"'), current, sections)
+    return sections
+
+def _expand(value, section, sections):
+    def repl(match):
+        name = match.group(1) or match.group(2)
+        if "::" in name:
+            scope, var = name.split("::", 1)
+            if scope == "ENV":
+                # $ENV:: values are resolved per call by openssl; keep them verbatim
+                return match.group(0)
+            return sections.get(scope, {}).get(var, "")
+        return section.get(name, sections["default"].get(name, ""))
+    return _VAR_RE.sub(repl, value)
+
+def serial_to_hex(serial):
+    text = f"{serial:X}"
+    return text if len(text) % 2 == 0 else f"0{text}"
+
+def openssl_time(when):
+    if when.year < 2050:
+        return when.strftime("%y%m%d%H%M%SZ")
+    return when.strftime("%Y%m%d%H%M%SZ")
+
+def parse_openssl_time(text):
+    fmt = "%y%m%d%H%M%SZ" if len(text) == 13 else "%Y%m%d%H%M%SZ"
+    return datetime.datetime.strptime(text, fmt).replace(tzinfo=datetime.timezone.utc)
+
+class IndexEntry:
+    """One line of an OpenSSL CA database (index.txt)."""
+    __slots__ = ("status", "expires", "revoked", "reason", "serial", "subject", "filename")
+
+    def __init__(self, status, expires, revoked, reason, serial, subject, filename="unknown"):
+        self.status = status
+        self.expires = expires
+        self.revoked = revoked
+        self.reason = reason
+        self.serial = serial
+        self.subject = subject
+        self.filename = filename
+
+    @classmethod
+    def parse(cls, line):
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) < 6:
+            return None
+        revoked, reason = None, None
+        if fields[2]:
+            when, _, reason = fields[2].partition(",")
+            revoked = parse_openssl_time(when)
+        return cls(fields[0], parse_openssl_time(fields[1]), revoked, reason or None,
+                   int(fields[3], 16), fields[5], fields[4])
+
+    def format(self):
+        revocation = ""
+        if self.revoked is not None:
+            revocation = openssl_time(self.revoked) + (f",{self.reason}" if self.reason else "")
+        return "\t".join([self.status, openssl_time(self.expires), revocation,
+                          serial_to_hex(self.serial), self.filename, self.subject])
+
+def read_index(path):
+    """Serial -> IndexEntry for an OpenSSL CA database."""
+    entries = {}
+    with open(path, "r") as fp:
+        for line in fp:
+            entry = IndexEntry.parse(line)
+            if entry is not None:
+                entries[entry.serial] = entry
+    return entries
+
+def name_oneline(name):
+    parts = []
+    for attr in name:
+        label = ONELINE_NAMES.get(attr.oid, attr.oid.dotted_string)
+        parts.append(f"/{label}={attr.value}")
+    return "".join(parts)
+
+
+# -----------------------------------------------------------------------------
+# CA context
+# -----------------------------------------------------------------------------
+class CAContext:
+    """One issuing CA: key, cert, conf and extension profiles, loaded once."""
+
+    def __init__(self, pki, ca_key, ca_passfile, ca_cert, ca_conf):
+        self.pki = pki
+        self.ca_key = ca_key
+        self.ca_passfile = ca_passfile
+        self.ca_cert = ca_cert
+        self.ca_conf = ca_conf
+        self.lock = threading.Lock()
+        self.key = None
+        self.profiles = {}
+        self.state = None  # caState.CAState when serials are leased
+        self._subjects = None
+        self._subjects_stamp = None
+        self._load()
+
+    def _load(self):
+        with open(self.ca_cert, "rb") as fp:
+            self.cert_pem = fp.read()
+        self.cert = x509.load_pem_x509_certificate(self.cert_pem)
+        self.name = self.cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
+
+        self.conf = parse_openssl_conf(self.ca_conf)
+        ca_section = self.conf.get("ca", {}).get("default_ca", "")
+        section = self.conf.get(ca_section, {})
+        self.section_name = ca_section
+        self.section = section
+        self.database = section.get("database")
+        self.serial_file = section.get("serial")
+        self.crlnumber_file = section.get("crlnumber")
+        self.new_certs_dir = section.get("new_certs_dir")
+        self.default_md = section.get("default_md", "sha256")
+        self.default_crl_days = int(section.get("default_crl_days", "1"))
+        self.copy_extensions = section.get("copy_extensions", "none")
+        self.unique_subject = self._unique_subject()
+        self.policy = self.conf.get(section.get("policy", ""), {})
+
+        with open(self.ca_passfile, "rb") as fp:
+            password = fp.readline().rstrip(b"\r\n")
+        try:
+            with open(self.ca_key, "rb") as fp:
+                key = serialization.load_pem_private_key(fp.read(), password=password)
+        except (UnsupportedAlgorithm, ValueError) as e:
+            logging.info(f"{self.name}: key not usable in-process ({e}); using openssl ca")
+            return
+        if not isinstance(key, SUPPORTED_KEY_TYPES):
+            logging.info(f"{self.name}: {type(key).__name__} not supported in-process; using openssl ca")
+            return
+        if not (self.database and self.serial_file and self.new_certs_dir):
+            logging.info(f"{self.name}: CA database not described in {self.ca_conf}; using openssl ca")
+            return
+        self.key = key
+
+        for purpose, ext_section in PURPOSE_EXTENSIONS.items():
+            try:
+                self.profiles[purpose] = self._build_profile(ext_section)
+            except UnsupportedProfile as e:
+                logging.info(f"{self.name}: {ext_section} needs openssl ca ({e})")
+
+    def _unique_subject(self):
+        """`unique_subject` as openssl ca resolves it: index.txt.attr, then the conf, default yes."""
+        value = self.section.get("unique_subject", "yes")
+        if self.database:
+            try:
+                with open(f"{self.database}.attr", "r") as fp:
+                    for line in fp:
+                        key, _, val = line.partition("=")
+                        if key.strip() == "unique_subject":
+                            value = val.strip()
+            except FileNotFoundError:
+                pass
+        return value.strip().lower() not in ("no", "n", "false", "f", "off", "0")
+
+    @property
+    def in_process(self):
+        return self.key is not None
+
+    def signature_hash(self):
+        if isinstance(self.key, PURE_KEY_TYPES):
+            return None
+        if self.default_md not in DIGESTS:
+            raise UnsupportedProfile(f"digest {self.default_md}")
+        return DIGESTS[self.default_md]()
+
+    # -- extension profile ----------------------------------------------------
+    def _build_profile(self, ext_section):
+        if ext_section not in self.conf:
+            raise UnsupportedProfile(f"missing section [{ext_section}]")
+        profile = []
+        for name, value in self.conf[ext_section].items():
+            critical = False
+            items = [item.strip() for item in value.split(",") if item.strip()]
+            if items and items[0] == "critical":
+                critical = True
+                items = items[1:]
+            builder = getattr(self, f"_ext_{name}", None)
+            if builder is None:
+                raise UnsupportedProfile(f"extension {name}")
+            profile.append((builder(items), critical))
+        return profile
+
+    def _ext_basicConstraints(self, items):
+        ca, pathlen = False, None
+        for item in items:
+            key, _, val = item.partition(":")
+            if key == "CA":
+                ca = val.upper() == "TRUE"
+            elif key == "pathlen":
+                pathlen = int(val)
+        return lambda csr: x509.BasicConstraints(ca=ca, path_length=pathlen)
+
+    def _ext_keyUsage(self, items):
+        flags = dict.fromkeys(set(KEY_USAGES.values()), False)
+        for item in items:
+            if item not in KEY_USAGES:
+                raise UnsupportedProfile(f"keyUsage {item}")
+            flags[KEY_USAGES[item]] = True
+        return lambda csr: x509.KeyUsage(**flags)
+
+    def _ext_extendedKeyUsage(self, items):
+        try:
+            usages = [EXTENDED_KEY_USAGES[item] for item in items]
+        except KeyError as e:
+            raise UnsupportedProfile(f"extendedKeyUsage {e}")
+        return lambda csr: x509.ExtendedKeyUsage(usages)
+
+    def _ext_subjectKeyIdentifier(self, items):
+        if items != ["hash"]:
+            raise UnsupportedProfile("subjectKeyIdentifier")
+        return lambda csr: x509.SubjectKeyIdentifier.from_public_key(csr.public_key())
+
+    def _ext_authorityKeyIdentifier(self, items):
+        if not all(item.startswith("keyid") for item in items):
+            raise UnsupportedProfile("authorityKeyIdentifier")
+        try:
+            ski = self.cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value
+            aki = x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ski)
+        except x509.ExtensionNotFound:
+            aki = x509.AuthorityKeyIdentifier.from_issuer_public_key(self.key.public_key())
+        return lambda csr: aki
+
+    def _ext_authorityInfoAccess(self, items):
+        methods = {
+            "caIssuers": AuthorityInformationAccessOID.CA_ISSUERS,
+            "OCSP": AuthorityInformationAccessOID.OCSP,
+        }
+        descriptions = []
+        for method, uri in self._general_uris(items, prefixed=True):
+            if method not in methods:
+                raise UnsupportedProfile(f"authorityInfoAccess {method}")
+            descriptions.append(x509.AccessDescription(methods[method], x509.UniformResourceIdentifier(uri)))
+        return lambda csr: x509.AuthorityInformationAccess(descriptions)
+
+    def _ext_crlDistributionPoints(self, items):
+        uris = [x509.UniformResourceIdentifier(uri) for _, uri in self._general_uris(items)]
+        points = [x509.DistributionPoint(full_name=uris, relative_name=None, reasons=None, crl_issuer=None)]
+        return lambda csr: x509.CRLDistributionPoints(points)
+
+    def _general_uris(self, items, prefixed=False):
+        """Expand `URI:...` items or an `@section` of `[method;]URI.n = ...` lines."""
+        entries = []
+        for item in items:
+            if item.startswith("@"):
+                for key, val in self.conf.get(item[1:], {}).items():
+                    entries.append((key, val))
+            else:
+                key, _, val = item.partition(":")
+                entries.append((key, val))
+        result = []
+        for key, val in entries:
+            method, _, kind = key.rpartition(";") if prefixed else ("", "", key)
+            if not kind.split(".")[0] == "URI":
+                raise UnsupportedProfile(f"general name {key}")
+            result.append((method, val))
+        return result
+
+    # -- subject --------------------------------------------------------------
+    def build_subject(self, csr):
+        """Apply the CA policy like `openssl ca` (preserve=no): policy order, match/supplied."""
+        if not self.policy:
+            return csr.subject
+        attrs = []
+        for field, rule in self.policy.items():
+            oid = POLICY_FIELDS.get(field)
+            if oid is None:
+                raise UnsupportedProfile(f"policy field {field}")
+            values = csr.subject.get_attributes_for_oid(oid)
+            if rule == "match":
+                expected = self.cert.subject.get_attributes_for_oid(oid)
+                if not values or [v.value for v in values] != [e.value for e in expected]:
+                    raise ValueError(f"{field} field needed to be the same in the CA certificate and the request")
+            elif rule == "supplied" and not values:
+                raise ValueError(f"{field} field needed to be supplied and was missing")
+            attrs.extend(values)
+        return x509.Name(attrs)
+
+    # -- database -------------------------------------------------------------
+    @contextmanager
+    def db_lock(self):
+        """
+        Serialize access to the OpenSSL CA database within and across processes.
+        With leased serials, pending journal entries are merged first so the
+        index is complete while the lock is held.
+        """
+        with self.lock:
+            with open(f"{self.database}.lock", "a") as lock_fp:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX)
+                try:
+                    if self.state is not None:
+                        self.state.merge_journals()
+                    yield
+                finally:
+                    fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _index_stamp(self):
+        st = os.stat(self.database)
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def valid_subjects(self):
+        """Subjects of the valid entries in the CA database, re-read only when it changed."""
+        stamp = self._index_stamp()
+        if stamp != self._subjects_stamp:
+            self._subjects = {e.subject for e in read_index(self.database).values() if e.status == "V"}
+            self._subjects_stamp = stamp
+        return self._subjects
+
+    def check_unique_subject(self, subject, pending=()):
+        """Refuse `subject` (oneline) like openssl ca when unique_subject is on and it is still valid."""
+        if self.unique_subject and (subject in self.valid_subjects() or subject in pending):
+            raise ValueError(f"There is already a certificate for {subject} (unique_subject)")
+
+    def next_serial(self):
+        with open(self.serial_file, "r") as fp:
+            serial = int(fp.read().strip(), 16)
+        atomic_write(self.serial_file, f"{serial_to_hex(serial + 1)}\n")
+        return serial
+
+    def write_index(self, entries):
+        atomic_write(self.database, "".join(f"{entry.format()}\n" for entry in entries))
+
+    def next_crl_number(self):
+        with open(self.crlnumber_file, "r") as fp:
+            number = int(fp.read().strip(), 16)
+        atomic_write(self.crlnumber_file, f"{serial_to_hex(number + 1)}\n")
+        return number
+
+    def append_index(self, cert):
+        entry = IndexEntry("V", cert.not_valid_after_utc, None, None,
+                           cert.serial_number, name_oneline(cert.subject))
+        fresh = self._subjects is not None and self._index_stamp() == self._subjects_stamp
+        with open(self.database, "a") as fp:
+            fp.write(f"{entry.format()}\n")
+            fp.flush()
+            os.fsync(fp.fileno())
+        if fresh:
+            # keep the subject set current without re-reading our own append
+            self._subjects.add(entry.subject)
+            self._subjects_stamp = self._index_stamp()
+
+
+def atomic_write(path, data, mode="w"):
+    tmp = f"{path}.tmp"
+    with open(tmp, mode) as fp:
+        fp.write(data)
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.replace(tmp, path)
+
+
+# -----------------------------------------------------------------------------
+# Signing engine
+# -----------------------------------------------------------------------------
+class SigningEngine:
+    """Signs CSRs in-process with cached CA contexts; falls back to `openssl ca`."""
+
+    def __init__(self, openssl, days=365, ca_state=None):
+        self.openssl = openssl
+        self.days = days
+        self.ca_state = ca_state  # CAContext -> caState.CAState, or None to sign under db_lock
+        self._contexts = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def context(self, pki, ca_key, ca_passfile, ca_cert, ca_conf):
+        cache_key = (pki, ca_conf, ca_key)
+        ctx = self._contexts.get(cache_key)
+        if ctx is None:
+            with self._lock:
+                ctx = self._contexts.get(cache_key)
+                if ctx is None:
+                    ctx = CAContext(pki, ca_key, ca_passfile, ca_cert, ca_conf)
+                    if self.ca_state is not None and ctx.database and ctx.serial_file:
+                        ctx.state = self.ca_state(ctx)
+                    self._contexts[cache_key] = ctx
+                    logging.info(f"Loaded CA context {ctx.name} (in-process: {ctx.in_process})")
+        return ctx
+
+    def adopt(self, ctx, old=None):
+        """
+        Serve `ctx` (loaded and validated elsewhere) instead of `old`. Signs
+        that already hold `old` finish on it; serial leases carry over when
+        both use the same CA database.
+        """
+        with self._lock:
+            if self.ca_state is not None and ctx.database and ctx.serial_file:
+                if old is not None and old.state is not None and old.database == ctx.database:
+                    ctx.state = old.state.rebind(ctx)
+                else:
+                    ctx.state = self.ca_state(ctx)
+            for key, cached in list(self._contexts.items()):
+                if cached is old:
+                    del self._contexts[key]
+            self._contexts[(ctx.pki, ctx.ca_conf, ctx.ca_key)] = ctx
+        if old is not None and old.state is not None and old.state is not ctx.state:
+            old.state.release()
+        logging.info(f"Loaded CA context {ctx.name} (in-process: {ctx.in_process})")
+        return ctx
+
+    def start(self, interval=5):
+        """Merge journals, heartbeat leases and reclaim dead ones every `interval` seconds."""
+        if self._thread is None and self.ca_state is not None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="ca-state", daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            for ctx in list(self._contexts.values()):
+                if ctx.state is not None:
+                    try:
+                        ctx.state.maintain()
+                    except Exception as e:
+                        logging.error(f"CA state maintenance failed for {ctx.name}: {e!r}")
+
+    def state_stats(self):
+        return {ctx.name: ctx.state.stats() for ctx in list(self._contexts.values()) if ctx.state is not None}
+
+    @staticmethod
+    def _requested_subject(ctx, csr_data):
+        """Oneline subject `openssl ca` will issue `csr_data` for."""
+        if b"-----BEGIN" in csr_data:
+            csr = x509.load_pem_x509_csr(csr_data)
+        else:
+            csr = x509.load_der_x509_csr(csr_data)
+        try:
+            return name_oneline(ctx.build_subject(csr))
+        except (ValueError, UnsupportedProfile):
+            return name_oneline(csr.subject)  # openssl ca reports the policy error itself
+
+    @contextmanager
+    def _openssl_ca(self, ctx, csr_data):
+        """
+        Conf for `openssl ca`: a leased scratch database, or the CA's own one
+        under db_lock. The scratch index is empty, so unique_subject is
+        checked here against the CA's index and journals instead.
+        """
+        if ctx.state is not None:
+            with ctx.state.claim_subject(self._requested_subject(ctx, csr_data)), \
+                    ctx.state.openssl_ca_conf() as conf:
+                yield conf
+        else:
+            with ctx.db_lock():
+                yield ctx.ca_conf
+
+    def _try_in_process(self, ctx, csr_data, purpose):
+        if ctx.in_process and purpose in ctx.profiles:
+            try:
+                return self._sign_in_process(ctx, csr_data, purpose)
+            except (UnsupportedProfile, UnsupportedAlgorithm) as e:
+                logging.info(f"{ctx.name}: falling back to openssl ca ({e})")
+        return None
+
+    def sign(self, pki, csr_file, crt_file, purpose, ca_key, ca_passfile, ca_cert, ca_conf):
+        ctx = self.context(pki, ca_key, ca_passfile, ca_cert, ca_conf)
+        with open(csr_file, "rb") as fp:
+            csr_data = fp.read()
+        cert = self._try_in_process(ctx, csr_data, purpose)
+        if cert is not None:
+            atomic_write(crt_file, cert.public_bytes(serialization.Encoding.PEM), mode="wb")
+            logging.info(f"Successfully created end entity certificate: {crt_file}")
+            return cert
+        with self._openssl_ca(ctx, csr_data) as conf:
+            sign_certificate(self.openssl, pki, csr_file, crt_file, purpose, ca_key, ca_passfile, ca_cert, conf)
+        return None
+
+    def sign_pem(self, pki, csr_data, purpose, ca_key, ca_passfile, ca_cert, ca_conf):
+        """Sign a CSR held in memory and return the certificate PEM; only the CA's own records hit the disk."""
+        ctx = self.context(pki, ca_key, ca_passfile, ca_cert, ca_conf)
+        cert = self._try_in_process(ctx, csr_data, purpose)
+        if cert is not None:
+            return cert.public_bytes(serialization.Encoding.PEM)
+        with self._openssl_ca(ctx, csr_data) as conf:
+            return sign_certificate_pem(self.openssl, pki, csr_data, purpose, ca_key, ca_passfile, ca_cert, conf)
+
+    def _sign_in_process(self, ctx, csr_data, purpose):
+        if b"-----BEGIN" in csr_data:
+            csr = x509.load_pem_x509_csr(csr_data)
+        else:
+            csr = x509.load_der_x509_csr(csr_data)
+        public_key = csr.public_key()  # UnsupportedAlgorithm for PQ leaf keys
+        if not csr.is_signature_valid:
+            raise ValueError("CSR signature verification failed")
+        subject = ctx.build_subject(csr)
+        algorithm = ctx.signature_hash()
+
+        now = datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+        builder = (
+            x509.CertificateBuilder()
+            .issuer_name(ctx.cert.subject)
+            .subject_name(subject)
+            .public_key(public_key)
+            .not_valid_before(now)
+            .not_valid_after(now + datetime.timedelta(days=self.days))
+        )
+        copied = {}
+        if ctx.copy_extensions in ("copy", "copyall"):
+            copied = {ext.oid: ext for ext in csr.extensions}
+        for build, critical in ctx.profiles[purpose]:
+            ext = build(csr)
+            if ext.oid in copied and ctx.copy_extensions == "copy":
+                del copied[ext.oid]
+            elif ext.oid in copied:
+                continue  # copyall: the request wins
+            builder = builder.add_extension(ext, critical=critical)
+        for ext in copied.values():
+            builder = builder.add_extension(ext.value, critical=ext.critical)
+
+        if ctx.state is not None:
+            with ctx.state.claim_subject(name_oneline(subject)):
+                cert = builder.serial_number(ctx.state.next_serial()).sign(ctx.key, algorithm)
+                self._write_newcert(ctx, cert)
+                ctx.state.record(cert)
+            return cert
+        with ctx.db_lock():
+            ctx.check_unique_subject(name_oneline(subject))
+            cert = builder.serial_number(ctx.next_serial()).sign(ctx.key, algorithm)
+            self._write_newcert(ctx, cert)
+            ctx.append_index(cert)
+        return cert
+
+    @staticmethod
+    def _write_newcert(ctx, cert):
+        pem = cert.public_bytes(serialization.Encoding.PEM)
+        atomic_write(os.path.join(ctx.new_certs_dir, f"{serial_to_hex(cert.serial_number)}.pem"), pem, mode="wb")
@@ -0,0 +1,220 @@
+import os
+import time
+import logging
+import threading
+import subprocess
+from datetime import datetime, timezone
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from caEngine import CAContext
+from pkiCrypto import run_openssl
+
+WATCHED = ("ca_key_file", "ca_passfile", "ca_cert", "ca_conf", "ca_chain")
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+class _Entry:
+    __slots__ = ("chain", "ca", "paths", "stamp", "ctx", "loaded_at", "generation")
+
+    def __init__(self, chain, ca, paths, stamp, ctx, generation):
+        self.chain = chain
+        self.ca = ca
+        self.paths = paths
+        self.stamp = stamp
+        self.ctx = ctx
+        self.loaded_at = time.time()
+        self.generation = generation
+
+
+class CARegistry:
+    """
+    Issuing CA contexts, loaded once and reloaded when their files change.
+
+    `resolve()` maps each chain to (CA name, paths) from the current config.
+    The watcher re-stats the key, passphrase, certificate, conf and chain of
+    every CA (and the config file, through `reload_config`). Changed
+    material is loaded only after it has stayed unchanged for one more
+    interval, since rotation scripts write the files one at a time. It is
+    validated off the request path and then swapped in atomically, and
+    listeners are called with the new context. Signs already running keep
+    the context they started with. CAs whose files did not change keep
+    their context and everything cached for it.
+    """
+
+    def __init__(self, signer, openssl, resolve, reload_config=None, config_file=None):
+        self.signer = signer
+        self.openssl = openssl
+        self.resolve = resolve
+        self.reload_config = reload_config
+        self.config_file = config_file
+        self._config_stamp = _stamp(config_file) if config_file else None
+        self._entries = {}
+        self._pending = {}
+        self._rejected = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"reloads": 0, "rejected": 0, "config_reloads": 0}
+        self.errors = {}
+
+    def subscribe(self, callback):
+        """callback(chain, ca_name, ctx) whenever a CA context is (re)loaded."""
+        self._listeners.append(callback)
+
+    def get(self, chain):
+        entry = self._entries.get(chain)
+        return entry.ctx if entry else None
+
+    def contexts(self):
+        return {chain: entry.ctx for chain, entry in list(self._entries.items())}
+
+    # -- loading --------------------------------------------------------------
+    def load(self):
+        """Load every CA now (startup); failures are logged and retried by the watcher."""
+        for chain, (ca, paths) in self.resolve().items():
+            try:
+                self._swap(chain, ca, paths, self._stamps(paths))
+            except Exception as e:
+                self.errors[chain] = str(e)
+                logging.warning(f"Could not load CA context for {chain}: {e}")
+
+    @staticmethod
+    def _stamps(paths):
+        return tuple(_stamp(paths[name]) for name in WATCHED)
+
+    def _swap(self, chain, ca, paths, stamp):
+        ctx = CAContext(chain, paths["ca_key_file"], paths["ca_passfile"], paths["ca_cert"], paths["ca_conf"])
+        self.validate(chain, ctx, paths)
+        with self._lock:
+            old = self._entries.get(chain)
+            self.signer.adopt(ctx, old.ctx if old else None)
+            self._entries[chain] = _Entry(chain, ca, paths, stamp, ctx, (old.generation + 1) if old else 1)
+            self.errors.pop(chain, None)
+        for callback in self._listeners:
+            try:
+                callback(chain, ca, ctx)
+            except Exception as e:
+                logging.error(f"CA registry listener failed for {ca}: {e!r}")
+        return old
+
+    def validate(self, chain, ctx, paths):
+        """Raise ValueError unless `ctx` is usable: valid CA cert, matching key, chain containing it."""
+        now = datetime.now(timezone.utc)
+        cert = ctx.cert
+        if not cert.not_valid_before_utc <= now < cert.not_valid_after_utc:
+            raise ValueError(f"{ctx.name}: certificate not valid now")
+        try:
+            if not cert.extensions.get_extension_for_class(x509.BasicConstraints).value.ca:
+                raise ValueError(f"{ctx.name}: certificate is not a CA")
+        except x509.ExtensionNotFound:
+            raise ValueError(f"{ctx.name}: certificate has no basicConstraints")
+        with open(paths["ca_chain"], "rb") as fp:
+            chain_certs = x509.load_pem_x509_certificates(fp.read())
+        if cert not in chain_certs:
+            raise ValueError(f"{ctx.name}: CA certificate missing from {paths['ca_chain']}")
+        if ctx.key is not None:
+            spki = (serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo)
+            matches = ctx.key.public_key().public_bytes(*spki) == cert.public_key().public_bytes(*spki)
+        else:
+            # PQ keys: compare what openssl derives from the key with the certificate's key
+            try:
+                key_pub = run_openssl(self.openssl, chain, [
+                    "pkey", "-in", paths["ca_key_file"], "-passin", f"file:{paths['ca_passfile']}", "-pubout",
+                ], op="pkey").stdout
+                cert_pub = run_openssl(self.openssl, chain, [
+                    "x509", "-in", paths["ca_cert"], "-pubkey", "-noout",
+                ], op="x509").stdout
+            except subprocess.CalledProcessError as e:
+                raise ValueError(f"{ctx.name}: key or certificate unreadable ({str(e.stderr).strip()})")
+            matches = key_pub.strip() == cert_pub.strip()
+        if not matches:
+            raise ValueError(f"{ctx.name}: private key does not match the certificate")
+        for name in ("database", "new_certs_dir"):
+            path = getattr(ctx, name)
+            if path and not os.path.exists(path):
+                raise ValueError(f"{ctx.name}: {name} {path} does not exist")
+
+    # -- watching -------------------------------------------------------------
+    def start(self, interval=10):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="ca-registry", daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                logging.error(f"CA registry check failed: {e!r}")
+
+    def _check_config(self):
+        stamp = _stamp(self.config_file)
+        if stamp == self._config_stamp:
+            return
+        self._config_stamp = stamp
+        try:
+            self.reload_config()
+            self._stats["config_reloads"] += 1
+            logging.info(f"Reloaded configuration from {self.config_file}")
+        except Exception as e:
+            self.errors["config"] = str(e)
+            logging.error(f"Configuration reload rejected, keeping the previous one: {e}")
+        else:
+            self.errors.pop("config", None)
+
+    def check(self):
+        """One watcher pass; returns the chains whose context was replaced."""
+        if self.config_file and self.reload_config:
+            self._check_config()
+        swapped = []
+        for chain, (ca, paths) in self.resolve().items():
+            stamp = self._stamps(paths)
+            entry = self._entries.get(chain)
+            current = (paths, stamp)
+            if entry is not None and (entry.paths, entry.stamp) == current:
+                self._pending.pop(chain, None)
+                continue
+            if self._rejected.get(chain) == current:
+                continue
+            if self._pending.get(chain) != current:
+                self._pending[chain] = current  # let the rotation settle first
+                continue
+            del self._pending[chain]
+            try:
+                self._swap(chain, ca, paths, stamp)
+            except Exception as e:
+                self._rejected[chain] = current
+                self._stats["rejected"] += 1
+                self.errors[chain] = str(e)
+                logging.error(f"Rejected new CA material for {chain}, keeping the loaded context: {e}")
+                continue
+            self._rejected.pop(chain, None)
+            self._stats["reloads"] += 1
+            swapped.append(chain)
+            logging.warning(f"CA {ca} ({chain}) reloaded from changed material")
+        return swapped
+
+    def stats(self):
+        entries = list(self._entries.values())
+        return dict(self._stats, errors=dict(self.errors), pending=sorted(self._pending), cas={
+            entry.chain: {
+                "ca": entry.ca,
+                "subject": entry.ctx.cert.subject.rfc4514_string(),
+                "serial": f"{entry.ctx.cert.serial_number:X}",
+                "not_after": entry.ctx.cert.not_valid_after_utc.isoformat(),
+                "in_process": entry.ctx.in_process,
+                "generation": entry.generation,
+                "loaded_at": entry.loaded_at,
+            }
+            for entry in entries
+        })
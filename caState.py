@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import errno
+import fcntl
+import atexit
+import shutil
+import socket
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+from cryptography import x509
+
+from caEngine import IndexEntry, read_index, atomic_write, serial_to_hex, name_oneline
+from retention import SegmentArchive
+
+
+def _ranges(serials):
+    """Sorted serials -> [[start, end), ...] runs."""
+    runs = []
+    for serial in serials:
+        if runs and runs[-1][1] == serial:
+            runs[-1][1] += 1
+        else:
+            runs.append([serial, serial + 1])
+    return runs
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+class CAState:
+    """
+    Serial leasing and journaled index writes for one OpenSSL CA database.
+
+    Each process leases a block of `lease_size` serials from the CA's serial
+    file and signs from it without holding the database lock. Issued
+    certificates are appended to a per-process journal under
+    `<database>.state/journal/`; `merge_journals` folds them into the
+    OpenSSL-compatible index whenever `CAContext.db_lock()` is taken (and
+    periodically through `maintain`). Leases of processes that died, or of
+    other nodes that stopped heartbeating for `stale_after` seconds, are
+    reclaimed: unused serials go back to a free list, certificates already
+    written to newcerts but never journaled are restored into the index.
+
+    With `unique_subject = yes` each signing holds a per-CA subject lock from
+    the check (against the index and the pending journals) until its entry
+    is journaled, so duplicates are refused like `openssl ca` does; those
+    signings are then serialized across processes.
+
+    The state directory lives next to the database, so nodes sharing a CA
+    need it on the same volume, with working `flock` (e.g. NFSv4).
+    """
+
+    def __init__(self, ctx, lease_size=32, stale_after=300):
+        self.ctx = ctx
+        self.lease_size = lease_size
+        self.stale_after = stale_after
+        self.host = socket.gethostname()
+        self.pid = os.getpid()
+        self.owner = f"{self.host}-{self.pid}"
+        self.dir = f"{ctx.database}.state"
+        self.lease_dir = os.path.join(self.dir, "leases")
+        self.journal_dir = os.path.join(self.dir, "journal")
+        self.scratch_dir = os.path.join(self.dir, "scratch")
+        for path in (self.lease_dir, self.journal_dir, self.scratch_dir):
+            os.makedirs(path, exist_ok=True)
+        self.free_file = os.path.join(self.dir, "free.json")
+        self.lease_file = os.path.join(self.lease_dir, f"{self.owner}.json")
+        self.journal_file = os.path.join(self.journal_dir, f"{self.owner}.log")
+        self.subject_lock_file = os.path.join(self.dir, "subjects.lock")
+        with open(ctx.ca_conf, "r") as fp:
+            self._conf_text = fp.read()
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._next = self._end = None
+        self._archive = None
+        self._stats = {"leases": 0, "issued": 0, "journaled": 0, "merged": 0, "reclaimed": 0, "restored": 0}
+        with ctx.db_lock():
+            self.merge_journals()
+            self._recover()
+        atexit.register(self.release)
+
+    def rebind(self, ctx):
+        """Follow a reloaded context of the same database (CA rotation)."""
+        with open(ctx.ca_conf, "r") as fp:
+            conf_text = fp.read()
+        with self._lock:
+            self.ctx, self._conf_text = ctx, conf_text
+        return self
+
+    # -- serials --------------------------------------------------------------
+    def next_serial(self):
+        with self._lock:
+            if self._next is None or self._next >= self._end:
+                self._lease()
+            serial = self._next
+            self._next += 1
+            self._stats["issued"] += 1
+        return serial
+
+    def _read_free(self):
+        try:
+            with open(self.free_file, "r") as fp:
+                return json.load(fp)
+        except FileNotFoundError:
+            return []
+
+    def _lease(self):
+        with self.ctx.db_lock():
+            free = self._read_free()
+            if free:
+                start, end = free.pop(0)
+                if end - start > self.lease_size:
+                    free.insert(0, [start + self.lease_size, end])
+                    end = start + self.lease_size
+                atomic_write(self.free_file, json.dumps(free))
+            else:
+                with open(self.ctx.serial_file, "r") as fp:
+                    start = int(fp.read().strip(), 16)
+                end = start + self.lease_size
+                atomic_write(self.ctx.serial_file, f"{serial_to_hex(end)}\n")
+            atomic_write(self.lease_file, json.dumps(
+                {"host": self.host, "pid": self.pid, "start": start, "end": end}))
+            self._next, self._end = start, end
+        self._stats["leases"] += 1
+        logging.debug(f"{self.ctx.name}: leased serials {serial_to_hex(start)}..{serial_to_hex(end - 1)}")
+
+    def release(self):
+        """Hand the unused rest of the lease back and merge the journal (clean shutdown)."""
+        with self._lock:
+            if self._next is None:
+                return
+            rest, self._next, self._end = [self._next, self._end], None, None
+        with self.ctx.db_lock():
+            self.merge_journals()
+            if rest[0] < rest[1]:
+                atomic_write(self.free_file, json.dumps(sorted(self._read_free() + [rest])))
+            for path in (self.lease_file, self.journal_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # -- journal --------------------------------------------------------------
+    def record(self, cert):
+        """Journal a certificate signed with a leased serial."""
+        self._append([IndexEntry("V", cert.not_valid_after_utc, None, None,
+                                 cert.serial_number, name_oneline(cert.subject))])
+
+    def _append(self, entries):
+        data = "".join(f"{entry.format()}\n" for entry in entries)
+        if not data:
+            return
+        with self._journal_lock, open(self.journal_file, "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            fp.write(data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self._stats["journaled"] += len(entries)
+
+    def _journaled_subjects(self):
+        """Subjects issued under a lease but not merged into the index yet."""
+        subjects = set()
+        for name in os.listdir(self.journal_dir):
+            try:
+                with open(os.path.join(self.journal_dir, name), "r") as fp:
+                    data = fp.read()
+            except FileNotFoundError:
+                continue  # reclaimed meanwhile: its entries are in the index
+            for line in data.split("\n")[:-1]:
+                entry = IndexEntry.parse(line)
+                if entry is not None and entry.status == "V":
+                    subjects.add(entry.subject)
+        return subjects
+
+    @contextmanager
+    def claim_subject(self, subject):
+        """
+        Refuse `subject` (oneline) if the CA enforces unique_subject and it is
+        already valid, and keep others from claiming it until its entry is
+        journaled inside this block.
+        """
+        if not self.ctx.unique_subject:
+            yield
+            return
+        with open(self.subject_lock_file, "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            self.ctx.check_unique_subject(subject, pending=self._journaled_subjects())
+            yield
+
+    def merge_journals(self):
+        """Fold every journal into the index. The caller holds `ctx.db_lock()`."""
+        index = None
+        for name in sorted(os.listdir(self.journal_dir)):
+            with open(os.path.join(self.journal_dir, name), "r+") as fp:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+                data = fp.read()
+                if not data:
+                    continue
+                if index is None:
+                    index = read_index(self.ctx.database)
+                # a torn last line (crash mid-append) is dropped; recovery restores it from newcerts
+                entries = [IndexEntry.parse(line) for line in data.split("\n")[:-1]]
+                new = [e for e in entries if e is not None and e.serial not in index]
+                self._append_index(new)
+                index.update((e.serial, e) for e in new)
+                fp.truncate(0)
+                os.fsync(fp.fileno())
+                self._stats["merged"] += len(new)
+
+    def _append_index(self, entries):
+        if not entries:
+            return
+        with open(self.ctx.database, "a") as fp:
+            fp.write("".join(f"{entry.format()}\n" for entry in entries))
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    # -- recovery -------------------------------------------------------------
+    def _dead(self, lease, path):
+        if lease.get("host") == self.host:
+            if lease.get("pid") == self.pid:
+                return self._next is None  # left over by an earlier process with our pid
+            return not _pid_alive(lease.get("pid", 0))
+        return time.time() - os.path.getmtime(path) > self.stale_after
+
+    def _archived(self, name):
+        """`name` from the newcerts segments the retention sweep packed it into, or None."""
+        if self._archive is None or self._archive.directory != self.ctx.new_certs_dir:
+            if not os.path.exists(os.path.join(self.ctx.new_certs_dir, "archive", "index.db")):
+                return None
+            self._archive = SegmentArchive(self.ctx.new_certs_dir)
+        return self._archive.read(name)
+
+    def _restore(self, serial):
+        """
+        Index entry for a certificate that reached newcerts but not the journal;
+        it may have been archived since if the lease went stale long ago.
+        """
+        name = f"{serial_to_hex(serial)}.pem"
+        try:
+            with open(os.path.join(self.ctx.new_certs_dir, name), "rb") as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            data = self._archived(name)
+        except OSError:
+            return None
+        try:
+            cert = x509.load_pem_x509_certificate(data) if data else None
+        except ValueError:
+            cert = None
+        if cert is None:
+            return None
+        return IndexEntry("V", cert.not_valid_after_utc, None, None,
+                          cert.serial_number, name_oneline(cert.subject))
+
+    def _recover(self):
+        """Reclaim dead leases. The caller holds `ctx.db_lock()` and has merged the journals."""
+        index = None
+        for name in os.listdir(self.lease_dir):
+            path = os.path.join(self.lease_dir, name)
+            try:
+                with open(path, "r") as fp:
+                    lease = json.load(fp)
+            except (OSError, ValueError):
+                continue
+            if not self._dead(lease, path):
+                continue
+            if index is None:
+                index = read_index(self.ctx.database)
+            unused, restored = [], []
+            for serial in range(lease["start"], lease["end"]):
+                if serial in index:
+                    continue
+                entry = self._restore(serial)
+                if entry is None:
+                    unused.append(serial)
+                else:
+                    restored.append(entry)
+            self._append_index(restored)
+            index.update((e.serial, e) for e in restored)
+            if unused:
+                atomic_write(self.free_file, json.dumps(sorted(self._read_free() + _ranges(unused))))
+            os.remove(path)
+            journal = os.path.join(self.journal_dir, f"{name[:-len('.json')]}.log")
+            if journal != self.journal_file and os.path.exists(journal):
+                os.remove(journal)
+            self._stats["reclaimed"] += len(unused)
+            self._stats["restored"] += len(restored)
+            logging.warning(f"{self.ctx.name}: reclaimed lease {name} "
+                            f"({len(unused)} serials freed, {len(restored)} entries restored)")
+
+    def maintain(self):
+        """Heartbeat our lease, merge journals and reclaim stale leases."""
+        if os.path.exists(self.lease_file):
+            os.utime(self.lease_file)
+        with self.ctx.db_lock():
+            self.merge_journals()
+            self._recover()
+
+    # -- openssl ca -----------------------------------------------------------
+    @contextmanager
+    def openssl_ca_conf(self):
+        """
+        CA conf for one `openssl ca` run on a leased serial with a scratch index;
+        the issued entry is journaled on exit, so runs need no database lock.
+        """
+        serial = self.next_serial()
+        scratch = tempfile.mkdtemp(prefix=f"{serial_to_hex(serial)}-", dir=self.scratch_dir)
+        database = os.path.join(scratch, "index.txt")
+        serial_file = os.path.join(scratch, "serial")
+        conf = os.path.join(scratch, "ca.conf")
+        open(database, "w").close()
+        with open(serial_file, "w") as fp:
+            fp.write(f"{serial_to_hex(serial)}\n")
+        with open(conf, "w") as fp:
+            # a repeated section extends the original one; later keys win
+            fp.write(f"{self._conf_text}\n[ {self.ctx.section_name} ]\n"
+                     f"database = {database}\nserial = {serial_file}\n")
+        try:
+            yield conf
+            self._append(read_index(database).values())
+        finally:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            remaining = 0 if self._next is None else self._end - self._next
+        return dict(self._stats, lease_remaining=remaining, free=sum(e - s for s, e in self._read_free()))
@@ -0,0 +1,138 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.serialization import pkcs7, pkcs12
+
+from pkiCrypto import run_openssl
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    "pem": ("application/x-pem-file", "pem"),
+    "der": ("application/pkix-cert", "der"),
+    "p7b": ("application/pkcs7-mime", "p7b"),
+    "p12": ("application/x-pkcs12", "p12"),
+}
+
+
+class _Chain:
+    __slots__ = ("stamp", "pem", "certs")
+
+    def __init__(self, stamp, pem):
+        self.stamp = stamp
+        self.pem = pem
+        self.certs = x509.load_pem_x509_certificates(pem)
+
+
+class FormatEngine:
+    """
+    Output formats of issued certificates, derived in-process on request.
+
+    - pem: the certificate, followed by the CA chain when one is given
+    - der: the certificate; with a chain, a PKCS#7 bundle (DER has no concatenated form)
+    - p7b: PKCS#7 certs-only (DER) of the certificate and chain
+    - p12: PKCS#12 with the private key when the caller still holds it
+
+    CA chains are read once per file version. Key-less results are kept in
+    an LRU bounded to `max_bytes`.
+    """
+
+    def __init__(self, openssl, max_bytes=8 * 1024 * 1024):
+        self.openssl = openssl
+        self.max_bytes = max_bytes
+        self._chains = {}
+        self._cache = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "chain_loads": 0}
+
+    # -- CA chains ------------------------------------------------------------
+    def _chain(self, path):
+        st = os.stat(path)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        entry = self._chains.get(path)
+        if entry is None or entry.stamp != stamp:
+            with open(path, "rb") as fp:
+                entry = _Chain(stamp, fp.read())
+            with self._lock:
+                self._chains[path] = entry
+                self._stats["chain_loads"] += 1
+        return entry
+
+    def chain_pem(self, path):
+        return self._chain(path).pem
+
+    # -- rendering ------------------------------------------------------------
+    def render(self, cert_pem, fmt, chain=None, key_pem=None, password=None, pki=None):
+        """`fmt` bytes for `cert_pem`; `chain` is the path of the CA chain PEM to bundle."""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unsupported output format: {fmt}")
+        ca = self._chain(chain) if chain else None
+        if fmt == "p12" and key_pem is not None:
+            return self._p12(cert_pem, ca, key_pem, password, pki)
+        key = (hashlib.sha256(cert_pem).digest(), fmt, chain, ca.stamp if ca else None)
+        with self._lock:
+            data = self._cache.get(key)
+            if data is not None:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return data
+            self._stats["misses"] += 1
+        data = self._derive(cert_pem, fmt, ca)
+        self._remember(key, data)
+        return data
+
+    def _derive(self, cert_pem, fmt, ca):
+        if fmt == "pem":
+            return cert_pem + ca.pem if ca else cert_pem
+        if fmt == "p12":
+            return self._p12(cert_pem, ca, None, None, None)
+        cert = x509.load_pem_x509_certificate(cert_pem)
+        if fmt == "der" and ca is None:
+            return cert.public_bytes(serialization.Encoding.DER)
+        return pkcs7.serialize_certificates([cert] + (ca.certs if ca else []), serialization.Encoding.DER)
+
+    def _p12(self, cert_pem, ca, key_pem, password, pki):
+        encryption = (serialization.BestAvailableEncryption(password.encode()) if password
+                      else serialization.NoEncryption())
+        cert = x509.load_pem_x509_certificate(cert_pem)
+        try:
+            key = serialization.load_pem_private_key(key_pem, password=None) if key_pem else None
+            return pkcs12.serialize_key_and_certificates(
+                None, key, cert, ca.certs if ca else None, encryption)
+        except (UnsupportedAlgorithm, ValueError, TypeError) as e:
+            logging.debug(f"In-process PKCS#12 failed ({e}), using openssl")
+        # PQ keys: `openssl pkcs12` reads -in twice, so only the (public) certs go to a file
+        with tempfile.NamedTemporaryFile(suffix=".pem") as certs:
+            certs.write(cert_pem + (ca.pem if ca else b""))
+            certs.flush()
+            return run_openssl(
+                self.openssl, pki,
+                ["pkcs12", "-export", "-in", certs.name, "-passout", "env:P12_PASS",
+                 *(["-inkey", "/dev/stdin"] if key_pem else ["-nokeys"])],
+                op="pkcs12", extra_env={"P12_PASS": password or ""}, text=False, input=key_pem,
+            ).stdout
+
+    def _remember(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = data
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                _, old = self._cache.popitem(last=False)
+                self._size -= len(old)
+                self._stats["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._cache), bytes=self._size,
+                        max_bytes=self.max_bytes, chains=len(self._chains))
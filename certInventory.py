@@ -0,0 +1,264 @@
+import os
+import glob
+import json
+import base64
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timezone
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives.asymmetric import rsa, ec, ed25519, ed448
+
+from caEngine import read_index, serial_to_hex
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS certificates (
+    ca          TEXT NOT NULL,
+    serial      TEXT NOT NULL,
+    pki         TEXT,
+    cert_id     TEXT,
+    common_name TEXT,
+    san         TEXT,
+    algorithm   TEXT,
+    not_before  TEXT,
+    not_after   TEXT,
+    status      TEXT NOT NULL,
+    revoked_at  TEXT,
+    path        TEXT,
+    PRIMARY KEY (ca, serial)
+);
+CREATE INDEX IF NOT EXISTS idx_certificates_cn ON certificates (common_name);
+CREATE INDEX IF NOT EXISTS idx_certificates_cert_id ON certificates (cert_id);
+CREATE INDEX IF NOT EXISTS idx_certificates_not_after ON certificates (not_after);
+CREATE INDEX IF NOT EXISTS idx_certificates_keyset ON certificates (not_after, ca, serial);
+CREATE INDEX IF NOT EXISTS idx_certificates_status ON certificates (status, not_after);
+"""
+
+COLUMNS = ("ca", "serial", "pki", "cert_id", "common_name", "san", "algorithm",
+           "not_before", "not_after", "status", "revoked_at", "path")
+
+STATUSES = {"V": "valid", "R": "revoked", "E": "valid"}
+
+
+def _iso(when):
+    return when.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if when else None
+
+def key_algorithm(cert):
+    """Short algorithm label for a certificate's public key."""
+    try:
+        key = cert.public_key()
+    except (UnsupportedAlgorithm, ValueError):
+        oid = cert.public_key_algorithm_oid
+        return getattr(oid, "_name", None) or oid.dotted_string
+    if isinstance(key, rsa.RSAPublicKey):
+        return f"rsa{key.key_size}"
+    if isinstance(key, ec.EllipticCurvePublicKey):
+        return f"ec-{key.curve.name}"
+    if isinstance(key, ed25519.Ed25519PublicKey):
+        return "ed25519"
+    if isinstance(key, ed448.Ed448PublicKey):
+        return "ed448"
+    return type(key).__name__
+
+def encode_cursor(row):
+    """Opaque keyset cursor for the page after `row`."""
+    return base64.urlsafe_b64encode(json.dumps([row["not_after"], row["ca"], row["serial"]]).encode()).decode()
+
+def decode_cursor(cursor):
+    """(not_after, ca, serial) from `encode_cursor`; ValueError when malformed."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not (isinstance(key, list) and len(key) == 3 and all(isinstance(k, str) for k in key)):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+def certificate_row(pki, ca, cert, path, cert_id=None, algorithm=None):
+    cn = cert.subject.get_attributes_for_oid(NameOID.COMMON_NAME)
+    try:
+        san_ext = cert.extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        san = ",".join(str(name.value) for name in san_ext)
+    except x509.ExtensionNotFound:
+        san = None
+    return {
+        "ca": ca,
+        "serial": serial_to_hex(cert.serial_number),
+        "pki": pki,
+        "cert_id": cert_id,
+        "common_name": cn[0].value if cn else None,
+        "san": san,
+        "algorithm": algorithm or key_algorithm(cert),
+        "not_before": _iso(cert.not_valid_before_utc),
+        "not_after": _iso(cert.not_valid_after_utc),
+        "status": "valid",
+        "revoked_at": None,
+        "path": path,
+    }
+
+
+class CertificateInventory:
+    """
+    Indexed record of every issued certificate, kept in SQLite.
+
+    Rows are written right after each issue or revoke, not atomically with
+    the OpenSSL database: a crash in between leaves the inventory behind, and
+    `backfill` (run for every CA on startup) reconciles it from the OpenSSL
+    databases and `newcerts` directories.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._conn() as conn:
+            conn.executescript(SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # -- writes ---------------------------------------------------------------
+    def record_issued(self, pki, ca, cert_pem, path=None, cert_id=None, algorithm=None, newcerts_dir=None):
+        """Insert a freshly issued certificate; `path` defaults to newcerts/<SERIAL>.pem."""
+        cert = x509.load_pem_x509_certificate(cert_pem)
+        if path is None:
+            path = os.path.join(newcerts_dir, f"{serial_to_hex(cert.serial_number)}.pem")
+        row = certificate_row(pki, ca, cert, path, cert_id, algorithm)
+        with self._conn() as conn:
+            conn.execute(
+                f"INSERT INTO certificates ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                "ON CONFLICT (ca, serial) DO UPDATE SET "
+                "cert_id = COALESCE(excluded.cert_id, cert_id), path = excluded.path, "
+                "algorithm = excluded.algorithm",
+                [row[c] for c in COLUMNS],
+            )
+        return row
+
+    def record_revoked(self, ca, serial, revoked_at=None):
+        with self._conn() as conn:
+            conn.execute(
+                "UPDATE certificates SET status = 'revoked', revoked_at = ? WHERE ca = ? AND serial = ?",
+                (_iso(revoked_at or datetime.now(timezone.utc)), ca, serial_to_hex(serial)),
+            )
+
+    def backfill(self, pki, ca, database, newcerts_dir):
+        """Reconcile the inventory with an OpenSSL CA database and its newcerts dir."""
+        entries = read_index(database)
+        conn = self._conn()
+        known = {
+            row["serial"]: row
+            for row in conn.execute("SELECT serial, status, cert_id FROM certificates WHERE ca = ?", (ca,))
+        }
+        added = updated = 0
+        with conn:
+            for serial, entry in entries.items():
+                hex_serial = serial_to_hex(serial)
+                status = STATUSES.get(entry.status, "valid")
+                if hex_serial in known:
+                    if known[hex_serial]["status"] != status:
+                        conn.execute(
+                            "UPDATE certificates SET status = ?, revoked_at = ? WHERE ca = ? AND serial = ?",
+                            (status, _iso(entry.revoked), ca, hex_serial),
+                        )
+                        updated += 1
+                    continue
+                path = os.path.join(newcerts_dir, f"{hex_serial}.pem")
+                try:
+                    with open(path, "rb") as fp:
+                        row = certificate_row(pki, ca, x509.load_pem_x509_certificate(fp.read()), path)
+                except (OSError, ValueError):
+                    row = dict.fromkeys(COLUMNS)
+                    row.update(ca=ca, serial=hex_serial, pki=pki, not_after=_iso(entry.expires))
+                    cn = [part[3:] for part in entry.subject.split("/") if part.startswith("CN=")]
+                    row["common_name"] = cn[0] if cn else None
+                row.update(status=status, revoked_at=_iso(entry.revoked))
+                # issuance may have recorded it since `known` was read
+                cursor = conn.execute(
+                    f"INSERT INTO certificates ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+                    "ON CONFLICT (ca, serial) DO NOTHING",
+                    [row[c] for c in COLUMNS],
+                )
+                added += cursor.rowcount
+
+            known_ids = {
+                row[0] for row in conn.execute(
+                    "SELECT cert_id FROM certificates WHERE ca = ? AND cert_id IS NOT NULL", (ca,))
+            }
+            for path in glob.glob(os.path.join(newcerts_dir, "*-cert.pem")):
+                cert_id = os.path.basename(path)[:-len("-cert.pem")]
+                if cert_id in known_ids:
+                    continue
+                try:
+                    with open(path, "rb") as fp:
+                        cert = x509.load_pem_x509_certificate(fp.read())
+                except (OSError, ValueError):
+                    continue
+                conn.execute(
+                    "UPDATE certificates SET cert_id = ?, path = ? WHERE ca = ? AND serial = ?",
+                    (cert_id, path, ca, serial_to_hex(cert.serial_number)),
+                )
+        logging.info(f"Inventory backfill for {ca}: {added} added, {updated} updated")
+        return added, updated
+
+    # -- reads ----------------------------------------------------------------
+    def get(self, ca, serial):
+        row = self._conn().execute(
+            "SELECT * FROM certificates WHERE ca = ? AND serial = ?", (ca, serial_to_hex(serial))
+        ).fetchone()
+        return dict(row) if row else None
+
+    def find_by_cert_id(self, cert_id):
+        row = self._conn().execute("SELECT * FROM certificates WHERE cert_id = ?", (cert_id,)).fetchone()
+        return dict(row) if row else None
+
+    def query(self, cn=None, serial=None, ca=None, status=None,
+              expires_after=None, expires_before=None, cursor=None, per_page=50):
+        """
+        One page of matches ordered by (not_after, ca, serial). Pages are keyset
+        based: pass the returned `next_cursor` to get the following one.
+        """
+        clauses, params = [], []
+        if cn:
+            clauses.append("common_name = ?")
+            params.append(cn)
+        if serial is not None:
+            clauses.append("serial = ?")
+            params.append(serial_to_hex(serial))
+        if ca:
+            clauses.append("ca = ?")
+            params.append(ca)
+        now = _iso(datetime.now(timezone.utc))
+        if status == "revoked":
+            clauses.append("status = 'revoked'")
+        elif status == "expired":
+            clauses.append("status = 'valid' AND not_after < ?")
+            params.append(now)
+        elif status == "valid":
+            clauses.append("status = 'valid' AND not_after >= ?")
+            params.append(now)
+        if expires_after:
+            clauses.append("not_after >= ?")
+            params.append(_iso(expires_after))
+        if expires_before:
+            clauses.append("not_after < ?")
+            params.append(_iso(expires_before))
+        if cursor:
+            clauses.append("(not_after, ca, serial) > (?, ?, ?)")
+            params.extend(decode_cursor(cursor))
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn().execute(
+            f"SELECT * FROM certificates {where} ORDER BY not_after, ca, serial LIMIT ?",
+            params + [per_page + 1],
+        ).fetchall()
+        items = [dict(r) for r in rows[:per_page]]
+        next_cursor = encode_cursor(items[-1]) if len(rows) > per_page else None
+        return {"per_page": per_page, "items": items, "next_cursor": next_cursor}
@@ -0,0 +1,475 @@
+import os
+import time
+import base64
+import binascii
+import logging
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature, UnsupportedAlgorithm
+from cryptography.hazmat.primitives import serialization
+
+from crlIndex import iter_revoked, REASON_NAMES, NO_REASON
+from opensslPool import WorkerError
+from pkiCrypto import run_openssl, openssl_env_name
+
+STATUSES = ("valid", "expired", "not_yet_valid", "revoked", "unknown_issuer", "bad_signature", "malformed")
+SIGNATURE_METHODS = ("pooled", "in_process", "cli")
+
+REMOVE_FROM_CRL = 8  # delta CRL entry un-revoking a certificateHold
+MAX_CERT_BYTES = 1024 * 1024
+_PEM_BEGIN = b"-----BEGIN CERTIFICATE-----"
+_PEM_END = b"-----END CERTIFICATE-----"
+DER = serialization.Encoding.DER
+PEM = serialization.Encoding.PEM
+
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _read_exact(stream, size):
+    chunks = []
+    while size > 0:
+        chunk = stream.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+def _iter_der(stream, head, name):
+    index = 0
+    while head:
+        index += 1
+        header = head + _read_exact(stream, 1)
+        if len(header) < 2:
+            yield f"{name}#{index}", header
+            return
+        length = header[1]
+        if length & 0x80:
+            size = _read_exact(stream, length & 0x7F)
+            header += size
+            length = int.from_bytes(size, "big")
+        if length > MAX_CERT_BYTES:
+            yield f"{name}#{index}", header  # cannot resynchronise past it
+            return
+        body = _read_exact(stream, length)
+        yield f"{name}#{index}", header + body
+        if len(body) < length:
+            return
+        head = stream.read(1)
+
+def _iter_pem(stream, head, name):
+    index, block, inside = 0, [], False
+    line = head + stream.readline(65536)
+    while line:
+        line = line.strip()
+        if line == _PEM_BEGIN:
+            inside, block = True, []
+        elif inside and line == _PEM_END:
+            inside = False
+            index += 1
+            try:
+                der = base64.b64decode(b"".join(block))
+            except binascii.Error:
+                der = b""
+            yield f"{name}#{index}", der
+        elif inside:
+            block.append(line)
+            if len(block) * 64 > MAX_CERT_BYTES * 4 // 3:
+                inside = False
+                index += 1
+                yield f"{name}#{index}", b""
+        line = stream.readline(65536)
+
+def iter_certificates(stream, name="upload"):
+    """
+    Yield (label, DER) for each certificate in `stream`, a PEM bundle or
+    concatenated DER certificates, read incrementally. Input that does not
+    decode is yielded as is, to be reported as malformed.
+    """
+    head = stream.read(1)
+    if not head:
+        return
+    if head == b"\x30":
+        yield from _iter_der(stream, head, name)
+    else:
+        yield from _iter_pem(stream, head, name)
+
+
+class _CA:
+    __slots__ = ("chain", "cert", "der", "subject", "ski", "issuer", "revoked", "crl_next_update")
+
+    def __init__(self, chain, cert):
+        self.chain = chain
+        self.cert = cert
+        self.der = cert.public_bytes(DER)
+        self.subject = cert.subject.rfc4514_string()
+        try:
+            self.ski = cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value.digest
+        except x509.ExtensionNotFound:
+            self.ski = None
+        self.issuer = None  # the _CA that signed this one; None for the root
+        self.revoked = None  # serial -> (epoch, reason code) from this CA's CRL; None without a CRL
+        self.crl_next_update = None
+
+
+class TrustStore:
+    """
+    CA certificates of every chain, parsed once, with the serial set of each
+    CA's current CRL (base, then delta). `resolve()` maps each chain to its
+    certificate and CRL files. Those are stat()ed at most every `check_interval` seconds and a
+    chain is reloaded when one of them changed. CA-to-CA signatures and CRL
+    signatures are checked at load. A chain whose new files do not check out
+    keeps the previous load.
+    """
+
+    def __init__(self, resolve, verify, verify_crl, check_interval=5):
+        self.resolve = resolve  # () -> {chain: ([certificate files], [CRL files])}
+        self.verify = verify  # (issuer _CA, [DER]) -> [bool]
+        self.verify_crl = verify_crl  # (issuer _CA, CRL file) -> bool, for keys cryptography cannot use
+        self.check_interval = check_interval
+        self._chains = {}  # chain -> (stamp, [_CA], loaded at)
+        self._by_subject = {}  # subject DER -> [_CA]
+        self._checked = None
+        self._lock = threading.Lock()
+        self._stats = {"loads": 0, "errors": 0}
+        self.errors = {}
+
+    def invalidate(self):
+        """Re-check the files on the next snapshot (e.g. a CRL was just published)."""
+        self._checked = None
+
+    def snapshot(self):
+        """{subject DER: [_CA]} over all chains, reloading changed chains first."""
+        with self._lock:
+            now = time.monotonic()
+            if self._checked is None or now - self._checked >= self.check_interval:
+                self._checked = now
+                self._refresh()
+            return self._by_subject
+
+    def _refresh(self):
+        changed = False
+        for chain, (cert_files, crl_files) in self.resolve().items():
+            stamp = tuple(_stamp(path) for path in (*cert_files, *crl_files))
+            loaded = self._chains.get(chain)
+            if loaded is not None and loaded[0] == stamp:
+                continue
+            try:
+                cas = self._load(chain, cert_files, crl_files)
+            except (OSError, ValueError) as e:
+                self._stats["errors"] += 1
+                self.errors[chain] = str(e)
+                logging.error(f"Could not load trust anchors for {chain}, keeping the previous ones: {e}")
+                self._chains[chain] = (stamp, *(loaded[1:] if loaded else ([], None)))
+                continue
+            self._chains[chain] = (stamp, cas, time.time())
+            self.errors.pop(chain, None)
+            self._stats["loads"] += 1
+            changed = True
+            logging.info(f"Loaded {len(cas)} trust anchors for {chain}")
+        if changed:
+            by_subject = {}
+            for _, cas, _ in self._chains.values():
+                for ca in cas:
+                    by_subject.setdefault(ca.cert.subject.public_bytes(), []).append(ca)
+            self._by_subject = by_subject
+
+    def _load(self, chain, cert_files, crl_files):
+        cas, seen = [], set()
+        for path in cert_files:
+            with open(path, "rb") as fp:
+                for cert in x509.load_pem_x509_certificates(fp.read()):
+                    ca = _CA(chain, cert)
+                    if ca.der not in seen:
+                        seen.add(ca.der)
+                        cas.append(ca)
+        for ca in cas:
+            if ca.cert.issuer == ca.cert.subject:
+                continue  # root: trusted as configured
+            for candidate in cas:
+                if candidate.cert.subject == ca.cert.issuer and self.verify(candidate, [ca.der])[0]:
+                    ca.issuer = candidate
+                    break
+            else:
+                raise ValueError(f"{ca.subject}: no issuer in the chain verifies its signature")
+        for path in crl_files:
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as fp:
+                data = fp.read()
+            crl = x509.load_pem_x509_crl(data) if b"-----BEGIN" in data else x509.load_der_x509_crl(data)
+            owner = next((ca for ca in cas if ca.cert.subject == crl.issuer), None)
+            if owner is None:
+                raise ValueError(f"{path}: CRL issuer {crl.issuer.rfc4514_string()} is not in the chain")
+            try:
+                signed = crl.is_signature_valid(owner.cert.public_key())
+            except UnsupportedAlgorithm:
+                signed = self.verify_crl(owner, path)
+            if not signed:
+                raise ValueError(f"{path}: CRL signature does not verify with {owner.subject}")
+            try:
+                crl.extensions.get_extension_for_class(x509.DeltaCRLIndicator)
+                delta = True
+            except x509.ExtensionNotFound:
+                delta = False
+            if not delta or owner.revoked is None:
+                owner.revoked = {}
+            for serial, when, reason in iter_revoked(crl.public_bytes(DER)):
+                if delta and reason == REMOVE_FROM_CRL:
+                    owner.revoked.pop(serial, None)
+                else:
+                    owner.revoked[serial] = (when, reason)
+            if not delta:
+                owner.crl_next_update = crl.next_update_utc
+        return cas
+
+    def stats(self):
+        with self._lock:
+            chains = {
+                chain: {
+                    "loaded_at": loaded_at,
+                    "cas": {
+                        ca.subject: {"crl_entries": None if ca.revoked is None else len(ca.revoked)}
+                        for ca in cas
+                    },
+                }
+                for chain, (_, cas, loaded_at) in self._chains.items()
+            }
+            return dict(self._stats, errors=dict(self.errors), chains=chains)
+
+
+class ChainValidator:
+    """
+    Batch validation of certificates against the chains in a TrustStore.
+
+    Issuers are looked up by name and key identifier. Each certificate's
+    signature is checked by the pooled OpenSSL workers of its chain's
+    environment, `chunk` certificates per job, with jobs spread over up to
+    `workers` workers at a time. Signatures the pool cannot check are
+    verified in-process, or with `openssl verify` for keys cryptography
+    does not support (composite); their CRLs likewise with `openssl crl`.
+    Revocation against the CRL serial sets and validity periods of the whole
+    path are checked in-process.
+    """
+
+    def __init__(self, openssl, resolve, pool=None, workers=4, chunk=64, check_interval=5):
+        self.openssl = openssl
+        self.pool = pool
+        self.chunk = chunk
+        self.store = TrustStore(resolve, self.verify, self.verify_crl, check_interval)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chain-verify")
+        self._pool_started = False
+        self._lock = threading.Lock()
+        self._stats = {"batches": 0, "certificates": 0, "seconds": 0.0}
+        self._statuses = dict.fromkeys(STATUSES, 0)
+        self._signatures = dict.fromkeys(SIGNATURE_METHODS, 0)
+
+    # -- signatures -----------------------------------------------------------
+    def _start_pool(self):
+        with self._lock:
+            if not self._pool_started:
+                self._pool_started = True
+                self.pool.start()
+
+    def _count(self, method, n):
+        with self._lock:
+            self._signatures[method] += n
+
+    def verify(self, ca, ders):
+        """Whether `ca`'s key verifies the signature of each DER certificate in `ders`."""
+        results = [None] * len(ders)
+        if self.pool is not None:
+            self._start_pool()
+            try:
+                results = self.pool.call(
+                    openssl_env_name(ca.chain), "verify", wait=self.pool.timeout,
+                    issuer=base64.b64encode(ca.der).decode(), certs=[base64.b64encode(der).decode() for der in ders],
+                )
+                self._count("pooled", sum(ok is not None for ok in results))
+            except WorkerError as e:
+                logging.warning(f"Pooled signature verification failed, verifying in-process: {e}")
+        in_process, unsupported = 0, []
+        for n, ok in enumerate(results):
+            if ok is not None:
+                continue
+            try:
+                x509.load_der_x509_certificate(ders[n]).verify_directly_issued_by(ca.cert)
+                results[n] = True
+            except (InvalidSignature, ValueError, TypeError):
+                results[n] = False
+            except UnsupportedAlgorithm:
+                unsupported.append(n)
+                continue
+            in_process += 1
+        self._count("in_process", in_process)
+        if unsupported:
+            for n, ok in zip(unsupported, self._verify_cli(ca, [ders[n] for n in unsupported])):
+                results[n] = ok
+            self._count("cli", len(unsupported))
+        return results
+
+    def _verify_cli(self, ca, ders):
+        with tempfile.TemporaryDirectory(prefix="chain_verify_") as tmp:
+            anchor = os.path.join(tmp, "issuer.pem")
+            with open(anchor, "wb") as fp:
+                fp.write(ca.cert.public_bytes(PEM))
+            files = []
+            for n, der in enumerate(ders):
+                path = os.path.join(tmp, f"{n}.pem")
+                with open(path, "wb") as fp:
+                    fp.write(x509.load_der_x509_certificate(der).public_bytes(PEM))
+                files.append(path)
+            try:
+                out = run_openssl(self.openssl, ca.chain, [
+                    "verify", "-partial_chain", "-no_check_time", "-CAfile", anchor, *files,
+                ], op="verify").stdout
+            except subprocess.CalledProcessError as e:
+                out = e.stdout or ""  # some failed; the others still print OK
+            ok = {line[:-len(": OK")] for line in out.splitlines() if line.endswith(": OK")}
+            return [path in ok for path in files]
+
+    def verify_crl(self, ca, path):
+        """Whether `ca`'s key verifies the CRL file at `path`, checked by `openssl crl`."""
+        with open(path, "rb") as fp:
+            inform = "PEM" if b"-----BEGIN" in fp.read(64) else "DER"
+        with tempfile.TemporaryDirectory(prefix="crl_verify_") as tmp:
+            anchor = os.path.join(tmp, "issuer.pem")
+            with open(anchor, "wb") as fp:
+                fp.write(ca.cert.public_bytes(PEM))
+            try:
+                result = run_openssl(self.openssl, ca.chain, [
+                    "crl", "-in", path, "-inform", inform, "-CAfile", anchor, "-noout",
+                ], op="crl")
+            except subprocess.CalledProcessError:
+                return False
+        self._count("cli", 1)
+        # openssl crl reports a bad signature on stderr but still exits 0
+        return "verify OK" in result.stderr
+
+    # -- validation -----------------------------------------------------------
+    @staticmethod
+    def _candidates(cert, by_subject, chain):
+        cas = [ca for ca in by_subject.get(cert.issuer.public_bytes(), ()) if chain is None or ca.chain == chain]
+        try:
+            aki = cert.extensions.get_extension_for_class(x509.AuthorityKeyIdentifier).value.key_identifier
+        except (x509.ExtensionNotFound, ValueError):
+            aki = None
+        if aki is not None:
+            cas = [ca for ca in cas if ca.ski is None or ca.ski == aki]
+        return cas
+
+    def _verify_all(self, pending):
+        jobs = {}
+        for i, (_, _, der, candidates) in enumerate(pending):
+            for ca in candidates:
+                jobs.setdefault(ca, []).append((i, der))
+        futures = []
+        for ca, entries in jobs.items():
+            for n in range(0, len(entries), self.chunk):
+                part = entries[n:n + self.chunk]
+                futures.append((ca, part, self._executor.submit(self.verify, ca, [der for _, der in part])))
+        verdicts = {}
+        for ca, part, future in futures:
+            for (i, _), ok in zip(part, future.result()):
+                verdicts[i, ca] = ok
+        return verdicts
+
+    @staticmethod
+    def _check_path(result, cert, issuer, now):
+        result["chain"] = issuer.chain
+        result["not_after"] = cert.not_valid_after_utc.isoformat()
+        path = [(cert, result["subject"], issuer)]
+        ca = issuer
+        while ca is not None:
+            path.append((ca.cert, ca.subject, ca.issuer))
+            ca = ca.issuer
+        warnings = []
+        revoked = expired = not_yet_valid = None
+        for subject_cert, subject, signer in path:
+            if subject_cert.not_valid_after_utc < now:
+                expired = expired or subject
+            elif subject_cert.not_valid_before_utc > now:
+                not_yet_valid = not_yet_valid or subject
+            if signer is None:
+                continue
+            if signer.revoked is None:
+                warnings.append(f"no CRL for {signer.subject}")
+                continue
+            if signer.crl_next_update is not None and signer.crl_next_update < now:
+                warnings.append(f"CRL of {signer.subject} is past its nextUpdate")
+            entry = signer.revoked.get(subject_cert.serial_number)
+            if entry is not None and revoked is None:
+                revoked = subject
+                when, reason = entry
+                result["revoked_at"] = datetime.fromtimestamp(when, timezone.utc).isoformat()
+                result["reason"] = REASON_NAMES[reason] if reason != NO_REASON else None
+        if revoked:
+            result["status"] = "revoked"
+        elif expired:
+            result["status"] = "expired"
+        elif not_yet_valid:
+            result["status"] = "not_yet_valid"
+        else:
+            result["status"] = "valid"
+        culprit = revoked or expired or not_yet_valid
+        if culprit and culprit != result["subject"]:
+            result["ca"] = culprit  # the leaf is fine, a CA on its path is not
+        if warnings:
+            result["warnings"] = warnings
+
+    def validate(self, items, chain=None):
+        """A result dict per (label, DER) in `items`, in order; only certificates issued under `chain` if given."""
+        start = time.perf_counter()
+        by_subject = self.store.snapshot()
+        now = datetime.now(timezone.utc)
+        results, pending = [], []
+        for label, der in items:
+            result = {"name": label}
+            results.append(result)
+            try:
+                cert = x509.load_der_x509_certificate(der)
+                result.update(
+                    subject=cert.subject.rfc4514_string(),
+                    issuer=cert.issuer.rfc4514_string(),
+                    serial=f"{cert.serial_number:X}",
+                )
+            except ValueError as e:
+                result.update(status="malformed", error=str(e))
+                continue
+            candidates = self._candidates(cert, by_subject, chain)
+            if not candidates:
+                result["status"] = "unknown_issuer"
+                continue
+            pending.append((result, cert, der, candidates))
+
+        verdicts = self._verify_all(pending)
+        for i, (result, cert, _, candidates) in enumerate(pending):
+            issuer = next((ca for ca in candidates if verdicts.get((i, ca))), None)
+            if issuer is None:
+                result["status"] = "bad_signature"
+                continue
+            self._check_path(result, cert, issuer, now)
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["certificates"] += len(results)
+            self._stats["seconds"] += time.perf_counter() - start
+            for result in results:
+                self._statuses[result["status"]] += 1
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, statuses=dict(self._statuses), signatures=dict(self._signatures))
+        stats["trust_store"] = self.store.stats()
+        return stats
@@ -0,0 +1,163 @@
+import bisect
+import calendar
+from array import array
+from datetime import datetime, timezone
+
+from cryptography import x509
+from cryptography.x509.oid import ExtensionOID
+
+from caEngine import serial_to_hex
+
+# RFC 5280 CRLReason codes, named as in index.txt (code 7 is unused)
+REASON_NAMES = (
+    "unspecified", "keyCompromise", "CACompromise", "affiliationChanged", "superseded",
+    "cessationOfOperation", "certificateHold", None, "removeFromCRL", "privilegeWithdrawn",
+    "AACompromise",
+)
+NO_REASON = 0xFF
+
+_SEQUENCE, _INTEGER, _UTCTIME, _GENTIME, _OCTETS, _ENUMERATED = 0x30, 0x02, 0x17, 0x18, 0x04, 0x0A
+_REASON_OID = b"\x55\x1d\x15"  # 2.5.29.21
+
+
+def der_tlv(buf, pos):
+    """(tag, value start, value end) of the DER element at `pos`."""
+    tag, length = buf[pos], buf[pos + 1]
+    pos += 2
+    if length & 0x80:
+        n = length & 0x7F
+        length = int.from_bytes(buf[pos:pos + n], "big")
+        pos += n
+    end = pos + length
+    if end > len(buf):
+        raise ValueError("Truncated DER element")
+    return tag, pos, end
+
+def _time(buf, tag, start, end):
+    text = bytes(buf[start:end]).decode("ascii").rstrip("Z")
+    if tag == _UTCTIME:
+        year = int(text[:2])
+        text = f"{1900 + year if year >= 50 else 2000 + year}{text[2:]}"
+    return calendar.timegm((int(text[:4]), int(text[4:6]), int(text[6:8]),
+                            int(text[8:10]), int(text[10:12]), int(text[12:14] or 0)))
+
+def _reason(buf, start, end):
+    pos = start
+    while pos < end:
+        _, ext, ext_end = der_tlv(buf, pos)
+        _, oid, oid_end = der_tlv(buf, ext)
+        if buf[oid:oid_end] == _REASON_OID:
+            tag, value, value_end = der_tlv(buf, oid_end)
+            if tag != _OCTETS:  # critical flag
+                tag, value, value_end = der_tlv(buf, value_end)
+            tag, code, _ = der_tlv(buf, value)
+            if tag == _ENUMERATED:
+                return buf[code]
+        pos = ext_end
+    return NO_REASON
+
+def iter_revoked(der):
+    """
+    Yield (serial, revocation epoch, reason code) for each entry of a DER CRL,
+    walking the encoding in place; nothing but the three fields is decoded.
+    """
+    buf = memoryview(der)
+    _, outer, _ = der_tlv(buf, 0)
+    _, pos, tbs_end = der_tlv(buf, outer)
+    tag, _, end = der_tlv(buf, pos)  # version, or signature when v1
+    if tag == _INTEGER:
+        _, _, end = der_tlv(buf, end)  # signature
+    _, _, end = der_tlv(buf, end)  # issuer
+    _, _, end = der_tlv(buf, end)  # thisUpdate
+    if end >= tbs_end:
+        return
+    tag, start, end = der_tlv(buf, end)
+    if tag in (_UTCTIME, _GENTIME):  # nextUpdate
+        if end >= tbs_end:
+            return
+        tag, start, end = der_tlv(buf, end)
+    if tag != _SEQUENCE:  # no revokedCertificates, only crlExtensions
+        return
+    pos = start
+    while pos < end:
+        _, entry, entry_end = der_tlv(buf, pos)
+        _, s, e = der_tlv(buf, entry)
+        serial = int.from_bytes(buf[s:e], "big", signed=True)
+        tag, s, e = der_tlv(buf, e)
+        revoked = _time(buf, tag, s, e)
+        reason = NO_REASON
+        if e < entry_end:
+            _, s, e = der_tlv(buf, e)
+            reason = _reason(buf, s, e)
+        yield serial, revoked, reason
+        pos = entry_end
+
+
+class CRLIndex:
+    """
+    Revoked entries of one CRL in serial order, held as flat arrays, with a
+    revocation-date permutation for range lookups. Built once per CRL file
+    version (see `pkiCache.Artifact.derived`).
+    """
+
+    def __init__(self, der, parsed=None):
+        entries = sorted(iter_revoked(der))
+        self.serials = [serial for serial, _, _ in entries]
+        self.revoked = array("q", (revoked for _, revoked, _ in entries))
+        self.reasons = bytes(reason for _, _, reason in entries)
+        self.by_date = array("l", sorted(range(len(entries)), key=self.revoked.__getitem__))
+        self.dates = array("q", (self.revoked[i] for i in self.by_date))
+        self.header = self._header(parsed)
+
+    def _header(self, crl):
+        header = {"entries": len(self.serials)}
+        if crl is None:
+            return header
+        header.update(
+            issuer=crl.issuer.rfc4514_string(),
+            this_update=crl.last_update_utc.isoformat(),
+            next_update=crl.next_update_utc.isoformat() if crl.next_update_utc else None,
+            signature_algorithm=crl.signature_algorithm_oid.dotted_string,
+        )
+        for oid, key in ((ExtensionOID.CRL_NUMBER, "crl_number"), (ExtensionOID.DELTA_CRL_INDICATOR, "base_crl_number")):
+            try:
+                header[key] = crl.extensions.get_extension_for_oid(oid).value.crl_number
+            except x509.ExtensionNotFound:
+                pass
+        return header
+
+    def __len__(self):
+        return len(self.serials)
+
+    def entry(self, i):
+        reason = self.reasons[i]
+        return {
+            "serial": serial_to_hex(self.serials[i]),
+            "revoked_at": datetime.fromtimestamp(self.revoked[i], timezone.utc).isoformat(),
+            "reason": REASON_NAMES[reason] if reason < len(REASON_NAMES) else None,
+        }
+
+    def query(self, serial=None, revoked_after=None, revoked_before=None, page=1, per_page=50):
+        """
+        One page of entries: the entry for `serial`, entries revoked in
+        [`revoked_after`, `revoked_before`) in date order, or all in serial order.
+        """
+        if serial is not None:
+            i = bisect.bisect_left(self.serials, serial)
+            rows = [i] if i < len(self.serials) and self.serials[i] == serial else []
+        elif revoked_after or revoked_before:
+            lo = bisect.bisect_left(self.dates, int(revoked_after.timestamp())) if revoked_after else 0
+            hi = bisect.bisect_left(self.dates, int(revoked_before.timestamp())) if revoked_before else len(self.dates)
+            rows = range(lo, max(lo, hi))
+        else:
+            rows = range(len(self.serials))
+        first = (page - 1) * per_page
+        window = rows[first:first + per_page]
+        if serial is None and (revoked_after or revoked_before):
+            window = [self.by_date[i] for i in window]
+        return {
+            "total": len(rows),
+            "page": page,
+            "per_page": per_page,
+            "items": [self.entry(i) for i in window],
+        }
@@ -0,0 +1,310 @@
+import os
+import time
+import logging
+import tempfile
+import threading
+import datetime
+
+from cryptography import x509
+from cryptography.hazmat.primitives import serialization
+
+from caEngine import read_index, atomic_write, serial_to_hex, REVOCATION_REASONS
+from pkiCrypto import run_openssl
+
+
+def delta_crl_path(crl_path):
+    """`qubip-tls-ca.crl` -> `qubip-tls-ca-delta.crl`, next to the base CRL."""
+    root, ext = os.path.splitext(crl_path)
+    return f"{root}-delta{ext or '.crl'}"
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+def _der_integer(value):
+    """`DER:` form of an INTEGER, for extensions openssl cannot parse from conf text."""
+    content = value.to_bytes(value.bit_length() // 8 + 1, "big")
+    return "DER:" + ":".join(f"{b:02X}" for b in bytes([0x02, len(content)]) + content)
+
+
+class _CAState:
+    def __init__(self, chain, ca_name, ctx, crl_path):
+        self.chain = chain
+        self.ca_name = ca_name
+        self.ctx = ctx
+        self.crl_path = crl_path
+        self.delta_path = delta_crl_path(crl_path)
+        self.revoked = {}        # serial -> x509.RevokedCertificate, built once per entry
+        self.base_serials = set()
+        self.base_number = None
+        self.base_time = None
+        self.lock = threading.Lock()
+        self.publish_lock = threading.Lock()
+        self.stats = {"base": {}, "delta": {}}
+
+
+class CRLManager:
+    """
+    Revocation API and CRL publisher for the issuing CAs.
+
+    Revoked entries are kept per CA as ready-built CRL entries, so a new
+    CRL only builds the entries revoked since the last run. Between periodic
+    base CRLs each revocation publishes an RFC 5280 delta CRL next to the
+    base. CAs whose key cannot be used in-process sign both through
+    `openssl ca -gencrl`; their deltas are generated from a scratch index
+    holding only the entries revoked since the base.
+    """
+
+    def __init__(self, openssl, base_interval=86400, delta_url=None):
+        self.openssl = openssl
+        self.base_interval = base_interval
+        self.delta_url = delta_url
+        self._cas = {}
+        self._listeners = []
+        self._thread = None
+
+    def register(self, chain, ca_name, ctx, crl_path):
+        state = _CAState(chain, ca_name, ctx, crl_path)
+        with ctx.db_lock():
+            self._load(state)
+        self._cas[ca_name] = state
+        return state
+
+    def subscribe(self, callback):
+        """callback(event, chain, ca_name, detail) on "revoked", "base_crl" and "delta_crl"."""
+        self._listeners.append(callback)
+
+    def _emit(self, event, state, detail):
+        for callback in self._listeners:
+            try:
+                callback(event, state.chain, state.ca_name, detail)
+            except Exception as e:
+                logging.error(f"CRL listener failed on {event} for {state.ca_name}: {e!r}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="crl-base", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            for state in list(self._cas.values()):
+                due = state.base_time is None or \
+                    (_now() - state.base_time).total_seconds() >= self.base_interval
+                if due:
+                    try:
+                        self.generate_base(state.ca_name)
+                    except Exception as e:
+                        logging.error(f"Base CRL generation failed for {state.ca_name}: {e!r}")
+            time.sleep(min(60, self.base_interval))
+
+    # -- store ----------------------------------------------------------------
+    def _load(self, state):
+        for entry in read_index(state.ctx.database).values():
+            if entry.status == "R":
+                state.revoked[entry.serial] = self._revoked_entry(entry.serial, entry.revoked, entry.reason)
+        try:
+            with open(state.crl_path, "rb") as fp:
+                data = fp.read()
+            crl = x509.load_pem_x509_crl(data) if b"-----BEGIN" in data else x509.load_der_x509_crl(data)
+            state.base_number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+            state.base_time = crl.last_update_utc
+            state.base_serials = {entry.serial_number for entry in crl}
+        except (OSError, ValueError, x509.ExtensionNotFound) as e:
+            logging.info(f"{state.ca_name}: no usable base CRL at {state.crl_path} ({e})")
+
+    @staticmethod
+    def _revoked_entry(serial, when, reason):
+        builder = x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(when)
+        flag = REVOCATION_REASONS.get(reason)
+        if flag is not None and flag is not x509.ReasonFlags.unspecified:
+            builder = builder.add_extension(x509.CRLReason(flag), critical=False)
+        return builder.build()
+
+    def revoke(self, ca_name, serial, reason="unspecified"):
+        """Mark `serial` revoked in the CA database and publish the change."""
+        state = self._cas[ca_name]
+        if reason not in REVOCATION_REASONS:
+            raise ValueError(f"Unknown revocation reason: {reason}")
+        with state.ctx.db_lock():
+            entries = read_index(state.ctx.database)
+            entry = entries.get(serial)
+            if entry is None:
+                raise LookupError(f"Serial {serial:X} not issued by {ca_name}")
+            if entry.status == "R":
+                raise ValueError(f"Serial {serial:X} is already revoked")
+            entry.status = "R"
+            entry.revoked = _now()
+            entry.reason = reason
+            state.ctx.write_index(entries.values())
+            with state.lock:
+                state.revoked[serial] = self._revoked_entry(serial, entry.revoked, reason)
+        logging.info(f"Revoked {ca_name} serial {serial:X} ({reason})")
+        self._emit("revoked", state, serial)
+        if state.base_number is not None:
+            self.generate_delta(ca_name)
+        else:
+            self.generate_base(ca_name)
+        return entry
+
+    # -- generation -----------------------------------------------------------
+    def _build(self, state, entries, number, delta_of=None):
+        ctx = state.ctx
+        now = _now()
+        builder = (
+            x509.CertificateRevocationListBuilder()
+            .issuer_name(ctx.cert.subject)
+            .last_update(now)
+            .next_update(now + datetime.timedelta(days=ctx.default_crl_days))
+            .add_extension(x509.CRLNumber(number), critical=False)
+        )
+        try:
+            ski = ctx.cert.extensions.get_extension_for_class(x509.SubjectKeyIdentifier).value
+            builder = builder.add_extension(
+                x509.AuthorityKeyIdentifier.from_issuer_subject_key_identifier(ski), critical=False)
+        except x509.ExtensionNotFound:
+            pass
+        if delta_of is not None:
+            builder = builder.add_extension(x509.DeltaCRLIndicator(delta_of), critical=True)
+        elif self.delta_url:
+            url = self.delta_url.format(chain=state.chain, ca=state.ca_name)
+            point = x509.DistributionPoint([x509.UniformResourceIdentifier(url)], None, None, None)
+            builder = builder.add_extension(x509.FreshestCRL([point]), critical=False)
+        for revoked in entries:
+            builder = builder.add_revoked_certificate(revoked)
+        return builder.sign(ctx.key, ctx.signature_hash()), now
+
+    def _publish(self, path, crl):
+        pem = crl.public_bytes(serialization.Encoding.PEM)
+        atomic_write(path, pem, mode="wb")
+        atomic_write(f"{path}.der", crl.public_bytes(serialization.Encoding.DER), mode="wb")
+        return len(pem)
+
+    def generate_base(self, ca_name):
+        state = self._cas[ca_name]
+        with state.publish_lock:
+            self._generate_base(state)
+        self._emit("base_crl", state, state.crl_path)
+
+    def _generate_base(self, state):
+        start = time.perf_counter()
+        if not state.ctx.in_process:
+            size = self._generate_with_openssl(state)
+            self._record(state, "base", start, size, len(state.base_serials), state.base_number)
+            return
+        with state.ctx.db_lock():
+            number = state.ctx.next_crl_number()
+            delta_number = state.ctx.next_crl_number()
+        with state.lock:
+            entries = list(state.revoked.values())
+            serials = set(state.revoked)
+        crl, now = self._build(state, entries, number)
+        size = self._publish(state.crl_path, crl)
+        # the previous delta refers to the old base: replace it with an empty one
+        empty_delta, _ = self._build(state, [], delta_number, delta_of=number)
+        self._publish(state.delta_path, empty_delta)
+        with state.lock:
+            state.base_number, state.base_time, state.base_serials = number, now, serials
+        self._record(state, "base", start, size, len(entries), number)
+
+    def generate_delta(self, ca_name):
+        state = self._cas[ca_name]
+        with state.publish_lock:
+            start = time.perf_counter()
+            with state.ctx.db_lock():
+                number = state.ctx.next_crl_number()
+                index = None if state.ctx.in_process else read_index(state.ctx.database)
+            with state.lock:
+                base_serials = set(state.base_serials)
+                entries = [rev for serial, rev in state.revoked.items() if serial not in base_serials]
+                base_number = state.base_number
+            if state.ctx.in_process:
+                crl, _ = self._build(state, entries, number, delta_of=base_number)
+                size = self._publish(state.delta_path, crl)
+            else:
+                entries = [e for e in index.values() if e.status == "R" and e.serial not in base_serials]
+                size = self._delta_with_openssl(state, entries, number, base_number)
+            self._record(state, "delta", start, size, len(entries), number)
+        self._emit("delta_crl", state, state.delta_path)
+
+    def _gencrl(self, state, out, extensions, database=None, crlnumber=None):
+        """
+        `openssl ca -gencrl` into `out`, with `extensions` as the CRL
+        extensions and optionally another database and CRL number.
+        """
+        ctx = state.ctx
+        section = dict(ctx.conf.get(ctx.conf.get(ctx.section_name, {}).get("crl_extensions", ""), {}))
+        section.update(extensions)
+        with tempfile.TemporaryDirectory(prefix="crl_", dir=os.path.dirname(out)) as scratch:
+            override = ["crl_extensions = qubip_crl_ext"]
+            if database is not None:
+                path = os.path.join(scratch, "index.txt")
+                with open(path, "w") as fp:
+                    fp.write("".join(f"{entry.format()}\n" for entry in database))
+                override.append(f"database = {path}")
+            if crlnumber is not None:
+                path = os.path.join(scratch, "crlnumber")
+                with open(path, "w") as fp:
+                    fp.write(f"{serial_to_hex(crlnumber)}\n")
+                override.append(f"crlnumber = {path}")
+            conf = os.path.join(scratch, "ca.conf")
+            with open(ctx.ca_conf, "r") as src, open(conf, "w") as fp:
+                # a repeated section extends the original one; later keys win
+                fp.write(f"{src.read()}\n[ {ctx.section_name} ]\n" + "".join(f"{line}\n" for line in override)
+                         + "[ qubip_crl_ext ]\n" + "".join(f"{k} = {v}\n" for k, v in section.items()))
+            run_openssl(
+                self.openssl, ctx.pki,
+                ["ca", "-gencrl", "-config", conf, "-keyfile", ctx.ca_key,
+                 "-passin", f"file:{ctx.ca_passfile}", "-cert", ctx.ca_cert, "-out", out],
+                op="gencrl",
+            )
+
+    def _publish_file(self, tmp, path):
+        os.replace(tmp, path)
+        with open(path, "rb") as fp:
+            pem = fp.read()
+        crl = x509.load_pem_x509_crl(pem)
+        atomic_write(f"{path}.der", crl.public_bytes(serialization.Encoding.DER), mode="wb")
+        return crl, len(pem)
+
+    def _delta_with_openssl(self, state, entries, number, base_number):
+        tmp = f"{state.delta_path}.tmp"
+        self._gencrl(state, tmp, {"authorityKeyIdentifier": "keyid",
+                                  "deltaCRL": f"critical,{_der_integer(base_number)}"},
+                     database=entries, crlnumber=number)
+        _, size = self._publish_file(tmp, state.delta_path)
+        return size
+
+    def _generate_with_openssl(self, state):
+        ctx = state.ctx
+        tmp = f"{state.crl_path}.tmp"
+        extensions = {"authorityKeyIdentifier": "keyid"}
+        if self.delta_url:
+            extensions["freshestCRL"] = f"URI:{self.delta_url.format(chain=state.chain, ca=state.ca_name)}"
+        with ctx.db_lock():
+            self._gencrl(state, tmp, extensions)
+            delta_number = ctx.next_crl_number()
+        crl, size = self._publish_file(tmp, state.crl_path)
+        number = crl.extensions.get_extension_for_class(x509.CRLNumber).value.crl_number
+        # the previous delta refers to the old base: replace it with an empty one
+        self._delta_with_openssl(state, [], delta_number, number)
+        with state.lock:
+            state.base_number, state.base_time = number, crl.last_update_utc
+            state.base_serials = {entry.serial_number for entry in crl}
+        return size
+
+    def _record(self, state, kind, start, size, entries, number):
+        elapsed = time.perf_counter() - start
+        state.stats[kind] = {
+            "crl_number": number,
+            "entries": entries,
+            "bytes": size,
+            "seconds": elapsed,
+            "generated_at": _now().isoformat(),
+        }
+        logging.info(f"{state.ca_name}: {kind} CRL #{number} with {entries} entries, {size} bytes in {elapsed:.3f}s")
+
+    def stats(self):
+        return {
+            ca_name: dict(state.stats, revoked=len(state.revoked), in_process=state.ctx.in_process)
+            for ca_name, state in self._cas.items()
+        }
@@ -0,0 +1,231 @@
+import re
+import time
+import hashlib
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+
+from cryptography import x509
+from cryptography.exceptions import UnsupportedAlgorithm
+from cryptography.hazmat.primitives import serialization
+
+from caEngine import UnsupportedProfile
+from pkiCrypto import run_openssl, classical_algorithms, pq_algorithms
+
+# SubjectPublicKeyInfo algorithm OID -> algorithm name as used by /generate_certificate
+KEY_ALGORITHMS = {
+    "1.3.101.112": "ed25519",
+    "2.16.840.1.101.3.4.3.17": "mldsa44",
+    "2.16.840.1.101.3.4.3.18": "mldsa65",
+    "2.16.840.1.101.3.4.3.19": "mldsa87",
+}
+RSA_OID = "1.2.840.113549.1.1.1"
+EC_OID = "1.2.840.10045.2.1"
+
+REASONS = ("malformed", "signature", "algorithm", "subject", "san")
+
+_LABEL = r"[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?"
+_DNS_NAME = re.compile(rf"^(?=.{{1,253}}$){_LABEL}(?:\.{_LABEL})*$", re.IGNORECASE)
+_OPENSSL_KEY_ALGORITHM = re.compile(r"Public Key Algorithm:\s*(\S+)")
+
+
+class CSRRejected(ValueError):
+    """A CSR that must not reach the CA; `reason` is one of REASONS."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+
+
+class CheckedCSR:
+    __slots__ = ("csr", "pem", "digest", "algorithm")
+
+    def __init__(self, csr, pem, digest, algorithm):
+        self.csr = csr
+        self.pem = pem
+        self.digest = digest
+        self.algorithm = algorithm
+
+
+class CSRValidator:
+    """
+    Checks a CSR before any signing work: it must parse, carry a valid
+    self-signature, use a key algorithm allowed for the chain, satisfy the
+    CA's subject policy and name only well-formed DNS/IP SANs.
+
+    Everything runs in-process except for provider (PQ/composite) keys:
+    their signature and algorithm name come from one `openssl req -verify`,
+    and algorithm names are remembered per OID.
+    """
+
+    def __init__(self, openssl, algorithms=None, max_san=16, allow_wildcards=False):
+        self.openssl = openssl
+        self.algorithms = algorithms or {}  # chain -> allowed names
+        self.default_algorithms = classical_algorithms + pq_algorithms
+        self.max_san = max_san
+        self.allow_wildcards = allow_wildcards
+        self._learned = {}
+        self._lock = threading.Lock()
+        self._stats = dict({"accepted": 0, "openssl_checks": 0}, **{reason: 0 for reason in REASONS})
+
+    def check(self, chain, data, ctx=None):
+        """CheckedCSR for `data` (PEM or DER), or CSRRejected; `ctx` is the chain's CAContext."""
+        try:
+            checked = self._check(chain, data, ctx)
+        except CSRRejected as e:
+            with self._lock:
+                self._stats[e.reason] += 1
+            raise
+        with self._lock:
+            self._stats["accepted"] += 1
+        return checked
+
+    def _check(self, chain, data, ctx):
+        try:
+            if b"-----BEGIN" in data:
+                csr = x509.load_pem_x509_csr(data)
+            else:
+                csr = x509.load_der_x509_csr(data)
+            extensions = csr.extensions
+        except ValueError as e:
+            raise CSRRejected("malformed", f"Not a valid CSR: {e}")
+        der = csr.public_bytes(serialization.Encoding.DER)
+
+        algorithm = self._algorithm(csr)
+        try:
+            valid = csr.is_signature_valid
+        except UnsupportedAlgorithm:
+            valid = None
+        if valid is None or algorithm is None:
+            valid, algorithm = self._openssl_verify(chain, der, csr, algorithm)
+        if not valid:
+            raise CSRRejected("signature", "CSR signature verification failed")
+        allowed = self.algorithms.get(chain, self.default_algorithms)
+        if algorithm not in allowed:
+            raise CSRRejected("algorithm", f"Key algorithm {algorithm} is not accepted for {chain}")
+
+        if ctx is not None:
+            try:
+                ctx.build_subject(csr)
+            except ValueError as e:
+                raise CSRRejected("subject", str(e))
+            except UnsupportedProfile:
+                pass  # policy only openssl ca understands; it will enforce it
+        self._check_san(extensions)
+        return CheckedCSR(csr, csr.public_bytes(serialization.Encoding.PEM), hashlib.sha256(der).hexdigest(), algorithm)
+
+    def _algorithm(self, csr):
+        oid = csr.public_key_algorithm_oid.dotted_string
+        if oid == RSA_OID:
+            return f"rsa{csr.public_key().key_size}"
+        if oid == EC_OID:
+            return f"ec-{csr.public_key().curve.name}"
+        return KEY_ALGORITHMS.get(oid) or self._learned.get(oid)
+
+    def _openssl_verify(self, chain, der, csr, algorithm):
+        with self._lock:
+            self._stats["openssl_checks"] += 1
+        try:
+            result = run_openssl(self.openssl, chain, [
+                "req", "-in", "/dev/stdin", "-inform", "DER", "-verify", "-noout", "-text",
+            ], op="req", text=False, input=der)
+        except subprocess.CalledProcessError as e:
+            err = e.stderr.decode(errors="replace") if isinstance(e.stderr, bytes) else str(e.stderr)
+            if "verify" in err.lower():
+                return False, algorithm
+            raise CSRRejected("algorithm", "Key algorithm not supported by this CA")
+        out = result.stdout.decode(errors="replace")
+        # OpenSSL 3.0 reports a verify failure on stderr with exit status 0
+        if b"verify OK" not in result.stdout + result.stderr:
+            return False, algorithm
+        if algorithm is None:
+            match = _OPENSSL_KEY_ALGORITHM.search(out)
+            if match is None:
+                raise CSRRejected("algorithm", "Key algorithm not recognised")
+            algorithm = re.sub(r"[^a-z0-9_]", "", match.group(1).lower())
+            oid = csr.public_key_algorithm_oid.dotted_string
+            self._learned[oid] = algorithm
+            logging.info(f"CSR key algorithm {oid} is {algorithm}")
+        return True, algorithm
+
+    def _check_san(self, extensions):
+        try:
+            san = extensions.get_extension_for_class(x509.SubjectAlternativeName).value
+        except x509.ExtensionNotFound:
+            return
+        names = list(san)
+        if len(names) > self.max_san:
+            raise CSRRejected("san", f"Too many subjectAltName entries ({len(names)} > {self.max_san})")
+        for name in names:
+            if isinstance(name, x509.IPAddress):
+                continue
+            if not isinstance(name, x509.DNSName):
+                raise CSRRejected("san", f"subjectAltName type {type(name).__name__} is not accepted")
+            value = name.value
+            if value.startswith("*.") and self.allow_wildcards:
+                value = value[2:]
+            if not _DNS_NAME.match(value):
+                raise CSRRejected("san", f"Invalid DNS name in subjectAltName: {name.value}")
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, learned=dict(self._learned))
+
+
+class IssuedCache:
+    """
+    Certificates issued per (CSR digest, chain, purpose), replayed for `ttl`
+    seconds so that a client retrying after a timeout gets the same
+    certificate back. Concurrent duplicates wait for the first signature.
+    """
+
+    def __init__(self, ttl=600, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires, serial, cert_pem)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._stats = {"issued": 0, "replayed": 0, "expired": 0, "evicted": 0, "discarded": 0}
+
+    def issue(self, key, sign):
+        """(cert_pem, replayed): the cached certificate for `key`, or `sign()`'s."""
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > time.monotonic():
+                    self._stats["replayed"] += 1
+                    return entry[2], True
+                if entry is not None:
+                    del self._entries[key]
+                    self._stats["expired"] += 1
+                waiting = self._inflight.get(key)
+                if waiting is None:
+                    done = self._inflight[key] = threading.Event()
+                    break
+            waiting.wait()  # then take its result, or sign ourselves if it failed
+        try:
+            cert_pem = sign()
+            serial = x509.load_pem_x509_certificate(cert_pem).serial_number
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, serial, cert_pem)
+                self._stats["issued"] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evicted"] += 1
+            return cert_pem, False
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            done.set()
+
+    def discard_serial(self, serial):
+        """Stop replaying a certificate (e.g. it was revoked)."""
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[1] == serial]:
+                del self._entries[key]
+                self._stats["discarded"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), ttl=self.ttl)
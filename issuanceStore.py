@@ -0,0 +1,113 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+class StoreFull(Exception):
+    """No room for another bundle; retry after `retry_after` seconds."""
+
+    def __init__(self, max_entries, retry_after):
+        super().__init__(f"Too many certificates awaiting download ({max_entries})")
+        self.retry_after = retry_after
+
+
+class IssuedBundle:
+    __slots__ = ("cert_id", "pki", "ca", "cert_pem", "sealed_key", "created")
+
+    def __init__(self, cert_id, pki, ca, cert_pem, sealed_key):
+        self.cert_id = cert_id
+        self.pki = pki
+        self.ca = ca
+        self.cert_pem = cert_pem
+        self.sealed_key = sealed_key
+        self.created = time.monotonic()
+
+
+class IssuanceStore:
+    """
+    Short-lived in-memory home for freshly issued material awaiting download.
+
+    Private keys are sealed with AES-GCM under a per-process key (bound to
+    the certificate id) and entries expire after `ttl` seconds. Issuance
+    `reserve`s room first and is refused with StoreFull once `max_entries`
+    bundles are waiting, so an issued key is never dropped to make room.
+    `pop` hands a bundle out exactly once.
+
+    The store is per process: with several app processes or hosts, the
+    download must reach the process that issued (sticky routing on the
+    certificate id), otherwise use on-disk issuance.
+    """
+
+    def __init__(self, ttl=900, max_entries=1000, retry_after=5):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.retry_after = retry_after
+        self._aead = AESGCM(AESGCM.generate_key(bit_length=256))
+        self._entries = OrderedDict()
+        self._reserved = set()
+        self._lock = threading.Lock()
+        self._stats = {"stored": 0, "downloaded": 0, "expired": 0, "rejected": 0}
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.ttl
+        while self._entries:
+            bundle = next(iter(self._entries.values()))
+            if bundle.created >= cutoff:
+                break
+            self._entries.popitem(last=False)
+            self._stats["expired"] += 1
+
+    def _claim(self, cert_id):
+        """Raise StoreFull unless there is room for `cert_id`. The caller holds the lock."""
+        self._expire()
+        if cert_id not in self._reserved and len(self._entries) + len(self._reserved) >= self.max_entries:
+            self._stats["rejected"] += 1
+            raise StoreFull(self.max_entries, self.retry_after)
+
+    @contextmanager
+    def reserve(self, cert_id):
+        """Hold room for `cert_id`'s bundle while it is issued; StoreFull when there is none."""
+        with self._lock:
+            self._claim(cert_id)
+            self._reserved.add(cert_id)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._reserved.discard(cert_id)
+
+    def put(self, cert_id, pki, ca, key_pem, cert_pem):
+        nonce = os.urandom(12)
+        sealed = nonce + self._aead.encrypt(nonce, key_pem, cert_id.encode())
+        with self._lock:
+            self._claim(cert_id)
+            self._entries[cert_id] = IssuedBundle(cert_id, pki, ca, cert_pem, sealed)
+            self._reserved.discard(cert_id)
+            self._stats["stored"] += 1
+
+    def __contains__(self, cert_id):
+        with self._lock:
+            self._expire()
+            return cert_id in self._entries
+
+    def pop(self, cert_id, pki, ca):
+        """(bundle, key PEM) for a matching live entry, removing it; None otherwise."""
+        with self._lock:
+            self._expire()
+            bundle = self._entries.get(cert_id)
+            if bundle is None or (bundle.pki, bundle.ca) != (pki, ca):
+                return None
+            del self._entries[cert_id]
+            self._stats["downloaded"] += 1
+        key_pem = self._aead.decrypt(bundle.sealed_key[:12], bundle.sealed_key[12:], cert_id.encode())
+        return bundle, key_pem
+
+    def stats(self):
+        with self._lock:
+            self._expire()
+            return dict(self._stats, entries=len(self._entries), reserved=len(self._reserved),
+                        ttl=self.ttl, max_entries=self.max_entries)
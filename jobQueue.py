@@ -0,0 +1,165 @@
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+
+class QueueFull(Exception):
+    """The queue already holds `max_pending` jobs; retry after `retry_after` seconds."""
+
+    def __init__(self, pending, retry_after):
+        super().__init__(f"Job queue is full ({pending} jobs pending)")
+        self.retry_after = retry_after
+
+
+class Job:
+    def __init__(self, algorithm, fn, args):
+        self.id = uuid.uuid4().hex
+        self.algorithm = algorithm
+        self.fn = fn
+        self.args = args
+        self.status = "queued"
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.stages = {}
+        self._queue = None
+
+    @contextmanager
+    def stage(self, name):
+        """Time one pipeline stage of this job."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.stages[name] = elapsed
+            if self._queue is not None:
+                self._queue._record_stage(name, elapsed)
+
+    def to_dict(self):
+        data = {
+            "job_id": self.id,
+            "status": self.status,
+            "algorithm": self.algorithm,
+            "queued_seconds": (self.started or time.time()) - self.submitted,
+            "stages": self.stages,
+        }
+        if self.finished is not None and self.started is not None:
+            data["run_seconds"] = self.finished - self.started
+        if self.status == "done":
+            data["result"] = self.result
+        elif self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """
+    Background issuance jobs with a concurrency cap per algorithm.
+
+    Workers pick the oldest job whose algorithm still has a free slot, so a
+    backlog of slow RSA-4096/ML-DSA-87 jobs never holds up cheaper ones.
+    Finished jobs are kept for `ttl` seconds for polling, in this process
+    only: `/jobs/<id>` must reach the process that queued the job. At most
+    `max_pending` jobs wait at a time; `submit` raises QueueFull beyond that.
+    """
+
+    def __init__(self, workers=4, limits=None, default_limit=2, ttl=3600, max_pending=100, retry_after=5):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.retry_after = retry_after
+        self._rejected = 0
+        self._jobs = {}
+        self._pending = deque()
+        self._running = {}
+        self._cond = threading.Condition()
+        self._stage_stats = {}
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"jobs-{i}", daemon=True) for i in range(workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, algorithm, fn, *args):
+        """Queue `fn(job, *args)`; its return value becomes the job result."""
+        job = Job(algorithm, fn, args)
+        job._queue = self
+        with self._cond:
+            if len(self._pending) >= self.max_pending:
+                self._rejected += 1
+                raise QueueFull(len(self._pending), self.retry_after)
+            self._expire()
+            self._jobs[job.id] = job
+            self._pending.append(job)
+            self._cond.notify()
+        return job
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _limit(self, algorithm):
+        return self.limits.get(algorithm, self.default_limit)
+
+    def _next_job(self):
+        for job in self._pending:
+            if self._running.get(job.algorithm, 0) < self._limit(job.algorithm):
+                self._pending.remove(job)
+                self._running[job.algorithm] = self._running.get(job.algorithm, 0) + 1
+                return job
+        return None
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+            job.status = "running"
+            job.started = time.time()
+            try:
+                job.result = job.fn(job, *job.args)
+                job.status = "done"
+            except Exception as e:
+                logging.error(f"Job {job.id} ({job.algorithm}) failed: {e!r}")
+                job.error = str(e) or repr(e)
+                job.status = "failed"
+            finally:
+                job.finished = time.time()
+                with self._cond:
+                    self._running[job.algorithm] -= 1
+                    self._cond.notify_all()
+
+    def _record_stage(self, name, elapsed):
+        with self._cond:
+            stats = self._stage_stats.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stats["count"] += 1
+            stats["total_seconds"] += elapsed
+            stats["max_seconds"] = max(stats["max_seconds"], elapsed)
+
+    def stats(self):
+        with self._cond:
+            queued = {}
+            for job in self._pending:
+                queued[job.algorithm] = queued.get(job.algorithm, 0) + 1
+            return {
+                "queue_depth": len(self._pending),
+                "max_pending": self.max_pending,
+                "rejected": self._rejected,
+                "queued_by_algorithm": queued,
+                "running_by_algorithm": {a: n for a, n in self._running.items() if n},
+                "limits": dict(self.limits, default=self.default_limit),
+                "stages": {name: dict(s) for name, s in self._stage_stats.items()},
+            }
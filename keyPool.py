@@ -0,0 +1,181 @@
+import os
+import time
+import socket
+import shutil
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from pkiCrypto import generate_private_key_pem
+
+# keys the devices and the TLS page ask for most, and that are slow to generate
+DEFAULT_POOLS = [
+    ("certs", "rsa4096"),
+    ("certs", "mldsa65"),
+    ("pki-65", "mldsa65_ed25519"),
+    ("pki-44", "mldsa44_ed25519"),
+]
+
+
+class KeyPool:
+    """
+    Pre-generated private keys per (pki, algorithm), refilled in the background.
+
+    Keys are kept AES-GCM encrypted under a per-process key in a
+    `<host>-<pid>` subdirectory of `pool_dir`, which may be shared by several
+    workers and hosts. On start a process wipes only its own subdirectory and
+    those of dead processes on the same host, whose keys are unreadable
+    anyway. Each key is handed out exactly once; a blob that has gone missing
+    counts as a miss.
+
+    Only the (pki, algorithm) pairs in `pools` are kept. A pool whose refill
+    fails waits `backoff` seconds (doubling per consecutive failure) before
+    the next take retries it, and is disabled after `max_failures` in a row.
+    """
+
+    def __init__(self, openssl, pool_dir, low=2, high=5, workers=2, pools=None, backoff=30, max_failures=5):
+        self.openssl = openssl
+        self.root = pool_dir
+        self.host = socket.gethostname()
+        self.pool_dir = os.path.join(pool_dir, f"{self.host}-{os.getpid()}")
+        self.low = low
+        self.high = high
+        self.backoff = backoff
+        self.max_failures = max_failures
+        self._aead = AESGCM(AESGCM.generate_key(bit_length=256))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="keypool")
+        self._lock = threading.Lock()
+        self._pools = {}
+        self._refilling = set()
+        self._started = False
+        self._stats = {}
+        self._retry_at = {}
+        for pki, algorithm in pools or DEFAULT_POOLS:
+            self._pools[(pki, algorithm)] = deque()
+            self._stats[(pki, algorithm)] = {
+                "hits": 0, "misses": 0, "generated": 0, "failures": 0, "consecutive_failures": 0,
+                "disabled": False, "refill_seconds_total": 0.0, "refill_seconds_last": None,
+            }
+
+    def _remove_stale(self):
+        """Subdirectories left by this host's processes that are no longer running."""
+        for name in os.listdir(self.root):
+            host, _, pid = name.rpartition("-")
+            if host != self.host or not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+            except PermissionError:
+                pass  # alive, owned by someone else
+
+    def start(self):
+        os.makedirs(self.root, mode=0o700, exist_ok=True)
+        self._remove_stale()
+        shutil.rmtree(self.pool_dir, ignore_errors=True)
+        os.makedirs(self.pool_dir, mode=0o700)
+        self._started = True
+        for pool in self._pools:
+            self._schedule_refill(pool)
+
+    def take_pem(self, pki, algorithm):
+        """A pooled key as PEM bytes, or None when the caller must generate inline."""
+        pool = (pki, algorithm)
+        if not self._started or pool not in self._pools:
+            return None
+        with self._lock:
+            blob_path = self._pools[pool].popleft() if self._pools[pool] else None
+        self._schedule_refill(pool)
+        blob = None
+        if blob_path is not None:
+            try:
+                with open(blob_path, "rb") as fp:
+                    blob = fp.read()
+                os.remove(blob_path)
+            except FileNotFoundError:
+                logging.warning(f"Pooled key {blob_path} is gone, generating inline")
+                blob = None
+        with self._lock:
+            self._stats[pool]["hits" if blob is not None else "misses"] += 1
+        if blob is None:
+            return None
+        return self._aead.decrypt(blob[:12], blob[12:], f"{pki}/{algorithm}".encode())
+
+    def ready(self, pki, algorithm):
+        """Whether a pooled key is waiting for (pki, algorithm) right now."""
+        keys = self._pools.get((pki, algorithm)) if self._started else None
+        return bool(keys)
+
+    def take(self, pki, algorithm, key_file):
+        """Write a pooled key to `key_file`. Returns False when the caller must generate inline."""
+        key_pem = self.take_pem(pki, algorithm)
+        if key_pem is None:
+            return False
+        fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(key_pem)
+        return True
+
+    def stats(self):
+        with self._lock:
+            pools = {
+                f"{pki}/{algorithm}": dict(self._stats[(pki, algorithm)], depth=len(keys))
+                for (pki, algorithm), keys in self._pools.items()
+            }
+        return {"low_watermark": self.low, "high_watermark": self.high, "pools": pools}
+
+    # -- refill ---------------------------------------------------------------
+    def _schedule_refill(self, pool):
+        with self._lock:
+            if pool in self._refilling or len(self._pools[pool]) >= self.low \
+                    or self._stats[pool]["disabled"] or self._retry_at.get(pool, 0) > time.monotonic():
+                return
+            self._refilling.add(pool)
+        self._executor.submit(self._refill, pool)
+
+    def _refill(self, pool):
+        pki, algorithm = pool
+        try:
+            while len(self._pools[pool]) < self.high:
+                start = time.perf_counter()
+                blob_path = self._generate(pki, algorithm)
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self._pools[pool].append(blob_path)
+                    stats = self._stats[pool]
+                    stats["generated"] += 1
+                    stats["consecutive_failures"] = 0
+                    stats["refill_seconds_total"] += elapsed
+                    stats["refill_seconds_last"] = elapsed
+        except Exception as e:  # openssl failures raise CalledProcessError
+            with self._lock:
+                stats = self._stats[pool]
+                stats["failures"] += 1
+                stats["consecutive_failures"] += 1
+                failures = stats["consecutive_failures"]
+                if failures >= self.max_failures:
+                    stats["disabled"] = True
+                else:
+                    self._retry_at[pool] = time.monotonic() + self.backoff * 2 ** (failures - 1)
+            if failures >= self.max_failures:
+                logging.error(f"Key pool {pki}/{algorithm} disabled after {failures} failed refills: {e!r}")
+            else:
+                logging.warning(f"Key pool refill failed for {pki}/{algorithm}: {e!r}")
+        finally:
+            with self._lock:
+                self._refilling.discard(pool)
+
+    def _generate(self, pki, algorithm):
+        # generated in memory: only the encrypted blob ever reaches the disk
+        key_pem = generate_private_key_pem(self.openssl, pki, algorithm)
+        blob_path = os.path.join(self.pool_dir, f"{os.urandom(8).hex()}.bin")
+        nonce = os.urandom(12)
+        blob = nonce + self._aead.encrypt(nonce, key_pem, f"{pki}/{algorithm}".encode())
+        fd = os.open(blob_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(blob)
+        return blob_path
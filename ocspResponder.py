@@ -0,0 +1,319 @@
+import os
+import time
+import base64
+import logging
+import tempfile
+import threading
+import datetime
+
+from cryptography import x509
+from cryptography.x509 import ocsp
+from cryptography.hazmat.primitives import hashes, serialization
+
+from caEngine import read_index, REVOCATION_REASONS
+from crlIndex import der_tlv
+from pkiCrypto import run_openssl, openssl_env_name
+from opensslPool import WorkerError
+
+HASHES = (hashes.SHA1, hashes.SHA256, hashes.SHA384, hashes.SHA512)
+
+# RFC 5280 CRLReason codes, for responses signed by the OpenSSL worker pool
+REASON_CODES = {
+    "unspecified": 0, "keyCompromise": 1, "CACompromise": 2, "affiliationChanged": 3,
+    "superseded": 4, "cessationOfOperation": 5, "certificateHold": 6, "removeFromCRL": 8,
+    "privilegeWithdrawn": 9, "AACompromise": 10,
+}
+
+
+def subject_public_key_bits(cert):
+    """Contents of the subjectPublicKey BIT STRING, for any key algorithm."""
+    tbs = cert.tbs_certificate_bytes
+    _, pos, end = der_tlv(tbs, 0)
+    fields = []
+    while pos < end:
+        tag, start, stop = der_tlv(tbs, pos)
+        fields.append((tag, start, stop))
+        pos = stop
+    if fields[0][0] == 0xA0:  # explicit version
+        fields = fields[1:]
+    _, spki_start, _ = fields[5]
+    _, _, alg_end = der_tlv(tbs, spki_start)
+    _, bits_start, bits_end = der_tlv(tbs, alg_end)
+    return tbs[bits_start + 1:bits_end]
+
+def _digest(algorithm, data):
+    h = hashes.Hash(algorithm)
+    h.update(data)
+    return h.finalize()
+
+def _has_nonce(req):
+    try:
+        req.extensions.get_extension_for_class(x509.OCSPNonce)
+        return True
+    except x509.ExtensionNotFound:
+        return False
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(microsecond=0)
+
+
+class _Issuer:
+    def __init__(self, ca_name, ctx):
+        self.ca_name = ca_name
+        self.ctx = ctx
+        subject = ctx.cert.subject.public_bytes()
+        key_bits = subject_public_key_bits(ctx.cert)
+        self.name_hash = {alg.name: _digest(alg(), subject) for alg in HASHES}
+        self.key_hash = {alg.name: _digest(alg(), key_bits) for alg in HASHES}
+        self.index = {}
+        self.db_stamp = None
+        self.checked_at = 0.0
+        self.cache = {}  # serial -> (response DER, next_update)
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "signed": 0, "errors": 0}
+
+
+class OCSPResponder:
+    """
+    RFC 6960 responder for the issuing CAs, signing with the CA key itself.
+
+    Keeps a serial -> status index per CA built from the OpenSSL database and
+    pre-signed SHA-1 CertID responses (RFC 5019 style) served until shortly
+    before nextUpdate. CAs whose key cannot be used in-process (provider
+    keys) are pre-signed in batches of `batch` by the OpenSSL worker pool,
+    which keeps the key loaded. Without a pool, or when it fails, they are
+    answered through `openssl ocsp`; that costs a process per response, so
+    each is signed on first request and cached.
+    """
+
+    def __init__(self, openssl, validity=86400, refresh_interval=30, pool=None, batch=64):
+        self.openssl = openssl
+        self.validity = datetime.timedelta(seconds=validity)
+        self.refresh_interval = refresh_interval
+        self.pool = pool
+        self.batch = batch
+        self._issuers = {}
+        self._thread = None
+
+    def register(self, ca_name, ctx):
+        issuer = _Issuer(ca_name, ctx)
+        self._issuers[ca_name] = issuer
+        return issuer
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ocsp-refresh", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            for ca_name in list(self._issuers):
+                try:
+                    self.refresh(ca_name)
+                except Exception as e:
+                    logging.error(f"OCSP refresh failed for {ca_name}: {e!r}")
+            time.sleep(self.refresh_interval)
+
+    def _pool_group(self, issuer):
+        """Worker pool group that can sign for a provider CA, or None."""
+        if issuer.ctx.in_process or self.pool is None:
+            return None
+        group = openssl_env_name(issuer.ctx.pki)
+        return group if self.pool.handles(group) else None
+
+    def _presigned(self, issuer):
+        return issuer.ctx.in_process or self._pool_group(issuer) is not None
+
+    # -- index maintenance ----------------------------------------------------
+    def _reload_index(self, issuer):
+        """Re-read the CA db if it changed. Returns the serials whose status changed."""
+        st = os.stat(issuer.ctx.database)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        issuer.checked_at = time.monotonic()
+        if stamp == issuer.db_stamp:
+            return set()
+        index = read_index(issuer.ctx.database)
+        old = issuer.index
+        changed = {
+            serial for serial, entry in index.items()
+            if serial not in old or (old[serial].status, old[serial].revoked) != (entry.status, entry.revoked)
+        }
+        changed |= old.keys() - index.keys()
+        with issuer.lock:
+            issuer.index = index
+            issuer.db_stamp = stamp
+            for serial in changed:
+                issuer.cache.pop(serial, None)
+        return changed
+
+    def refresh(self, ca_name, serials=()):
+        """
+        Reload the index and re-sign changed, expiring or explicitly given
+        entries; for CAs signing through the openssl CLI, only drop them from
+        the cache.
+        """
+        issuer = self._issuers[ca_name]
+        stale = self._reload_index(issuer) | set(serials)
+        horizon = _now() + self.validity / 2
+        with issuer.lock:
+            for serial in serials:
+                issuer.cache.pop(serial, None)
+            if not self._presigned(issuer):
+                for serial in [s for s, (_, next_update) in issuer.cache.items() if next_update < horizon]:
+                    del issuer.cache[serial]
+                return
+            stale |= {s for s in issuer.index if s not in issuer.cache or issuer.cache[s][1] < horizon}
+        self._presign(issuer, sorted(stale & issuer.index.keys()))
+
+    def _presign(self, issuer, serials):
+        if not issuer.ctx.in_process:
+            for i in range(0, len(serials), self.batch):
+                chunk = serials[i:i + self.batch]
+                try:
+                    signed = self._sign_with_pool(issuer, chunk)
+                except Exception as e:
+                    issuer.stats["errors"] += 1
+                    logging.warning(f"OCSP pre-sign failed for {issuer.ca_name} "
+                                    f"serials {chunk[0]:X}..{chunk[-1]:X}: {e!r}")
+                    continue
+                with issuer.lock:
+                    issuer.cache.update(zip(chunk, signed))
+            return
+        for serial in serials:
+            try:
+                der, next_update, _ = self._sign(issuer, serial, hashes.SHA1())
+            except Exception as e:
+                issuer.stats["errors"] += 1
+                logging.warning(f"OCSP pre-sign failed for {issuer.ca_name} serial {serial:X}: {e!r}")
+                continue
+            with issuer.lock:
+                issuer.cache[serial] = (der, next_update)
+
+    # -- responses ------------------------------------------------------------
+    def respond(self, ca_name, request_der):
+        """(response DER, next_update or None). Raises KeyError for unknown CAs."""
+        issuer = self._issuers[ca_name]
+        try:
+            req = ocsp.load_der_ocsp_request(request_der)
+        except (ValueError, NotImplementedError):
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(
+                ocsp.OCSPResponseStatus.MALFORMED_REQUEST).public_bytes(serialization.Encoding.DER), None
+        alg = req.hash_algorithm
+        if (alg.name not in issuer.name_hash
+                or req.issuer_name_hash != issuer.name_hash[alg.name]
+                or req.issuer_key_hash != issuer.key_hash[alg.name]):
+            return ocsp.OCSPResponseBuilder.build_unsuccessful(
+                ocsp.OCSPResponseStatus.UNAUTHORIZED).public_bytes(serialization.Encoding.DER), None
+
+        if time.monotonic() - issuer.checked_at > 1.0:
+            changed = self._reload_index(issuer)
+            if self._presigned(issuer):
+                self._presign(issuer, sorted(changed & issuer.index.keys()))
+        serial = req.serial_number
+        if isinstance(alg, hashes.SHA1):
+            cached = issuer.cache.get(serial)
+            if cached is not None and cached[1] > _now():
+                issuer.stats["hits"] += 1
+                return cached
+        issuer.stats["misses"] += 1
+        der, next_update, echoes_nonce = self._sign(issuer, serial, alg, request_der)
+        # openssl echoes the request nonce, so such a response only fits its own request
+        if isinstance(alg, hashes.SHA1) and serial in issuer.index and next_update is not None \
+                and not (echoes_nonce and _has_nonce(req)):
+            with issuer.lock:
+                issuer.cache[serial] = (der, next_update)
+        return der, next_update
+
+    def _sign(self, issuer, serial, alg, request_der=None):
+        """(response DER, next_update, whether it echoes the request nonce)."""
+        if not issuer.ctx.in_process:
+            if isinstance(alg, hashes.SHA1) and self._pool_group(issuer) is not None:
+                try:
+                    return self._sign_with_pool(issuer, [serial])[0] + (False,)
+                except WorkerError as e:
+                    logging.warning(f"OCSP signing through the worker pool failed for {issuer.ca_name}: {e}")
+            return self._sign_with_openssl(issuer, serial, alg, request_der) + (True,)
+        entry = issuer.index.get(serial)
+        this_update = _now()
+        next_update = this_update + self.validity
+        revocation_time, reason = None, None
+        if entry is None:
+            status = ocsp.OCSPCertStatus.UNKNOWN
+        elif entry.status == "R":
+            status = ocsp.OCSPCertStatus.REVOKED
+            revocation_time = entry.revoked
+            reason = REVOCATION_REASONS.get(entry.reason)
+        else:
+            status = ocsp.OCSPCertStatus.GOOD
+        builder = ocsp.OCSPResponseBuilder().add_response_by_hash(
+            issuer_name_hash=issuer.name_hash[alg.name],
+            issuer_key_hash=issuer.key_hash[alg.name],
+            serial_number=serial,
+            algorithm=alg,
+            cert_status=status,
+            this_update=this_update,
+            next_update=next_update,
+            revocation_time=revocation_time,
+            revocation_reason=reason,
+        ).responder_id(
+            ocsp.OCSPResponderEncoding.HASH, issuer.ctx.cert
+        ).certificates([issuer.ctx.cert])
+        response = builder.sign(issuer.ctx.key, issuer.ctx.signature_hash())
+        issuer.stats["signed"] += 1
+        return response.public_bytes(serialization.Encoding.DER), next_update, False
+
+    def _sign_with_pool(self, issuer, serials):
+        """[(response DER, next_update)] for SHA-1 CertIDs, signed by an OpenSSL worker."""
+        ctx = issuer.ctx
+        this_update = _now()
+        next_update = this_update + self.validity
+        entries = []
+        for serial in serials:
+            entry = issuer.index.get(serial)
+            if entry is None:
+                entries.append([f"{serial:X}", "unknown", None, -1])
+            elif entry.status == "R":
+                entries.append([f"{serial:X}", "revoked", int(entry.revoked.timestamp()),
+                                REASON_CODES.get(entry.reason, -1)])
+            else:
+                entries.append([f"{serial:X}", "good", None, -1])
+        signed = self.pool.call(
+            self._pool_group(issuer), "ocsp_sign",
+            ca_cert=ctx.ca_cert, ca_key=ctx.ca_key, passfile=ctx.ca_passfile, entries=entries,
+            this_update=int(this_update.timestamp()), next_update=int(next_update.timestamp()),
+        )
+        issuer.stats["signed"] += len(signed)
+        return [(base64.b64decode(der), next_update) for der in signed]
+
+    def _sign_with_openssl(self, issuer, serial, alg, request_der):
+        ctx = issuer.ctx
+        if request_der is None:
+            request_der = ocsp.OCSPRequestBuilder().add_certificate_by_hash(
+                issuer.name_hash[alg.name], issuer.key_hash[alg.name], serial, alg,
+            ).build().public_bytes(serialization.Encoding.DER)
+        with tempfile.TemporaryDirectory(prefix="ocsp_") as workdir:
+            req_path = os.path.join(workdir, "req.der")
+            resp_path = os.path.join(workdir, "resp.der")
+            with open(req_path, "wb") as fp:
+                fp.write(request_der)
+            run_openssl(
+                self.openssl, ctx.pki,
+                ["ocsp", "-index", ctx.database, "-CA", ctx.ca_cert,
+                 "-rsigner", ctx.ca_cert, "-rkey", ctx.ca_key, "-passin", f"file:{ctx.ca_passfile}",
+                 "-reqin", req_path, "-respout", resp_path,
+                 "-nmin", str(int(self.validity.total_seconds() // 60))],
+            )
+            with open(resp_path, "rb") as fp:
+                der = fp.read()
+        issuer.stats["signed"] += 1
+        try:
+            next_update = ocsp.load_der_ocsp_response(der).next_update_utc
+        except Exception:
+            next_update = None
+        return der, next_update
+
+    def stats(self):
+        return {
+            ca_name: dict(issuer.stats, serials=len(issuer.index), cached=len(issuer.cache))
+            for ca_name, issuer in self._issuers.items()
+        }
@@ -0,0 +1,569 @@
+import os
+import re
+import sys
+import json
+import base64
+import time
+import queue
+import ctypes
+import ctypes.util
+import logging
+import selectors
+import threading
+import subprocess
+
+MBSTRING_ASC = 0x1001
+OPENSSL_INIT_LOAD_CONFIG = 0x00000040
+
+_P = ctypes.c_void_p
+
+
+class _X509V3Ctx(ctypes.Structure):
+    """`struct v3_ext_ctx` (X509V3_CTX) as declared in <openssl/x509v3.h> for OpenSSL 3.x."""
+    _fields_ = [
+        ("flags", ctypes.c_int),
+        ("issuer_cert", _P),
+        ("subject_cert", _P),
+        ("subject_req", _P),
+        ("crl", _P),
+        ("db_meth", _P),
+        ("db", _P),
+        ("issuer_pkey", _P),
+    ]
+
+
+_SIGNATURES = {
+    "OPENSSL_init_crypto": (ctypes.c_int, [ctypes.c_uint64, _P]),
+    "OSSL_PROVIDER_available": (ctypes.c_int, [_P, ctypes.c_char_p]),
+    "ERR_get_error": (ctypes.c_ulong, []),
+    "ERR_error_string_n": (None, [ctypes.c_ulong, ctypes.c_char_p, ctypes.c_size_t]),
+    "ERR_clear_error": (None, []),
+    "BIO_new_file": (_P, [ctypes.c_char_p, ctypes.c_char_p]),
+    "BIO_free": (ctypes.c_int, [_P]),
+    "BIO_s_mem": (_P, []),
+    "BIO_new": (_P, [_P]),
+    "BIO_write": (ctypes.c_int, [_P, ctypes.c_char_p, ctypes.c_int]),
+    "BIO_read": (ctypes.c_int, [_P, ctypes.c_char_p, ctypes.c_int]),
+    "EVP_PKEY_CTX_new_from_name": (_P, [_P, ctypes.c_char_p, ctypes.c_char_p]),
+    "EVP_PKEY_CTX_free": (None, [_P]),
+    "EVP_PKEY_keygen_init": (ctypes.c_int, [_P]),
+    "EVP_PKEY_CTX_set_rsa_keygen_bits": (ctypes.c_int, [_P, ctypes.c_int]),
+    "EVP_PKEY_generate": (ctypes.c_int, [_P, ctypes.POINTER(_P)]),
+    "EVP_PKEY_free": (None, [_P]),
+    "EVP_PKEY_get_default_digest_name": (ctypes.c_int, [_P, ctypes.c_char_p, ctypes.c_size_t]),
+    "EVP_get_digestbyname": (_P, [ctypes.c_char_p]),
+    "PEM_write_bio_PrivateKey": (ctypes.c_int, [_P, _P, _P, _P, ctypes.c_int, _P, _P]),
+    "PEM_read_bio_PrivateKey": (_P, [_P, _P, _P, _P]),
+    "X509_REQ_new": (_P, []),
+    "X509_REQ_free": (None, [_P]),
+    "X509_REQ_set_version": (ctypes.c_int, [_P, ctypes.c_long]),
+    "X509_REQ_set_pubkey": (ctypes.c_int, [_P, _P]),
+    "X509_REQ_get_subject_name": (_P, [_P]),
+    "X509_NAME_add_entry_by_txt": (ctypes.c_int, [_P, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p,
+                                                  ctypes.c_int, ctypes.c_int, ctypes.c_int]),
+    "X509_REQ_sign": (ctypes.c_int, [_P, _P, _P]),
+    "PEM_write_bio_X509_REQ": (ctypes.c_int, [_P, _P]),
+    "NCONF_new": (_P, [_P]),
+    "NCONF_free": (None, [_P]),
+    "NCONF_load": (ctypes.c_int, [_P, ctypes.c_char_p, ctypes.POINTER(ctypes.c_long)]),
+    "NCONF_get_string": (ctypes.c_char_p, [_P, ctypes.c_char_p, ctypes.c_char_p]),
+    "X509V3_set_ctx": (None, [ctypes.POINTER(_X509V3Ctx), _P, _P, _P, _P, ctypes.c_int]),
+    "X509V3_set_nconf": (None, [ctypes.POINTER(_X509V3Ctx), _P]),
+    "X509V3_EXT_REQ_add_nconf": (ctypes.c_int, [_P, ctypes.POINTER(_X509V3Ctx), ctypes.c_char_p, _P]),
+    "d2i_X509": (_P, [_P, ctypes.POINTER(_P), ctypes.c_long]),
+    "PEM_read_bio_X509": (_P, [_P, _P, _P, _P]),
+    "X509_free": (None, [_P]),
+    "X509_get0_pubkey": (_P, [_P]),
+    "X509_verify": (ctypes.c_int, [_P, _P]),
+    "X509_get_subject_name": (_P, [_P]),
+    "X509_get0_pubkey_bitstr": (_P, [_P]),
+    "BN_hex2bn": (ctypes.c_int, [ctypes.POINTER(_P), ctypes.c_char_p]),
+    "BN_to_ASN1_INTEGER": (_P, [_P, _P]),
+    "BN_free": (None, [_P]),
+    "ASN1_INTEGER_free": (None, [_P]),
+    "ASN1_GENERALIZEDTIME_set": (_P, [_P, ctypes.c_long]),
+    "ASN1_STRING_free": (None, [_P]),
+    "OCSP_cert_id_new": (_P, [_P, _P, _P, _P]),
+    "OCSP_CERTID_free": (None, [_P]),
+    "OCSP_BASICRESP_new": (_P, []),
+    "OCSP_BASICRESP_free": (None, [_P]),
+    "OCSP_basic_add1_status": (_P, [_P, _P, ctypes.c_int, ctypes.c_int, _P, _P, _P]),
+    "OCSP_basic_sign": (ctypes.c_int, [_P, _P, _P, _P, _P, ctypes.c_ulong]),
+    "OCSP_response_create": (_P, [ctypes.c_int, _P]),
+    "OCSP_RESPONSE_free": (None, [_P]),
+    "i2d_OCSP_RESPONSE": (ctypes.c_int, [_P, ctypes.POINTER(ctypes.POINTER(ctypes.c_ubyte))]),
+}
+
+OCSP_RESPID_KEY = 0x400
+OCSP_STATUSES = {"good": 0, "revoked": 1, "unknown": 2}
+
+# same key algorithm spelling as pkiCrypto.generate_private_key
+_RSA_BITS = {"rsa2048": 2048, "rsa4096": 4096}
+
+
+class WorkerError(Exception):
+    """A pooled worker could not run a job (openssl error, crash or timeout)."""
+
+
+def find_libcrypto(openssl):
+    """The libcrypto next to the `openssl` binary, else the system one."""
+    prefix = os.path.dirname(os.path.dirname(os.path.realpath(openssl)))
+    for libdir in ("lib64", "lib"):
+        path = os.path.join(prefix, libdir, "libcrypto.so.3")
+        if os.path.exists(path):
+            return path
+    return ctypes.util.find_library("crypto")
+
+def _split_subject(subject):
+    """`/C=EU/O=QUBIP/CN=x` -> [("C", "EU"), ("O", "QUBIP"), ("CN", "x")], as `openssl req -subj`."""
+    fields = []
+    for part in re.split(r"(?<!\\)/", subject):
+        if not part:
+            continue
+        name, _, value = part.partition("=")
+        fields.append((name, value.replace("\\/", "/")))
+    return fields
+
+
+# -----------------------------------------------------------------------------
+# Worker side: runs in its own process with the pki environment, so the
+# OpenSSL config (and oqsprovider for pki-44) is loaded once per process.
+# -----------------------------------------------------------------------------
+class _LibCrypto:
+    def __init__(self, path):
+        self.lib = ctypes.CDLL(path)
+        self._signer_cache = None
+        for name, (restype, argtypes) in _SIGNATURES.items():
+            func = getattr(self.lib, name)
+            func.restype = restype
+            func.argtypes = argtypes
+        if not self.lib.OPENSSL_init_crypto(OPENSSL_INIT_LOAD_CONFIG, None):
+            raise WorkerError(self._error("OPENSSL_init_crypto"))
+
+    def _error(self, what):
+        code = self.lib.ERR_get_error()
+        buf = ctypes.create_string_buffer(256)
+        if code:
+            self.lib.ERR_error_string_n(code, buf, len(buf))
+        self.lib.ERR_clear_error()
+        return f"{what} failed: {buf.value.decode() or 'unknown error'}"
+
+    def _check(self, ok, what):
+        if not ok:
+            raise WorkerError(self._error(what))
+        return ok
+
+    def _bio(self, path, mode):
+        return self._check(self.lib.BIO_new_file(path.encode(), mode), f"open {path}")
+
+    def _mem_bio(self, data=None):
+        # BIO_write copies `data`; a BIO_new_mem_buf view would outlive the Python buffer
+        bio = self._check(self.lib.BIO_new(self.lib.BIO_s_mem()), "memory BIO")
+        if data is not None:
+            data = data.encode()
+            if self.lib.BIO_write(bio, data, len(data)) != len(data):
+                self.lib.BIO_free(bio)
+                raise WorkerError(self._error("memory BIO write"))
+        return bio
+
+    def _drain(self, bio):
+        chunks, buf = [], ctypes.create_string_buffer(16384)
+        while True:
+            n = self.lib.BIO_read(bio, buf, len(buf))
+            if n <= 0:
+                return b"".join(chunks).decode()
+            chunks.append(buf.raw[:n])
+
+    def _write(self, path, write, what, private=False):
+        """
+        Run `write(bio)` into memory and return the PEM when `path` is None,
+        else save it to `path` (owner-only for `private` files, as openssl genpkey does).
+        """
+        bio = self._mem_bio()
+        try:
+            self._check(write(bio), what)
+            pem = self._drain(bio)
+        finally:
+            self.lib.BIO_free(bio)
+        if path is None:
+            return pem
+        if private:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            os.fchmod(fd, 0o600)  # O_CREAT's mode does not apply to an existing file
+            with os.fdopen(fd, "w") as fp:
+                fp.write(pem)
+        else:
+            with open(path, "w") as fp:
+                fp.write(pem)
+        return None
+
+    def ping(self):
+        providers = {
+            name: bool(self.lib.OSSL_PROVIDER_available(None, name.encode()))
+            for name in ("default", "oqsprovider")
+        }
+        return {"pid": os.getpid(), "providers": providers}
+
+    def genpkey(self, algorithm, key_file=None):
+        lib = self.lib
+        name = "RSA" if algorithm in _RSA_BITS else algorithm
+        ctx = self._check(lib.EVP_PKEY_CTX_new_from_name(None, name.encode(), None), f"algorithm {algorithm}")
+        pkey = _P()
+        try:
+            self._check(lib.EVP_PKEY_keygen_init(ctx) > 0, "keygen init")
+            if algorithm in _RSA_BITS:
+                self._check(lib.EVP_PKEY_CTX_set_rsa_keygen_bits(ctx, _RSA_BITS[algorithm]) > 0, "rsa bits")
+            self._check(lib.EVP_PKEY_generate(ctx, ctypes.byref(pkey)) > 0, "keygen")
+            return self._write(
+                key_file, lambda bio: lib.PEM_write_bio_PrivateKey(bio, pkey, None, None, 0, None, None), "write key",
+                private=True)
+        finally:
+            lib.EVP_PKEY_free(pkey)
+            lib.EVP_PKEY_CTX_free(ctx)
+
+    def req(self, subject, conf, key_file=None, csr_file=None, key_pem=None, reqexts=None, san=None):
+        """
+        `openssl req -new -key .. -subj .. -config .. -reqexts ..` with SAN as $ENV::SAN.
+        The key comes from `key_file` or `key_pem`; without `csr_file` the PEM is returned.
+        """
+        lib = self.lib
+        bio = self._bio(key_file, b"r") if key_file else self._mem_bio(key_pem)
+        try:
+            pkey = self._check(lib.PEM_read_bio_PrivateKey(bio, None, None, None), f"read {key_file or 'key'}")
+        finally:
+            lib.BIO_free(bio)
+        req = lib.X509_REQ_new()
+        nconf = lib.NCONF_new(None)
+        try:
+            # the conf is parsed with the SAN of this job; each worker runs one job at a time
+            if san is not None:
+                os.environ["SAN"] = san
+            try:
+                errline = ctypes.c_long()
+                self._check(lib.NCONF_load(nconf, conf.encode(), ctypes.byref(errline)) > 0,
+                            f"load {conf} (line {errline.value})")
+            finally:
+                os.environ.pop("SAN", None)
+            self._check(lib.X509_REQ_set_version(req, 0), "set version")
+            name = lib.X509_REQ_get_subject_name(req)
+            for field, value in _split_subject(subject):
+                self._check(lib.X509_NAME_add_entry_by_txt(
+                    name, field.encode(), MBSTRING_ASC, value.encode(), -1, -1, 0), f"subject field {field}")
+            self._check(lib.X509_REQ_set_pubkey(req, pkey), "set public key")
+            section = reqexts or lib.NCONF_get_string(nconf, b"req", b"req_extensions")
+            lib.ERR_clear_error()
+            if section:
+                v3ctx = _X509V3Ctx()
+                lib.X509V3_set_ctx(ctypes.byref(v3ctx), None, None, req, None, 0)
+                lib.X509V3_set_nconf(ctypes.byref(v3ctx), nconf)
+                section = section.encode() if isinstance(section, str) else section
+                self._check(lib.X509V3_EXT_REQ_add_nconf(nconf, ctypes.byref(v3ctx), section, req),
+                            f"extensions {section.decode()}")
+            self._check(lib.X509_REQ_sign(req, pkey, self._digest(nconf, pkey)) > 0, "sign request")
+            return self._write(csr_file, lambda bio: lib.PEM_write_bio_X509_REQ(bio, req), "write request")
+        finally:
+            lib.NCONF_free(nconf)
+            lib.X509_REQ_free(req)
+            lib.EVP_PKEY_free(pkey)
+
+    def _digest(self, nconf, pkey):
+        """default_md from [req], else the key's default; NULL for ed25519/ML-DSA."""
+        lib = self.lib
+        name = lib.NCONF_get_string(nconf, b"req", b"default_md")
+        lib.ERR_clear_error()
+        if not name or name == b"default":
+            return self._key_digest(pkey)
+        return self._check(lib.EVP_get_digestbyname(name), f"digest {name.decode()}")
+
+    def _key_digest(self, pkey):
+        buf = ctypes.create_string_buffer(80)
+        if self.lib.EVP_PKEY_get_default_digest_name(pkey, buf, len(buf)) <= 0 or buf.value == b"UNDEF":
+            return None
+        return self._check(self.lib.EVP_get_digestbyname(buf.value), f"digest {buf.value.decode()}")
+
+    def _signer(self, ca_cert, ca_key, passfile):
+        """CA certificate and private key, loaded once per key file version."""
+        stamp = (ca_cert, ca_key, os.stat(ca_cert).st_mtime_ns, os.stat(ca_key).st_mtime_ns)
+        cached = self._signer_cache
+        if cached and cached[0] == stamp:
+            return cached[1], cached[2]
+        with open(passfile, "rb") as fp:
+            password = fp.readline().rstrip(b"\r\n")
+        bio = self._bio(ca_cert, b"r")
+        try:
+            cert = self._check(self.lib.PEM_read_bio_X509(bio, None, None, None), f"read {ca_cert}")
+        finally:
+            self.lib.BIO_free(bio)
+        bio = self._bio(ca_key, b"r")
+        try:
+            pkey = self.lib.PEM_read_bio_PrivateKey(bio, None, None, password)
+        finally:
+            self.lib.BIO_free(bio)
+        if not pkey:
+            self.lib.X509_free(cert)
+            raise WorkerError(self._error(f"read {ca_key}"))
+        if cached:
+            self.lib.X509_free(cached[1])
+            self.lib.EVP_PKEY_free(cached[2])
+        self._signer_cache = (stamp, cert, pkey)
+        return cert, pkey
+
+    def _ocsp_response(self, cert, pkey, entry, this_update, next_update):
+        lib = self.lib
+        serial_hex, status, revoked_at, reason = entry
+        bn, serial, cid, basic, resp = _P(), None, None, None, None
+        times = []
+        try:
+            self._check(lib.BN_hex2bn(ctypes.byref(bn), serial_hex.encode()), "serial")
+            serial = self._check(lib.BN_to_ASN1_INTEGER(bn, None), "serial")
+            cid = self._check(lib.OCSP_cert_id_new(
+                lib.EVP_get_digestbyname(b"SHA1"), lib.X509_get_subject_name(cert),
+                lib.X509_get0_pubkey_bitstr(cert), serial), "certificate id")
+            for when in (this_update, next_update, revoked_at):
+                times.append(when is not None and self._check(lib.ASN1_GENERALIZEDTIME_set(None, when), "time"))
+            basic = self._check(lib.OCSP_BASICRESP_new(), "basic response")
+            self._check(lib.OCSP_basic_add1_status(
+                basic, cid, OCSP_STATUSES[status], reason if status == "revoked" else -1,
+                times[2] or None, times[0], times[1]), "add status")
+            self._check(lib.OCSP_basic_sign(basic, cert, pkey, self._key_digest(pkey), None, OCSP_RESPID_KEY),
+                        "sign response")
+            resp = self._check(lib.OCSP_response_create(0, basic), "response")
+            size = self._check(lib.i2d_OCSP_RESPONSE(resp, None), "encode response")
+            buf = (ctypes.c_ubyte * size)()
+            out = ctypes.cast(buf, ctypes.POINTER(ctypes.c_ubyte))
+            lib.i2d_OCSP_RESPONSE(resp, ctypes.byref(out))
+            return base64.b64encode(bytes(buf)).decode()
+        finally:
+            lib.OCSP_RESPONSE_free(resp)
+            lib.OCSP_BASICRESP_free(basic)
+            for t in times:
+                if t:
+                    lib.ASN1_STRING_free(t)
+            lib.OCSP_CERTID_free(cid)
+            lib.ASN1_INTEGER_free(serial)
+            lib.BN_free(bn)
+
+    def ocsp_sign(self, ca_cert, ca_key, passfile, entries, this_update, next_update):
+        """
+        Signed SHA-1 CertID OCSP responses (base64 DER), one per
+        [serial hex, "good"|"revoked"|"unknown", revocation epoch, reason code]
+        in `entries`, as `openssl ocsp` would produce for the CA key.
+        """
+        cert, pkey = self._signer(ca_cert, ca_key, passfile)
+        return [self._ocsp_response(cert, pkey, entry, this_update, next_update) for entry in entries]
+
+
+    def _x509(self, der):
+        buf = ctypes.create_string_buffer(der, len(der))
+        ptr = _P(ctypes.addressof(buf))
+        return self.lib.d2i_X509(None, ctypes.byref(ptr), len(der))
+
+    def verify(self, issuer, certs):
+        """
+        For each base64 DER certificate in `certs`: whether `issuer`'s key
+        verifies its signature (None when OpenSSL cannot tell, e.g. unknown algorithm).
+        """
+        ca = self._check(self._x509(base64.b64decode(issuer)), "issuer certificate")
+        try:
+            pkey = self._check(self.lib.X509_get0_pubkey(ca), "issuer public key")
+            results = []
+            for cert in certs:
+                x = self._x509(base64.b64decode(cert))
+                if not x:
+                    results.append(None)
+                else:
+                    ok = self.lib.X509_verify(x, pkey)
+                    self.lib.X509_free(x)
+                    results.append(ok == 1 if ok >= 0 else None)
+                self.lib.ERR_clear_error()
+            return results
+        finally:
+            self.lib.X509_free(ca)
+
+
+def _serve(libcrypto):
+    try:
+        lib = _LibCrypto(libcrypto)
+    except Exception as e:
+        sys.stdout.write(json.dumps({"ok": False, "error": str(e)}) + "\n")
+        return
+    sys.stdout.write(json.dumps({"ok": True, "result": lib.ping()}) + "\n")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        job = json.loads(line)
+        try:
+            response = {"ok": True, "result": getattr(lib, job["op"])(**job.get("args", {}))}
+        except Exception as e:
+            response = {"ok": False, "error": str(e)}
+        sys.stdout.write(json.dumps(response) + "\n")
+        sys.stdout.flush()
+
+
+# -----------------------------------------------------------------------------
+# Pool side
+# -----------------------------------------------------------------------------
+class _Worker:
+    def __init__(self, group, env, libcrypto, timeout):
+        self.group = group
+        self.proc = subprocess.Popen(
+            [sys.executable, "-u", os.path.abspath(__file__), libcrypto],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, env=env, text=True, bufsize=1,
+        )
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.proc.stdout, selectors.EVENT_READ)
+        self.broken = False
+        try:
+            self.info = self._read(timeout)
+        except WorkerError:
+            self.stop()
+            raise
+
+    def _read(self, timeout):
+        if not self.selector.select(timeout):
+            self.broken = True
+            raise WorkerError(f"{self.group} worker {self.proc.pid} timed out")
+        line = self.proc.stdout.readline()
+        if not line:
+            self.broken = True
+            raise WorkerError(f"{self.group} worker {self.proc.pid} exited ({self.proc.poll()})")
+        response = json.loads(line)
+        if not response["ok"]:
+            raise WorkerError(response["error"])
+        return response["result"]
+
+    def call(self, op, args, timeout):
+        try:
+            self.proc.stdin.write(json.dumps({"op": op, "args": args}) + "\n")
+        except (BrokenPipeError, ValueError):
+            self.broken = True
+            raise WorkerError(f"{self.group} worker {self.proc.pid} is gone")
+        return self._read(timeout)
+
+    @property
+    def healthy(self):
+        return not self.broken and self.proc.poll() is None
+
+    def stop(self):
+        self.selector.close()
+        if self.proc.poll() is None:
+            self.proc.kill()
+        self.proc.wait()
+
+
+class _Group:
+    def __init__(self, name, env, size):
+        self.name = name
+        self.env = env
+        self.size = size
+        self.idle = queue.Queue()
+        self.count = 0
+        self.stats = {"started": 0, "restarts": 0, "unavailable": 0, "jobs": {}}
+
+
+class OpenSSLWorkerPool:
+    """
+    Long-lived worker processes per OpenSSL environment.
+
+    Each worker loads libcrypto with its group's environment once (for the
+    oqsprovider group that includes OQS_CONF and the provider module), then
+    runs key generation, CSR, signature verification and OCSP signing jobs
+    sent over its stdin. Workers that crash, time out or fail a health check are replaced.
+    Callers fall back to the openssl CLI when `call` raises WorkerError.
+    """
+
+    def __init__(self, openssl, envs, size=2, timeout=120, health_interval=30, libcrypto=None):
+        self.libcrypto = libcrypto or find_libcrypto(openssl)
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self._groups = {name: _Group(name, env, size) for name, env in envs.items()}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        for group in self._groups.values():
+            for _ in range(group.size):
+                self._spawn(group)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._health, name="openssl-pool", daemon=True)
+            self._thread.start()
+
+    def _spawn(self, group):
+        try:
+            worker = _Worker(group.name, group.env, self.libcrypto, self.timeout)
+        except (OSError, WorkerError) as e:
+            logging.error(f"Could not start {group.name} OpenSSL worker: {e}")
+            return False
+        group.stats["started"] += 1
+        group.count += 1
+        logging.info(f"{group.name} OpenSSL worker {worker.proc.pid} up, providers {worker.info['providers']}")
+        group.idle.put(worker)
+        return True
+
+    def _replace(self, group, worker):
+        worker.stop()
+        group.count -= 1
+        group.stats["restarts"] += 1
+        self._spawn(group)
+
+    def _health(self):
+        while True:
+            time.sleep(self.health_interval)
+            for group in self._groups.values():
+                for _ in range(group.idle.qsize()):
+                    try:
+                        worker = group.idle.get_nowait()
+                    except queue.Empty:
+                        break
+                    try:
+                        worker.call("ping", {}, timeout=5)
+                        group.idle.put(worker)
+                    except WorkerError as e:
+                        logging.warning(f"{group.name} OpenSSL worker failed health check: {e}")
+                        self._replace(group, worker)
+                for _ in range(group.size - group.count):
+                    self._spawn(group)
+
+    def handles(self, group):
+        return group in self._groups
+
+    def call(self, group_name, op, wait=1.0, **args):
+        """Run `op` on an idle worker of `group_name`; WorkerError if none is free or the job fails."""
+        group = self._groups[group_name]
+        try:
+            worker = group.idle.get(timeout=wait)
+        except queue.Empty:
+            group.stats["unavailable"] += 1
+            raise WorkerError(f"No idle {group_name} OpenSSL worker")
+        start = time.perf_counter()
+        ok = False
+        try:
+            result = worker.call(op, args, self.timeout)
+            ok = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - start
+            self._record(group, op, elapsed, ok)
+            if worker.healthy:
+                group.idle.put(worker)
+            else:
+                self._replace(group, worker)
+
+    def _record(self, group, op, elapsed, ok):
+        with self._lock:
+            entry = group.stats["jobs"].setdefault(op, {"count": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            entry["errors"] += not ok
+            entry["total_seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(group.stats, size=group.size, workers=group.count, idle=group.idle.qsize(),
+                           jobs={op: dict(e) for op, e in group.stats["jobs"].items()})
+                for name, group in self._groups.items()
+            }
+
+
+if __name__ == "__main__":
+    _serve(sys.argv[1])
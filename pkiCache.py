@@ -0,0 +1,108 @@
+import os
+import base64
+import hashlib
+import logging
+import threading
+from datetime import datetime, timezone
+
+from cryptography import x509
+
+
+def pem_to_der(data):
+    """DER bytes of the first PEM block in `data` (returned as-is if already DER)."""
+    if b"-----BEGIN" not in data:
+        return data
+    lines = data.split(b"-----BEGIN", 1)[1].split(b"\n")[1:]
+    body = []
+    for line in lines:
+        if line.startswith(b"-----END"):
+            break
+        body.append(line.strip())
+    return base64.b64decode(b"".join(body))
+
+def der_to_pem(der, label):
+    body = base64.encodebytes(der).replace(b"\n", b"")
+    lines = [body[i:i + 64] for i in range(0, len(body), 64)]
+    return b"\n".join([f"-----BEGIN {label}-----".encode(), *lines, f"-----END {label}-----".encode(), b""])
+
+
+class Artifact:
+    """One CA certificate or CRL as found on disk, in every form the views need."""
+
+    LABELS = {"certificate": "CERTIFICATE", "crl": "X509 CRL", "delta_crl": "X509 CRL"}
+
+    def __init__(self, kind, path, stamp, data, mtime):
+        self.kind = kind
+        self.path = path
+        self.stamp = stamp
+        self.data = data
+        self.der = pem_to_der(data)
+        self.pem = data if b"-----BEGIN" in data else der_to_pem(self.der, self.LABELS[kind])
+        self.etag = hashlib.sha256(self.der).hexdigest()[:32]
+        self.last_modified = datetime.fromtimestamp(mtime, timezone.utc)
+        self.parsed = self._parse()
+        self._text = None
+        self._derived = {}
+        self._lock = threading.Lock()
+
+    def _parse(self):
+        try:
+            if self.kind == "certificate":
+                return x509.load_der_x509_certificate(self.der)
+            return x509.load_der_x509_crl(self.der)
+        except ValueError as e:
+            logging.warning(f"Could not parse {self.path}: {e}")
+            return None
+
+    def rendered(self, render):
+        """Text dump of the artifact; `render()` runs once per file version."""
+        if self._text is None:
+            with self._lock:
+                if self._text is None:
+                    self._text = render()
+        return self._text
+
+    def derived(self, name, build):
+        """Any other per-version structure (e.g. a CRL index); `build()` runs once."""
+        value = self._derived.get(name)
+        if value is None:
+            with self._lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = self._derived[name] = build()
+        return value
+
+
+class ArtifactCache:
+    """CA certificates and CRLs keyed by (chain, ca, kind), invalidated on inode/mtime/size."""
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chain, ca, kind, path):
+        st = os.stat(path)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+        key = (chain, ca, kind)
+        entry = self._entries.get(key)
+        if entry is not None and entry.path == path and entry.stamp == stamp:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        with open(path, "rb") as fp:
+            data = fp.read()
+        entry = Artifact(kind, path, stamp, data, st.st_mtime)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def invalidate(self, chain=None, ca=None):
+        with self._lock:
+            for key in list(self._entries):
+                if chain in (None, key[0]) and ca in (None, key[1]):
+                    del self._entries[key]
+
+    def stats(self):
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
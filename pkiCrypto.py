@@ -1,13 +1,16 @@
 
-import sys
 import logging
 import os
 import subprocess
 import json, re
 from cryptography import x509
 from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
 import pprint
-import shlex
+import threading
+import time
+
+from opensslPool import WorkerError
 
 classical_algorithms = ['rsa2048', 'rsa4096', 'ed25519']
 
@@ -17,121 +20,233 @@ chains = ['certs', 'pki-65', 'pki-44']
 OPENSSL_MODULES = "/home/torseec/quantumsafe/build/lib/ossl-modules"
 OQS_CONF = "/opt/pki-file/oqs.cnf"
 
+OPENSSL_TIMEOUT = 120
+
+# environments for the openssl binary, built once: the oqsprovider one for pki-44
+# and for the composite keys, the process environment for the rest
+_BASE_ENV = dict(os.environ)
+_OQS_ENV = dict(_BASE_ENV, OPENSSL_CONF=OQS_CONF, OPENSSL_MODULES=OPENSSL_MODULES)
+OPENSSL_ENVS = {pki: (_OQS_ENV if pki == 'pki-44' else _BASE_ENV) for pki in chains}
+# one persistent worker group per distinct environment (see opensslPool)
+WORKER_ENVS = {"default": _BASE_ENV, "oqs": _OQS_ENV}
+_worker_pool = None
+
+_stats_lock = threading.Lock()
+_stats = {}
+
+def openssl_env_name(pki, algorithm=None):
+    return "oqs" if pki == 'pki-44' or algorithm == 'mldsa44_ed25519' else "default"
+
+def openssl_env(pki, algorithm=None):
+    if openssl_env_name(pki, algorithm) == "oqs":
+        return _OQS_ENV
+    return OPENSSL_ENVS.get(pki, _BASE_ENV)
+
+def set_worker_pool(pool):
+    """Route keygen and CSR generation through an OpenSSLWorkerPool (None: always exec openssl)."""
+    global _worker_pool
+    _worker_pool = pool
+
+def _pooled(op, pki, args, algorithm=None):
+    """
+    Run `op` on a pooled worker: (True, result), or (False, None) if there is
+    no pool or it failed and the caller must exec openssl.
+    """
+    group = openssl_env_name(pki, algorithm)
+    if _worker_pool is None or not _worker_pool.handles(group):
+        return False, None
+    try:
+        return True, _worker_pool.call(group, op, **args)
+    except WorkerError as e:
+        logging.warning(f"OpenSSL worker {op} failed, falling back to the CLI: {e}")
+        return False, None
+
+def run_openssl(openssl, pki, args, op=None, extra_env=None, algorithm=None, timeout=None, text=True, input=None):
+    """
+    Exec `openssl <args>` directly (no shell) with the pki's environment.
+    Raises CalledProcessError (with stderr) on failure and TimeoutExpired after `timeout`.
+    """
+    env = openssl_env(pki, algorithm)
+    if extra_env:
+        env = dict(env, **extra_env)
+    op = op or args[0]
+    start = time.perf_counter()
+    failed = True
+    try:
+        result = subprocess.run(
+            [openssl, *args], env=env, capture_output=True, text=text, input=input,
+            timeout=timeout or OPENSSL_TIMEOUT, check=True,
+        )
+        failed = False
+        return result
+    except subprocess.CalledProcessError as e:
+        logging.error(f"openssl {op} failed ({e.returncode}): {str(e.stderr).strip()}")
+        raise
+    except subprocess.TimeoutExpired:
+        logging.error(f"openssl {op} timed out after {timeout or OPENSSL_TIMEOUT}s")
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        with _stats_lock:
+            entry = _stats.setdefault(op, {"spawns": 0, "errors": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            entry["spawns"] += 1
+            entry["errors"] += failed
+            entry["total_seconds"] += elapsed
+            entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+
+def openssl_stats():
+    with _stats_lock:
+        return {
+            "spawns": sum(e["spawns"] for e in _stats.values()),
+            "operations": {op: dict(e) for op, e in _stats.items()},
+        }
+
 def generate_private_key(openssl, pki, key_file, algorithm):
-    if pki == 'pki-44':
-# add BOTH env vars inline
-        openssl_cmd = f'OPENSSL_CONF={shlex.quote(OQS_CONF)} OPENSSL_MODULES={shlex.quote(OPENSSL_MODULES)} {openssl}'
-        # include provider flags so we don’t depend on oqs.cnf content
-        provider_flags = f'-provider oqsprovider -provider default -provider-path {shlex.quote(OPENSSL_MODULES)} -propquery provider=oqsprovider'
-    else:
-        if algorithm == 'mldsa44_ed25519':
-            openssl_cmd = f'OPENSSL_CONF={shlex.quote(OQS_CONF)} OPENSSL_MODULES={shlex.quote(OPENSSL_MODULES)} {openssl}'
-        else:
-            openssl_cmd = openssl
     if algorithm in classical_algorithms:
         if algorithm == 'rsa2048':
-            cmd = f"{openssl_cmd} genpkey -algorithm RSA -out {key_file} -pkeyopt rsa_keygen_bits:2048"
+            args = ["genpkey", "-algorithm", "RSA", "-out", key_file, "-pkeyopt", "rsa_keygen_bits:2048"]
         elif algorithm == 'rsa4096':
-            cmd = f"{openssl_cmd} genpkey -algorithm RSA -out {key_file} -pkeyopt rsa_keygen_bits:4096"
+            args = ["genpkey", "-algorithm", "RSA", "-out", key_file, "-pkeyopt", "rsa_keygen_bits:4096"]
 
         elif algorithm == 'ed25519':
-            cmd = f"{openssl_cmd} genpkey -algorithm ed25519 -out {key_file}"
+            args = ["genpkey", "-algorithm", "ed25519", "-out", key_file]
     elif algorithm in pq_algorithms:
-        cmd = f"{openssl_cmd} genpkey -algorithm {algorithm} -out {key_file}"
+        args = ["genpkey", "-algorithm", algorithm, "-out", key_file]
     else:
         raise ValueError(f"Unsupported algorithm: {algorithm}")
-    
-    try:
-        subprocess.check_output(cmd, shell=True, text=True).strip()
-        if not os.path.isfile(key_file):
-            raise FileNotFoundError(f"Failed to create private key: {key_file}")
-    except subprocess.CalledProcessError as e:
-        sys.exit(1)
+    # openssl failures raise CalledProcessError / TimeoutExpired to the caller
+    if not _pooled("genpkey", pki, {"algorithm": algorithm, "key_file": key_file}, algorithm)[0]:
+        run_openssl(openssl, pki, args, op="genpkey", algorithm=algorithm)
+    if not os.path.isfile(key_file):
+        raise FileNotFoundError(f"Failed to create private key: {key_file}")
+
+def _request_extensions(subjectAltName, cn_type):
+    """(-reqexts section, extra env) for a request; the conf reads SAN as $ENV::SAN."""
+    if subjectAltName == "":
+        return None, None
+    # server or client
+    logging.info(f"SAN = {subjectAltName}")
+    reqexts = {"fqdn": "fqdn_ext", "ip": "ip_ext"}.get(cn_type)
+    return reqexts, {"SAN": subjectAltName}
 
 def generate_csr(openssl, pki, private_key, csr_filename, subject, conf, commonName, subjectAltName, cn_type):
-    env = os.environ
-    if pki == 'pki-44':
-        openssl_cmd = f'OPENSSL_CONF={shlex.quote(OQS_CONF)} OPENSSL_MODULES={shlex.quote(OPENSSL_MODULES)} {openssl}'
-    else:
-        openssl_cmd = openssl
-    if subjectAltName != "":  
-        # server or client
-        logging.info(f"SAN = {subjectAltName}")
-        env["SAN"] = subjectAltName
-        logging.info(env["SAN"])
-        if cn_type == "fqdn":
-            reqexts = "fqdn_ext"
-        elif cn_type == "ip":
-            reqexts = "ip_ext"
-    logging.info(reqexts)
-    try:
-        cmd = f"{openssl_cmd} req -new -key {private_key} -out {csr_filename} -subj {subject} -config {conf} -reqexts {reqexts}"
-        subprocess.check_output(cmd, shell=True, text=True).strip()
-    except subprocess.CalledProcessError as e:
-        logging.info(f"Error generating CSR: {e}")
-        sys.exit(1)
+    args = ["req", "-new", "-key", private_key, "-out", csr_filename, "-subj", subject, "-config", conf]
+    reqexts, extra_env = _request_extensions(subjectAltName, cn_type)
+    if reqexts:
+        args += ["-reqexts", reqexts]
+    pooled, _ = _pooled("req", pki, {
+        "key_file": private_key, "csr_file": csr_filename, "subject": subject,
+        "conf": conf, "reqexts": reqexts, "san": extra_env and extra_env["SAN"],
+    })
+    if not pooled:
+        run_openssl(openssl, pki, args, op="req", extra_env=extra_env)
 
 def sign_certificate(openssl, pki, csr_file, crt_file, purpose, ca_key, ca_passfile, ca_cert, ca_conf):
     if purpose == 'server':
         ext = 'server_ext'
     elif purpose == 'client':
         ext = 'client_ext'
-    if pki == 'pki-44':
-        openssl_cmd = f'OPENSSL_CONF={shlex.quote(OQS_CONF)} OPENSSL_MODULES={shlex.quote(OPENSSL_MODULES)} {openssl}'
-        
-    else:
-        openssl_cmd = openssl
-    try:
-        cmd = f"{openssl_cmd} ca -config {ca_conf} -keyfile {ca_key} -passin file:{ca_passfile} -cert {ca_cert} -in {csr_file} -out {crt_file} -extensions {ext} -days 365 -batch"
-        subprocess.check_output(cmd, shell=True, text=True).strip()
-        if os.path.isfile(crt_file):
-            logging.info(f"Successfully created end entity certificate: {crt_file}")
-            return
-        else:
-            raise FileNotFoundError(f"Failed to create certificate: {crt_file}")
-    except subprocess.CalledProcessError as e:
-        logging.info(f"Error generating certificate: {e}")
-        sys.exit(1)
+    run_openssl(openssl, pki, [
+        "ca", "-config", ca_conf, "-keyfile", ca_key, "-passin", f"file:{ca_passfile}",
+        "-cert", ca_cert, "-in", csr_file, "-out", crt_file, "-extensions", ext, "-days", "365", "-batch",
+    ], op="ca")
+    if not os.path.isfile(crt_file):
+        raise FileNotFoundError(f"Failed to create certificate: {crt_file}")
+    logging.info(f"Successfully created end entity certificate: {crt_file}")
 
 def convert_certificate_to_der(openssl, pki, crt_file):
-    if pki == 'pki-44':
-        openssl_cmd = f'OPENSSL_CONF={shlex.quote(OQS_CONF)} OPENSSL_MODULES={shlex.quote(OPENSSL_MODULES)} {openssl}'
-        
-    else:
-        openssl_cmd = openssl
+    der_file = f"{crt_file}.der"
     try:
-        der_file = f"{crt_file}.der"
-        cmd = f"{openssl_cmd} x509 -in {crt_file} -out {der_file} -outform DER"
-        subprocess.check_output(cmd, shell=True, text=True).strip()
-    except subprocess.CalledProcessError as e:
+        # first certificate only, like `openssl x509 -outform DER`; no provider needed to re-encode
+        with open(crt_file, "rb") as fp:
+            der = x509.load_pem_x509_certificate(fp.read()).public_bytes(serialization.Encoding.DER)
+        with open(der_file, "wb") as fp:
+            fp.write(der)
+        return
+    except (OSError, ValueError) as e:
+        logging.debug(f"In-process DER conversion of {crt_file} failed ({e}), using openssl")
+    try:
+        run_openssl(openssl, pki, ["x509", "-in", crt_file, "-out", der_file, "-outform", "DER"])
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
         logging.error(f"Error converting certificate to DER format: {e}")
 
+# In-memory variants for ISSUANCE_IN_MEMORY: keys, CSRs and derived formats stay
+# in process memory; only the CA writes the certificate of record.
+
+def generate_private_key_pem(openssl, pki, algorithm):
+    """PKCS#8 PEM private key, as `generate_private_key` but without a key file."""
+    if algorithm not in classical_algorithms and algorithm not in pq_algorithms:
+        raise ValueError(f"Unsupported algorithm: {algorithm}")
+    pooled, pem = _pooled("genpkey", pki, {"algorithm": algorithm}, algorithm)
+    if pooled:
+        return pem.encode()
+    if algorithm in ('rsa2048', 'rsa4096'):
+        args = ["genpkey", "-algorithm", "RSA", "-pkeyopt", f"rsa_keygen_bits:{algorithm[3:]}"]
+    else:
+        args = ["genpkey", "-algorithm", algorithm]
+    return run_openssl(openssl, pki, args, op="genpkey", algorithm=algorithm, text=False).stdout
+
+def generate_csr_pem(openssl, pki, key_pem, subject, conf, commonName, subjectAltName, cn_type):
+    """PEM CSR for `key_pem`, as `generate_csr` but without key or CSR files."""
+    reqexts, extra_env = _request_extensions(subjectAltName, cn_type)
+    pooled, pem = _pooled("req", pki, {
+        "key_pem": key_pem.decode(), "subject": subject, "conf": conf,
+        "reqexts": reqexts, "san": extra_env and extra_env["SAN"],
+    })
+    if pooled:
+        return pem.encode()
+    args = ["req", "-new", "-key", "/dev/stdin", "-subj", subject, "-config", conf]
+    if reqexts:
+        args += ["-reqexts", reqexts]
+    return run_openssl(openssl, pki, args, op="req", extra_env=extra_env, text=False, input=key_pem).stdout
+
+def sign_certificate_pem(openssl, pki, csr_pem, purpose, ca_key, ca_passfile, ca_cert, ca_conf):
+    """`openssl ca` on a CSR given in memory; the CA still writes newcerts/<SERIAL>.pem and its index."""
+    ext = 'server_ext' if purpose == 'server' else 'client_ext'
+    return run_openssl(openssl, pki, [
+        "ca", "-config", ca_conf, "-keyfile", ca_key, "-passin", f"file:{ca_passfile}",
+        "-cert", ca_cert, "-in", "/dev/stdin", "-notext", "-extensions", ext, "-days", "365", "-batch",
+    ], op="ca", text=False, input=csr_pem).stdout
+
+def certificate_to_der(pem):
+    """DER of the first certificate in `pem`."""
+    return x509.load_pem_x509_certificate(pem).public_bytes(serialization.Encoding.DER)
+
 def create_certificate_chain(cert_file, ca_chain, chain_file):
+    """Write leaf + CA chain to `chain_file` (the app derives bundles in memory via certFormats)."""
     try:
+        with open(cert_file, "rb") as cert, open(ca_chain, "rb") as ca:
+            data = cert.read() + ca.read()
         with open(chain_file, "wb") as chain:
-            print(chain_file)
-            with open(cert_file, "rb") as cert:
-                chain.write(cert.read())
-                cert.close()
-            with open(ca_chain, "rb") as ca:
-                print(ca_chain)
-                chain.write(ca.read())
-                ca.close()
+            chain.write(data)
         logging.info(f"Certificate chain successfully created: {chain_file}")
-        chain.close()
     except Exception as e:
         logging.info(f"Error creating certificate chain: {e}")
 
 # functions called by viewing ca certs/crl APIs
 
-def get_ca_certificate_details(openssl, ca_cert_path):
-    cert_command = f"{openssl} x509 -in {ca_cert_path} -noout -text -certopt no_sigdump"    
+def get_ca_certificate_details(openssl, ca_cert_path, pki=None):
     ca_cert_data = ""
-    ca_cert_data = subprocess.check_output(cert_command, shell=True, text=True).strip()
+    ca_cert_data = run_openssl(
+        openssl, pki, ["x509", "-in", ca_cert_path, "-noout", "-text", "-certopt", "no_sigdump"]
+    ).stdout.strip()
     return ca_cert_data
 
-def get_crl_details(openssl, crl_path):
-    crl_command = f"{openssl} crl -in {crl_path} -noout -text | sed '/Signature Value/,/^$/d'"
+def _drop_signature_blocks(text):
+    """Same as `sed '/Signature Value/,/^$/d'`."""
+    lines, skipping = [], False
+    for line in text.splitlines():
+        if skipping:
+            skipping = line != ""
+        elif "Signature Value" in line:
+            skipping = True
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+def get_crl_details(openssl, crl_path, pki=None):
     crl_data = ""
-    crl_data = subprocess.check_output(crl_command, shell=True, text=True).strip()
+    crl_data = _drop_signature_blocks(
+        run_openssl(openssl, pki, ["crl", "-in", crl_path, "-noout", "-text"]).stdout
+    ).strip()
     return crl_data
@@ -0,0 +1,157 @@
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_LABELS = ("stage", "pki", "ca", "algorithm", "purpose")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + [f'{n}="{v}"' for n, v in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, (), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            entry = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[i] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, entry in self._values.items():
+                for bound, count in zip(self.buckets, entry):
+                    out.append((f"{self.name}_bucket", key, (("le", _number(bound)),), count))
+                out.append((f"{self.name}_sum", key, (), entry[-2]))
+                out.append((f"{self.name}_count", key, (), entry[-1]))
+        return out
+
+
+class Gauge:
+    """Read at scrape time: `collect()` returns [(label values, value)]."""
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        return [(self.name, tuple(str(v) for v in key), (), value) for key, value in self.collect()]
+
+
+class CollectedCounter(Gauge):
+    """A counter whose totals are kept elsewhere (e.g. pkiCrypto.openssl_stats)."""
+    kind = "counter"
+
+
+class Metrics:
+    """
+    Prometheus text-format registry for the issuance pipeline.
+
+    `span()` times one stage of a request and records it in
+    `pki_stage_duration_seconds`, counting failures in `pki_stage_errors_total`.
+    Gauges and externally kept counters are read when /metrics is scraped.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self.stage_duration = self.histogram(
+            "pki_stage_duration_seconds", "Duration of one issuance pipeline stage.", STAGE_LABELS)
+        self.stage_errors = self.counter(
+            "pki_stage_errors_total", "Pipeline stages that raised.", STAGE_LABELS)
+        self.request_duration = self.histogram(
+            "pki_http_request_duration_seconds", "HTTP request duration by endpoint.",
+            ("endpoint", "method", "status"))
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=STAGE_BUCKETS):
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, labelnames, collect):
+        return self.register(Gauge(name, help, labelnames, collect))
+
+    def collected_counter(self, name, help, labelnames, collect):
+        return self.register(CollectedCounter(name, help, labelnames, collect))
+
+    @contextmanager
+    def span(self, stage, also=None, **labels):
+        """Time `stage`; `also(stage)` (e.g. a job's stage timer) is entered around it too."""
+        labels = {n: labels.get(n) or "" for n in STAGE_LABELS[1:]}
+        start = time.perf_counter()
+        try:
+            with (also(stage) if also else nullcontext()):
+                yield
+        except BaseException:
+            self.stage_errors.inc(stage=stage, **labels)
+            raise
+        finally:
+            self.stage_duration.observe(time.perf_counter() - start, stage=stage, **labels)
+
+    def stage_timer(self, also=None, **labels):
+        """`stage(name)` callable bound to fixed labels, for issue_generated_certificate."""
+        return lambda stage: self.span(stage, also=also, **labels)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            try:
+                samples = metric.samples()
+            except Exception:
+                continue  # a broken collector must not take /metrics down
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, extra, value in samples:
+                lines.append(f"{name}{_labels(metric.labelnames, key, extra)} {_number(value)}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+
+# files worth a precompressed variant (DER is mostly incompressible)
+GZIP_EXTS = (".pem", ".html", ".json", ".crl")
+MANIFEST = "manifest.json"
+
+
+class StaticPublisher:
+    """
+    Public CA material exported to `<root>/current`, for a reverse proxy to
+    serve directly (e.g. nginx `gzip_static on`).
+
+    Each run writes a complete tree under `<root>/versions/<id>/`, with
+    `.gz` variants and a `manifest.json` of size, ETag and mtime per file.
+    It then repoints the `current` symlink with one rename, so readers see
+    either the old tree or the new one. Runs whose content is unchanged do
+    not create a version. Runs are triggered by `request()` (CRL
+    regenerated, CA reloaded) and every `interval` seconds, and bursts of
+    triggers coalesce into one run.
+    """
+
+    def __init__(self, root, collect, keep=3):
+        self.root = root
+        self.collect = collect  # () -> [(relative path, bytes, mtime or None)]
+        self.keep = keep
+        self.versions = os.path.join(root, "versions")
+        self.current = os.path.join(root, "current")
+        os.makedirs(self.versions, exist_ok=True)
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stats = {"runs": 0, "published": 0, "unchanged": 0, "failed": 0}
+        self.last = None
+
+    def request(self):
+        self._event.set()
+
+    def start(self, interval=300):
+        if self._thread is None:
+            self._event.set()
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="static-publisher", daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            self._event.wait(interval)
+            self._event.clear()
+            try:
+                self.publish()
+            except Exception as e:
+                self._stats["failed"] += 1
+                logging.error(f"Static publication failed: {e!r}")
+
+    def _manifest(self, version):
+        try:
+            with open(os.path.join(self.versions, version, MANIFEST), "r") as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def live_version(self):
+        try:
+            return os.path.basename(os.readlink(self.current))
+        except OSError:
+            return None
+
+    def publish(self):
+        """Export everything `collect()` returns; returns the live version id."""
+        with self._lock:
+            start = time.perf_counter()
+            self._stats["runs"] += 1
+            items = self.collect()
+            manifest = {
+                path: {"etag": hashlib.sha256(data).hexdigest()[:32], "size": len(data), "mtime": mtime}
+                for path, data, mtime in items
+            }
+            live = self.live_version()
+            previous = self._manifest(live) if live else None
+            if previous is not None and previous.get("files") == manifest:
+                self._stats["unchanged"] += 1
+                return live
+            version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+            target = os.path.join(self.versions, version)
+            try:
+                self._write(target, items, manifest, version)
+                link = os.path.join(self.root, f".current-{version}")
+                os.symlink(os.path.join("versions", version), link)
+                os.replace(link, self.current)
+            except BaseException:
+                shutil.rmtree(target, ignore_errors=True)
+                raise
+            self._prune(version)
+            self._stats["published"] += 1
+            self.last = {"version": version, "files": len(items), "at": time.time(),
+                         "seconds": time.perf_counter() - start}
+            logging.info(f"Published {len(items)} static files as version {version}")
+            return version
+
+    def _write(self, target, items, manifest, version):
+        for path, data, mtime in items:
+            dest = os.path.join(target, path)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            variants = [(dest, data)]
+            if dest.endswith(GZIP_EXTS):
+                packed = gzip.compress(data, mtime=0)  # reproducible bytes
+                if len(packed) < len(data):
+                    variants.append((f"{dest}.gz", packed))
+            for name, body in variants:
+                with open(name, "wb") as fp:
+                    fp.write(body)
+                if mtime is not None:
+                    # stable Last-Modified/ETag from the proxy across versions
+                    os.utime(name, (mtime, mtime))
+        with open(os.path.join(target, MANIFEST), "w") as fp:
+            json.dump({"version": version, "generated": time.time(), "files": manifest}, fp, indent=1, sort_keys=True)
+            fp.flush()
+            os.fsync(fp.fileno())
+
+    def _prune(self, live):
+        old = sorted(name for name in os.listdir(self.versions) if name != live)
+        for name in old[:max(0, len(old) - (self.keep - 1))]:
+            shutil.rmtree(os.path.join(self.versions, name), ignore_errors=True)
+
+    def stats(self):
+        return dict(self._stats, root=self.root, live=self.live_version(), last=self.last)
@@ -0,0 +1,254 @@
+import os
+import time
+import uuid
+import fcntl
+import sqlite3
+import logging
+import threading
+
+ARCHIVE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    name    TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset  INTEGER NOT NULL,
+    length  INTEGER NOT NULL,
+    mtime   REAL
+);
+CREATE INDEX IF NOT EXISTS idx_members_segment ON members (segment);
+"""
+
+KINDS = ("keys", "csrs", "derived", "archived")
+
+
+def secure_delete(path):
+    """
+    Overwrite `path` with random bytes, fsync and unlink it; returns its size.
+    Best effort: copy-on-write or journaling filesystems may keep old blocks.
+    """
+    size = os.path.getsize(path)
+    with open(path, "r+b") as fp:
+        remaining = size
+        while remaining:
+            chunk = min(remaining, 65536)
+            fp.write(os.urandom(chunk))
+            remaining -= chunk
+        fp.flush()
+        os.fsync(fp.fileno())
+    os.remove(path)
+    return size
+
+
+class SegmentArchive:
+    """
+    Files of one directory packed into append-only segments under
+    `<dir>/archive/`, indexed in SQLite by name -> (segment, offset, length).
+
+    A segment is fsynced and indexed before the originals are unlinked; a
+    crash in between leaves files that the next run only removes, and
+    segments that never got indexed are dropped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.root = os.path.join(directory, "archive")
+        os.makedirs(self.root, exist_ok=True)
+        self.path = os.path.join(self.root, "index.db")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._conn() as conn:
+            conn.executescript(ARCHIVE_SCHEMA)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def read(self, name):
+        row = self._conn().execute(
+            "SELECT segment, offset, length FROM members WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        with open(os.path.join(self.root, row[0]), "rb") as fp:
+            fp.seek(row[1])
+            return fp.read(row[2])
+
+    def pack(self, paths, segment_bytes):
+        """Move `paths` into new segments. Returns (files, bytes, segments)."""
+        with self._lock, open(os.path.join(self.root, ".lock"), "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            conn = self._conn()
+            self._drop_orphans(conn)
+            done, pending = [], []
+            for path in paths:
+                known = conn.execute("SELECT 1 FROM members WHERE name = ?", (os.path.basename(path),)).fetchone()
+                (done if known else pending).append(path)
+            segments = 0
+            while pending:
+                chunk, size = [], 0
+                while pending and size < segment_bytes:
+                    path = pending.pop(0)
+                    chunk.append(path)
+                    size += os.path.getsize(path)
+                done += self._write_segment(conn, chunk)
+                segments += 1
+        files = nbytes = 0
+        for path in done:
+            try:
+                nbytes += os.path.getsize(path)
+                os.remove(path)
+                files += 1
+            except FileNotFoundError:
+                pass
+        return files, nbytes, segments
+
+    def _write_segment(self, conn, paths):
+        segment = f"seg-{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}.pack"
+        rows, offset = [], 0
+        with open(os.path.join(self.root, segment), "wb") as out:
+            for path in paths:
+                try:
+                    with open(path, "rb") as fp:
+                        data = fp.read()
+                    mtime = os.path.getmtime(path)
+                except FileNotFoundError:
+                    continue
+                out.write(data)
+                rows.append((os.path.basename(path), segment, offset, len(data), mtime))
+                offset += len(data)
+            out.flush()
+            os.fsync(out.fileno())
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO members VALUES (?, ?, ?, ?, ?)", rows)
+        return [os.path.join(self.directory, row[0]) for row in rows]
+
+    def _drop_orphans(self, conn):
+        indexed = {row[0] for row in conn.execute("SELECT DISTINCT segment FROM members")}
+        for name in os.listdir(self.root):
+            if name.endswith(".pack") and name not in indexed:
+                os.remove(os.path.join(self.root, name))
+
+    def stats(self):
+        members, nbytes, segments = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(length), 0), COUNT(DISTINCT segment) FROM members").fetchone()
+        return {"members": members, "bytes": nbytes, "segments": segments}
+
+
+class RetentionSweeper:
+    """
+    Background clean-up of what issuance leaves behind:
+
+    - private keys nobody downloaded, after `key_ttl` (overwritten, then unlinked)
+    - CSRs and legacy `.der`/`-chain.pem` copies in newcerts, after `csr_ttl`
+    - issued certificates older than `archive_after`, packed into segments
+      that `read_issued` still serves
+
+    Reclaimed bytes and inodes are counted per kind.
+    """
+
+    def __init__(self, key_dir, newcerts_dirs, key_ttl=86400, csr_ttl=3600,
+                 archive_after=30 * 86400, segment_bytes=64 * 1024 * 1024):
+        self.key_dir = key_dir
+        self.newcerts_dirs = list(newcerts_dirs)
+        self.key_ttl = key_ttl
+        self.csr_ttl = csr_ttl
+        self.archive_after = archive_after
+        self.segment_bytes = segment_bytes
+        self._archives = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._totals = {kind: {"files": 0, "bytes": 0, "inodes": 0} for kind in KINDS}
+        self.last_run = None
+
+    def archive(self, directory):
+        with self._lock:
+            archive = self._archives.get(directory)
+            if archive is None:
+                archive = self._archives[directory] = SegmentArchive(directory)
+            return archive
+
+    def read_issued(self, path):
+        """Bytes of an issued certificate file, from disk or from its directory's archive."""
+        try:
+            with open(path, "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(path)
+        if not os.path.isdir(os.path.join(directory, "archive")):
+            return None
+        return self.archive(directory).read(os.path.basename(path))
+
+    def start(self, interval=3600):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(interval,), name="retention", daemon=True)
+            self._thread.start()
+
+    def _run(self, interval):
+        while True:
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Retention sweep failed: {e!r}")
+            time.sleep(interval)
+
+    @staticmethod
+    def _older_than(directory, age, match):
+        cutoff = time.time() - age
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return []
+        return [e.path for e in entries
+                if e.is_file(follow_symlinks=False) and match(e.name) and e.stat().st_mtime < cutoff]
+
+    def _delete(self, report, kind, paths, remove=os.remove):
+        for path in paths:
+            try:
+                size = os.path.getsize(path)
+                remove(path)
+            except FileNotFoundError:
+                continue
+            report[kind]["files"] += 1
+            report[kind]["bytes"] += size
+            report[kind]["inodes"] += 1
+
+    def sweep(self):
+        """One pass over keys, CSRs and newcerts; returns what it reclaimed."""
+        start = time.perf_counter()
+        report = {kind: {"files": 0, "bytes": 0, "inodes": 0} for kind in KINDS}
+        # keys of the key pool live in a subdirectory and are not touched
+        self._delete(report, "keys", self._older_than(
+            self.key_dir, self.key_ttl, lambda n: n.endswith(".key")), remove=secure_delete)
+        for directory in self.newcerts_dirs:
+            self._delete(report, "csrs", self._older_than(
+                directory, self.csr_ttl, lambda n: n.endswith(".csr")))
+            self._delete(report, "derived", self._older_than(
+                directory, self.csr_ttl, lambda n: n.endswith((".der", "-chain.pem"))))
+            old = self._older_than(directory, self.archive_after, lambda n: n.endswith(".pem") and not n.endswith("-chain.pem"))
+            if old:
+                files, nbytes, segments = self.archive(directory).pack(sorted(old), self.segment_bytes)
+                report["archived"]["files"] += files
+                report["archived"]["bytes"] += nbytes
+                report["archived"]["inodes"] += files - segments
+        with self._lock:
+            for kind, counts in report.items():
+                for key, value in counts.items():
+                    self._totals[kind][key] += value
+            self.last_run = {"at": time.time(), "seconds": time.perf_counter() - start, "reclaimed": report}
+        if any(counts["files"] for counts in report.values()):
+            logging.info("Retention sweep reclaimed " + ", ".join(
+                f"{kind}: {c['files']} files/{c['bytes']} bytes" for kind, c in report.items() if c["files"]))
+        return report
+
+    def stats(self):
+        with self._lock:
+            totals = {kind: dict(counts) for kind, counts in self._totals.items()}
+            archives = dict(self._archives)
+        return {
+            "reclaimed": totals,
+            "last_run": self.last_run,
+            "archives": {directory: archive.stats() for directory, archive in archives.items()},
+        }
@@ -5,6 +5,8 @@ document.addEventListener("DOMContentLoaded", function () {
     const certForm = document.getElementById("certForm");
     const chain = certForm.getAttribute("data-chain");
     const purpose = certForm.getAttribute("data-purpose");
+    // jobs live in the process that queued them: only poll when the server says it is safe
+    const asyncJobs = certForm.getAttribute("data-async") === "true";
 
     // Actions after certificate generation
     const certActions = document.getElementById("certificate-actions");
@@ -42,6 +44,17 @@ document.addEventListener("DOMContentLoaded", function () {
         loader.style.display = "none";
     }
 
+    function pollJob(statusUrl) {
+        return fetch(statusUrl)
+            .then(response => response.json())
+            .then(job => {
+                if (job.status === "done") return job.result;
+                if (job.status === "failed" || job.error) throw new Error(job.error || "Job failed");
+                return new Promise(resolve => setTimeout(resolve, 500))
+                    .then(() => pollJob(statusUrl));
+            });
+    }
+
     function resetCheckboxes() {
         fqdnCheckboxes.forEach(checkbox => checkbox.checked = false);
         ipCheckboxes.forEach(checkbox => checkbox.checked = false);
@@ -211,7 +224,8 @@ document.addEventListener("DOMContentLoaded", function () {
                 algorithm: algorithm,
                 purpose: purpose,
                 cn_type: cnType,
-                device: device
+                device: device,
+                async: asyncJobs
             };
             console.log("Data to be sent:", data);
             fetch(`/generate_certificate/${purpose}`, {
@@ -219,6 +233,7 @@ document.addEventListener("DOMContentLoaded", function () {
                 headers: { 'Content-Type': 'application/json' },
                 body: JSON.stringify(data)
             }).then(response => response.json())
+                .then(data => data.job_id ? pollJob(data.status_url) : data)
                 .then(data => {
                     hideLoader();
                     certActions.style.display = "flex";
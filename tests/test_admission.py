@@ -0,0 +1,89 @@
+import threading
+
+import pytest
+
+from admission import AdmissionController, Rejected
+
+
+def _controller(**kwargs):
+    classes = {
+        "sign": {"concurrency": 2, "rate": 1.0, "burst": 3},
+        "keygen": {"concurrency": 4, "rate": 0.0, "burst": 0},
+        "keygen_heavy": {"concurrency": 1, "rate": 0.0, "burst": 0},
+    }
+    return AdmissionController(classes=classes, **kwargs)
+
+
+def test_classify():
+    controller = AdmissionController()
+    assert controller.classify("keygen", "ed25519") == "keygen"
+    assert controller.classify("keygen", "rsa4096") == "keygen_heavy"
+    assert controller.classify("keygen", "rsa4096", pooled=True) == "sign"
+    assert controller.classify("batch") == "batch"
+
+
+def test_client_over_its_rate_gets_429():
+    controller = _controller()
+    for _ in range(3):
+        controller.admit("sign", "10.0.0.1", slot=False)
+    with pytest.raises(Rejected) as e:
+        controller.admit("sign", "10.0.0.1", slot=False)
+    assert e.value.status == 429
+    assert e.value.cost_class == "sign"
+    assert e.value.retry_after >= 1
+    # other clients have their own bucket
+    assert controller.admit("sign", "10.0.0.2", slot=False) is None
+    assert controller.stats()["classes"]["sign"]["throttled"] == 1
+
+
+def test_full_class_gets_503_and_refunds_the_token():
+    controller = _controller()
+    tickets = [controller.admit("sign", "10.0.0.1") for _ in range(2)]
+    with pytest.raises(Rejected) as e:
+        controller.admit("sign", "10.0.0.1")
+    assert e.value.status == 503
+    assert e.value.retry_after >= 1
+
+    tickets[0].release()
+    tickets[0].release()  # a second release is a no-op
+    assert controller.stats()["classes"]["sign"]["in_flight"] == 1
+    controller.admit("sign", "10.0.0.1").release()  # the refunded token
+    with pytest.raises(Rejected) as e:
+        controller.admit("sign", "10.0.0.1")
+    assert e.value.status == 429
+    assert controller.stats()["classes"]["sign"]["shed"] == 1
+
+
+def test_reserved_workers_cap_all_classes():
+    controller = _controller(workers=4, reserved=1)
+    assert controller.capacity == 3
+    held = [controller.admit("keygen", f"10.0.0.{i}") for i in range(3)]
+    with pytest.raises(Rejected) as e:
+        controller.admit("sign", "10.0.0.9")
+    assert e.value.status == 503
+    for ticket in held:
+        ticket.release()
+    assert controller.stats()["in_flight"] == 0
+
+
+def test_algorithm_limit():
+    controller = _controller(algorithm_limits={"mldsa87": 1})
+    ticket = controller.admit("keygen", "10.0.0.1", algorithm="mldsa87")
+    with pytest.raises(Rejected):
+        controller.admit("keygen", "10.0.0.2", algorithm="mldsa87")
+    controller.admit("keygen", "10.0.0.2", algorithm="ed25519").release()
+    ticket.release()
+    controller.admit("keygen", "10.0.0.2", algorithm="mldsa87").release()
+    assert controller.stats()["algorithms"]["mldsa87"] == {"in_flight": 0, "limit": 1}
+
+
+def test_waiter_is_admitted_when_a_slot_frees():
+    controller = _controller(max_wait=5.0)
+    held = controller.admit("keygen_heavy", "10.0.0.1")
+    admitted = []
+    waiter = threading.Thread(target=lambda: admitted.append(controller.admit("keygen_heavy", "10.0.0.2")))
+    waiter.start()
+    held.release()
+    waiter.join(5)
+    assert len(admitted) == 1
+    admitted[0].release()
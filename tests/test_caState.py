@@ -0,0 +1,152 @@
+import os
+import sys
+import json
+import fcntl
+import socket
+import threading
+import subprocess
+from contextlib import contextmanager
+
+import pytest
+from cryptography.hazmat.primitives import serialization
+
+from caEngine import read_index, serial_to_hex, name_oneline
+from caState import CAState, _ranges
+
+
+class FakeCA:
+    """The parts of CAContext that CAState uses, over a database in `root`."""
+
+    def __init__(self, root, unique_subject=False):
+        self.name = "test-ca"
+        self.section_name = "CA_default"
+        self.database = os.path.join(root, "index.txt")
+        self.serial_file = os.path.join(root, "serial")
+        self.ca_conf = os.path.join(root, "ca.conf")
+        self.new_certs_dir = os.path.join(root, "newcerts")
+        self.unique_subject = unique_subject
+        self.lock = threading.Lock()
+        os.makedirs(self.new_certs_dir)
+        open(self.database, "w").close()
+        with open(self.serial_file, "w") as fp:
+            fp.write("1000\n")
+        with open(self.ca_conf, "w") as fp:
+            fp.write(f"[ {self.section_name} ]\ndatabase = {self.database}\n")
+
+    @contextmanager
+    def db_lock(self):
+        with self.lock, open(f"{self.database}.lock", "a") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            yield
+
+    def check_unique_subject(self, subject, pending=()):
+        valid = {e.subject for e in read_index(self.database).values() if e.status == "V"}
+        if self.unique_subject and (subject in valid or subject in pending):
+            raise ValueError(f"There is already a certificate for {subject} (unique_subject)")
+
+
+def _serial(ctx):
+    with open(ctx.serial_file, "r") as fp:
+        return int(fp.read().strip(), 16)
+
+def _dead_pid():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+
+@pytest.fixture
+def ctx(tmp_path):
+    return FakeCA(str(tmp_path))
+
+
+def test_ranges():
+    assert _ranges([1, 2, 3, 7, 9, 10]) == [[1, 4], [7, 8], [9, 11]]
+
+
+def test_lease_reserves_a_block_of_serials(ctx):
+    state = CAState(ctx, lease_size=4)
+    serials = [state.next_serial() for _ in range(6)]
+    assert serials == [0x1000, 0x1001, 0x1002, 0x1003, 0x1004, 0x1005]
+    assert _serial(ctx) == 0x1008
+    assert state.stats()["leases"] == 2
+    assert state.stats()["lease_remaining"] == 2
+
+
+def test_release_returns_the_rest_of_the_lease(ctx):
+    state = CAState(ctx, lease_size=8)
+    state.next_serial()
+    state.release()
+    assert json.load(open(state.free_file)) == [[0x1001, 0x1008]]
+    assert not os.path.exists(state.lease_file)
+
+    again = CAState(ctx, lease_size=4)
+    assert again.next_serial() == 0x1001
+    assert json.load(open(again.free_file)) == [[0x1005, 0x1008]]
+    assert _serial(ctx) == 0x1008
+
+
+def test_merge_folds_journals_into_the_index(ctx, make_cert):
+    state = CAState(ctx, lease_size=4)
+    certs = [make_cert(state.next_serial(), f"device-{i}") for i in range(3)]
+    for cert in certs:
+        state.record(cert)
+    assert read_index(ctx.database) == {}
+
+    with ctx.db_lock():
+        state.merge_journals()
+    index = read_index(ctx.database)
+    assert sorted(index) == [cert.serial_number for cert in certs]
+    assert index[certs[0].serial_number].subject == name_oneline(certs[0].subject)
+    assert os.path.getsize(state.journal_file) == 0
+
+    # an entry already in the index is not appended twice, a torn line is dropped
+    state.record(certs[0])
+    with open(state.journal_file, "a") as fp:
+        fp.write("V\t2501")
+    with ctx.db_lock():
+        state.merge_journals()
+    with open(ctx.database) as fp:
+        assert len(fp.readlines()) == 3
+    assert state.stats()["merged"] == 3
+
+
+def test_recover_reclaims_a_dead_lease(ctx, make_cert):
+    state = CAState(ctx, lease_size=4)
+    owner = f"{socket.gethostname()}-{_dead_pid()}"
+    with open(os.path.join(state.lease_dir, f"{owner}.json"), "w") as fp:
+        json.dump({"host": socket.gethostname(), "pid": int(owner.rsplit("-", 1)[1]),
+                   "start": 0x2000, "end": 0x2004}, fp)
+    # 0x2000 was journaled, 0x2001 reached newcerts only, the rest were never used
+    journaled, unjournaled = make_cert(0x2000, "journaled"), make_cert(0x2001, "unjournaled")
+    with open(os.path.join(state.journal_dir, f"{owner}.log"), "w") as fp:
+        fp.write(f"V\t{journaled.not_valid_after_utc:%y%m%d%H%M%SZ}\t\t{serial_to_hex(0x2000)}"
+                 f"\tunknown\t{name_oneline(journaled.subject)}\n")
+    with open(os.path.join(ctx.new_certs_dir, f"{serial_to_hex(0x2001)}.pem"), "wb") as fp:
+        fp.write(unjournaled.public_bytes(serialization.Encoding.PEM))
+
+    recovered = CAState(ctx, lease_size=4)
+    index = read_index(ctx.database)
+    assert sorted(index) == [0x2000, 0x2001]
+    assert index[0x2001].subject == "/CN=unjournaled"
+    assert json.load(open(recovered.free_file)) == [[0x2002, 0x2004]]
+    assert os.listdir(recovered.lease_dir) == []
+    assert recovered.stats()["restored"] == 1
+    assert recovered.stats()["reclaimed"] == 2
+    assert recovered.next_serial() == 0x2002
+
+
+def test_claim_subject_refuses_journaled_duplicates(tmp_path, make_cert):
+    ctx = FakeCA(str(tmp_path), unique_subject=True)
+    state = CAState(ctx, lease_size=4)
+    with state.claim_subject("/CN=device"):
+        state.record(make_cert(state.next_serial(), "device"))
+    with pytest.raises(ValueError):
+        with state.claim_subject("/CN=device"):
+            pass
+    with state.claim_subject("/CN=other"):
+        pass
+
+    ctx.unique_subject = False
+    with state.claim_subject("/CN=device"):
+        pass
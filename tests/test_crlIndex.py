@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+
+from crlIndex import CRLIndex, NO_REASON, der_tlv, iter_revoked
+
+NOW = datetime.datetime(2026, 1, 15, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+def _crl(ca_key, revoked, crl_number=7, delta_of=None):
+    """DER CRL with `revoked` = [(serial, revocation date, ReasonFlags or None)]."""
+    builder = (
+        x509.CertificateRevocationListBuilder()
+        .issuer_name(x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "Test CA")]))
+        .last_update(NOW)
+        .next_update(NOW + datetime.timedelta(days=7))
+        .add_extension(x509.CRLNumber(crl_number), critical=False)
+    )
+    if delta_of is not None:
+        builder = builder.add_extension(x509.DeltaCRLIndicator(delta_of), critical=True)
+    for serial, when, reason in revoked:
+        entry = x509.RevokedCertificateBuilder().serial_number(serial).revocation_date(when)
+        if reason is not None:
+            entry = entry.add_extension(x509.CRLReason(reason), critical=False)
+        builder = builder.add_revoked_certificate(entry.build())
+    crl = builder.sign(ca_key, hashes.SHA256())
+    return crl.public_bytes(serialization.Encoding.DER), crl
+
+
+@pytest.fixture
+def revoked():
+    return [
+        (0x1003, NOW - datetime.timedelta(days=1), x509.ReasonFlags.key_compromise),
+        (0x1001, NOW - datetime.timedelta(days=3), None),
+        (0x80FF00112233445566778899AABBCCDD, NOW - datetime.timedelta(days=2), x509.ReasonFlags.superseded),
+        (0x1002, datetime.datetime(2051, 1, 1, tzinfo=datetime.timezone.utc), x509.ReasonFlags.certificate_hold),
+    ]
+
+
+def test_der_tlv_short_and_long_lengths():
+    assert der_tlv(b"\x02\x01\x05", 0) == (0x02, 2, 3)
+    data = b"\x04\x82\x01\x00" + bytes(256)
+    assert der_tlv(data, 0) == (0x04, 4, 260)
+    with pytest.raises(ValueError):
+        der_tlv(data[:100], 0)
+
+
+def test_iter_revoked_matches_the_encoded_entries(ca_key, revoked):
+    der, _ = _crl(ca_key, revoked)
+    codes = {x509.ReasonFlags.key_compromise: 1, x509.ReasonFlags.superseded: 4,
+             x509.ReasonFlags.certificate_hold: 6, None: NO_REASON}
+    assert sorted(iter_revoked(der)) == sorted(
+        (serial, int(when.timestamp()), codes[reason]) for serial, when, reason in revoked
+    )
+
+
+def test_iter_revoked_empty_crl(ca_key):
+    der, _ = _crl(ca_key, [])
+    assert list(iter_revoked(der)) == []
+
+
+def test_query_by_serial_and_page(ca_key, revoked):
+    der, crl = _crl(ca_key, revoked)
+    index = CRLIndex(der, crl)
+    assert len(index) == 4
+    assert index.header["crl_number"] == 7
+    assert index.header["issuer"] == "CN=Test CA"
+
+    result = index.query(serial=0x1003)
+    assert result["total"] == 1
+    assert result["items"] == [{"serial": "1003", "revoked_at": "2026-01-14T12:00:00+00:00",
+                                "reason": "keyCompromise"}]
+    assert index.query(serial=0x1004)["items"] == []
+
+    page = index.query(page=2, per_page=3)
+    assert page["total"] == 4
+    assert [item["serial"] for item in page["items"]] == ["80FF00112233445566778899AABBCCDD"]
+    assert index.query(serial=0x1001)["items"][0]["reason"] is None
+
+
+def test_query_by_revocation_date(ca_key, revoked):
+    der, crl = _crl(ca_key, revoked)
+    index = CRLIndex(der, crl)
+    result = index.query(revoked_after=NOW - datetime.timedelta(days=3), revoked_before=NOW)
+    assert result["total"] == 3
+    assert [item["serial"] for item in result["items"]] == ["1001", "80FF00112233445566778899AABBCCDD", "1003"]
+    assert [item["serial"] for item in index.query(revoked_after=NOW)["items"]] == ["1002"]
+
+
+def test_delta_crl_header(ca_key, revoked):
+    der, crl = _crl(ca_key, revoked[:1], crl_number=9, delta_of=8)
+    index = CRLIndex(der, crl)
+    assert index.header["crl_number"] == 9
+    assert index.header["base_crl_number"] == 8
+    assert index.query()["total"] == 1
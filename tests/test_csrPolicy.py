@@ -0,0 +1,158 @@
+import ipaddress
+import threading
+
+import pytest
+from cryptography import x509
+from cryptography.x509.oid import NameOID
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+from csrPolicy import CSRRejected, CSRValidator, IssuedCache
+
+
+def _csr(key=None, common_name="device.example.com", san=None, encoding=serialization.Encoding.PEM):
+    key = key or ed25519.Ed25519PrivateKey.generate()
+    builder = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)]))
+    if san is not None:
+        builder = builder.add_extension(x509.SubjectAlternativeName(san), critical=False)
+    algorithm = None if isinstance(key, ed25519.Ed25519PrivateKey) else hashes.SHA256()
+    return builder.sign(key, algorithm).public_bytes(encoding)
+
+
+class FakeCA:
+    """Subject policy of a CA that requires a .example.com common name."""
+
+    def build_subject(self, csr):
+        common_name = csr.subject.get_attributes_for_oid(NameOID.COMMON_NAME)[0].value
+        if not common_name.endswith(".example.com"):
+            raise ValueError(f"commonName {common_name} is not allowed by the CA policy")
+        return csr.subject
+
+
+@pytest.fixture
+def validator():
+    return CSRValidator(openssl=None, algorithms={"tls": ["ed25519", "rsa2048"]})
+
+
+def _rejected(validator, data, chain="tls", ctx=None):
+    with pytest.raises(CSRRejected) as e:
+        validator.check(chain, data, ctx)
+    return e.value.reason
+
+
+def test_accepts_pem_and_der(validator):
+    checked = validator.check("tls", _csr(), FakeCA())
+    assert checked.algorithm == "ed25519"
+    assert len(checked.digest) == 64
+    der = _csr(encoding=serialization.Encoding.DER)
+    assert validator.check("tls", der).pem.startswith(b"-----BEGIN CERTIFICATE REQUEST-----")
+    assert validator.stats()["accepted"] == 2
+
+
+def test_rejects_malformed(validator):
+    assert _rejected(validator, b"not a csr") == "malformed"
+    assert _rejected(validator, b"-----BEGIN CERTIFICATE REQUEST-----\nAAAA\n-----END CERTIFICATE REQUEST-----\n") == "malformed"
+
+
+def test_rejects_bad_signature(validator):
+    der = bytearray(_csr(encoding=serialization.Encoding.DER))
+    der[-1] ^= 0x01
+    assert _rejected(validator, bytes(der)) == "signature"
+
+
+def test_rejects_algorithm_not_allowed_for_chain(validator):
+    assert _rejected(validator, _csr(ec.generate_private_key(ec.SECP256R1()))) == "algorithm"
+    rsa4096 = rsa.generate_private_key(public_exponent=65537, key_size=4096)
+    assert _rejected(validator, _csr(rsa4096)) == "algorithm"
+    # chains without their own list accept the default algorithms
+    assert validator.check("mpu", _csr(rsa4096)).algorithm == "rsa4096"
+
+
+def test_rejects_subject_against_ca_policy(validator):
+    assert _rejected(validator, _csr(common_name="device.other.org"), ctx=FakeCA()) == "subject"
+
+
+@pytest.mark.parametrize("san", [
+    [x509.DNSName("bad_name.example.com")],
+    [x509.DNSName("-leading.example.com")],
+    [x509.DNSName("*.example.com")],
+    [x509.UniformResourceIdentifier("https://example.com/")],
+    [x509.DNSName(f"host{i}.example.com") for i in range(17)],
+])
+def test_rejects_san(validator, san):
+    assert _rejected(validator, _csr(san=san)) == "san"
+
+
+def test_accepts_ip_and_wildcard_san_when_allowed():
+    validator = CSRValidator(openssl=None, allow_wildcards=True)
+    san = [x509.DNSName("*.example.com"), x509.IPAddress(ipaddress.ip_address("192.0.2.1"))]
+    assert validator.check("tls", _csr(san=san)).algorithm == "ed25519"
+
+
+def test_rejections_are_counted_by_reason(validator):
+    _rejected(validator, b"junk")
+    _rejected(validator, _csr(san=[x509.DNSName("a..b")]))
+    stats = validator.stats()
+    assert (stats["malformed"], stats["san"], stats["accepted"]) == (1, 1, 0)
+
+
+# -- IssuedCache ----------------------------------------------------------------
+def _signer(make_cert, serials):
+    def sign():
+        return make_cert(next(serials)).public_bytes(serialization.Encoding.PEM)
+    return sign
+
+
+def test_issued_cache_replays_and_evicts_oldest(make_cert):
+    cache = IssuedCache(ttl=600, max_entries=2)
+    sign = _signer(make_cert, iter(range(1, 100)))
+    first, replayed = cache.issue("a", sign)
+    assert not replayed
+    assert cache.issue("a", sign) == (first, True)
+    cache.issue("b", sign)
+    cache.issue("c", sign)
+    stats = cache.stats()
+    assert (stats["entries"], stats["evicted"], stats["replayed"]) == (2, 1, 1)
+    # "a" was evicted, so it is signed again
+    again, replayed = cache.issue("a", sign)
+    assert not replayed and again != first
+
+
+def test_issued_cache_expiry_and_discard(make_cert):
+    cache = IssuedCache(ttl=0)
+    sign = _signer(make_cert, iter(range(1, 100)))
+    cache.issue("a", sign)
+    assert cache.issue("a", sign)[1] is False
+    assert cache.stats()["expired"] == 1
+
+    cache = IssuedCache(ttl=600)
+    pem, _ = cache.issue("a", sign)
+    cache.discard_serial(x509.load_pem_x509_certificate(pem).serial_number)
+    assert cache.stats()["discarded"] == 1
+    assert cache.issue("a", sign)[1] is False
+
+
+def test_issued_cache_signs_concurrent_duplicates_once(make_cert):
+    cache = IssuedCache()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_sign():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return make_cert(len(calls)).public_bytes(serialization.Encoding.PEM)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.issue("a", slow_sign))) for _ in range(3)]
+    threads[0].start()
+    started.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert sorted(replayed for _, replayed in results) == [False, True, True]
+    assert len({pem for pem, _ in results}) == 1